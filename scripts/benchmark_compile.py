@@ -0,0 +1,91 @@
+import os
+import sys
+import time
+import argparse
+import logging
+import torch
+from hgan.configuration import load_config
+from hgan.experiment import Experiment
+from hgan.utils import setup_reproducibility
+
+logger = logging.getLogger(__name__)
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Compare step latency with and without a compiled rnn rollout"
+    )
+    parser.add_argument(
+        "--config-path",
+        type=str,
+        default=os.path.join(
+            os.path.dirname(__file__), "../src/hgan/configuration.ini"
+        ),
+        help="Path to configuration.ini specifying experiment parameters",
+    )
+    parser.add_argument(
+        "--mode",
+        type=str,
+        default="default",
+        help="torch.compile mode for the compiled run (e.g. default/reduce-overhead)",
+    )
+    parser.add_argument("--steps", type=int, default=20, help="Timed steps")
+    parser.add_argument(
+        "--warmup", type=int, default=3, help="Untimed steps (incl. compilation)"
+    )
+
+    return parser
+
+
+def synchronize(device):
+    if str(device).startswith("cuda"):
+        torch.cuda.synchronize(device)
+
+
+def time_steps(experiment, step, warmup, steps):
+    for _ in range(warmup):
+        step()
+    synchronize(experiment.device)
+    start = time.perf_counter()
+    for _ in range(steps):
+        step()
+    synchronize(experiment.device)
+    return (time.perf_counter() - start) / steps * 1000
+
+
+def main(*args):
+
+    args = get_parser().parse_args(args)
+    config = load_config(args.config_path)
+
+    for compile_rnn in (None, args.mode):
+        config.experiment.compile_rnn = compile_rnn
+        setup_reproducibility(config.experiment.seed)
+        experiment = Experiment(config)
+
+        real_data = experiment.get_real_data()
+
+        def rollout():
+            # The latent rollout by the rnn, forward and backward
+            z, dz, _ = experiment.get_latent_sample(
+                batch_size=experiment.batch_size,
+                n_frames=config.video.generator_frames,
+                label_and_props=real_data["label_and_props"],
+            )
+            loss = z.sum() if dz is None else z.sum() + dz.sum()
+            loss.backward()
+
+        rollout_ms = time_steps(experiment, rollout, args.warmup, args.steps)
+        train_step_ms = time_steps(
+            experiment, experiment.train_step, args.warmup, args.steps
+        )
+        experiment.close()
+
+        print(
+            f"compile_rnn={compile_rnn}: rnn rollout {rollout_ms:.1f} ms, "
+            f"train_step {train_step_ms:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,80 @@
+import sys
+import time
+import argparse
+import numpy as np
+import scipy
+from hgan.fvd import trace_sqrt_product, trace_sqrt_product_torch
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Compare implementations of the matrix square root step of FVD"
+    )
+    parser.add_argument(
+        "--n-features", type=int, default=400, help="Size of the covariance matrices"
+    )
+    parser.add_argument(
+        "--n-samples", type=int, default=2048, help="Samples per covariance matrix"
+    )
+    parser.add_argument("--repeats", type=int, default=10, help="Timed repeats")
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cpu",
+        help="Device for the torch implementation (e.g. cpu/cuda:0)",
+    )
+
+    return parser
+
+
+def svd_trace_sqrt_product(sigma, sigma_v, eps=1e-10):
+    # The previous implementation, with two full SVDs
+    def sqrtm(mat):
+        u, s, vT = scipy.linalg.svd(mat)
+        si = np.where(s < eps, s, np.sqrt(s))
+        return np.matmul(np.matmul(u, np.diag(si)), vT)
+
+    sqrt_sigma = sqrtm(sigma)
+    sqrt_a_sigmav_a = np.matmul(sqrt_sigma, np.matmul(sigma_v, sqrt_sigma))
+    return np.trace(sqrtm(sqrt_a_sigmav_a))
+
+
+def covariance(n_samples, n_features, rng):
+    x = rng.normal(size=(n_samples, n_features)) @ rng.normal(
+        size=(n_features, n_features)
+    )
+    return np.cov(x, rowvar=False)
+
+
+def main(*args):
+
+    args = get_parser().parse_args(args)
+    rng = np.random.default_rng(0)
+    sigma = covariance(args.n_samples, args.n_features, rng)
+    sigma_v = covariance(args.n_samples, args.n_features, rng)
+
+    implementations = {
+        "svd (previous)": svd_trace_sqrt_product,
+        "eigh": trace_sqrt_product,
+        f"torch ({args.device})": lambda sigma, sigma_v: trace_sqrt_product_torch(
+            sigma, sigma_v, device=args.device
+        ),
+    }
+
+    expected = None
+    for name, implementation in implementations.items():
+        value = implementation(sigma, sigma_v)  # warmup
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            implementation(sigma, sigma_v)
+        elapsed_ms = (time.perf_counter() - start) / args.repeats * 1000
+
+        expected = value if expected is None else expected
+        print(
+            f"{name}: {elapsed_ms:.1f} ms, trace = {value:.6f} "
+            f"(relative difference {abs(value - expected) / abs(expected):.1e})"
+        )
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -9,6 +9,7 @@ import hgan
 from hgan.demo import main as demo
 from hgan.run import main as run
 from hgan.eval import main as eval
+from hgan.pack import main as pack
 from hgan.hgn.train import main as hgn
 from hgan.configuration import show_config
 
@@ -16,6 +17,7 @@ commands = {
     "demo": demo,
     "run": run,
     "eval": eval,
+    "pack": pack,
     "show-config": show_config,
     "hgn": hgn,
 }
@@ -0,0 +1,107 @@
+import os
+import re
+import glob
+import logging
+import torch
+from hgan.utils import BackgroundWorker
+
+logger = logging.getLogger(__name__)
+
+
+def checkpoint_path(folder, epoch):
+    return os.path.join(folder, f"checkpoint_{epoch:0>6}.pth")
+
+
+def saved_checkpoints(folder):
+    """Sorted epochs for which a (consolidated) checkpoint exists in a folder."""
+    epochs = []
+    for path in glob.glob(os.path.join(folder, "checkpoint_*.pth")):
+        match = re.fullmatch(r"checkpoint_(\d+)\.pth", os.path.basename(path))
+        if match is not None:
+            epochs.append(int(match.group(1)))
+    return sorted(epochs)
+
+
+def load_checkpoint(folder, epoch, map_location=None):
+    """A dict of state dicts, keyed by name, as saved by CheckpointWriter."""
+    return torch.load(checkpoint_path(folder, epoch), map_location=map_location)
+
+
+def to_cpu(obj):
+    """A copy of a (nested) state dict, with all tensors copied to cpu memory."""
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, to_cpu(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(v) for v in obj)
+    return obj
+
+
+class CheckpointWriter:
+    """
+    Writes one checkpoint file per epoch (a dict of state dicts), in the background.
+
+    State dicts are snapshot to cpu memory when saving, so that training can carry on
+    modifying the models while the checkpoint is being written. Files are written
+    under a temporary name and atomically renamed, so that a checkpoint on disk is
+    always complete. After each write, older checkpoints are removed except for the
+    last <keep_last> ones, and those of every <keep_every> epochs.
+    """
+
+    def __init__(self, folder, keep_last=None, keep_every=None, background=True):
+        """
+        Parameters
+        ----------
+        folder : str
+            Folder to write checkpoints to.
+        keep_last : int or None
+            Number of most recent checkpoints to keep. None keeps all checkpoints.
+        keep_every : int or None
+            Checkpoints of epochs that are a multiple of this are always kept.
+        background : bool
+            Whether to write checkpoints on a background thread.
+        """
+        assert keep_last is None or keep_last >= 1, "keep_last must be None or >= 1"
+        self.folder = folder
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self._worker = BackgroundWorker(name="CheckpointWriter") if background else None
+
+    def save(self, epoch, state_dicts):
+        snapshot = to_cpu(state_dicts)
+        if self._worker is None:
+            self._write(epoch, snapshot)
+        else:
+            self._worker.submit(self._write, epoch, snapshot)
+
+    def _write(self, epoch, state_dicts):
+        os.makedirs(self.folder, exist_ok=True)
+        path = checkpoint_path(self.folder, epoch)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            torch.save(state_dicts, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._apply_retention()
+
+    def _apply_retention(self):
+        if self.keep_last is None:
+            return
+        epochs = saved_checkpoints(self.folder)
+        for epoch in epochs[: -self.keep_last]:
+            if self.keep_every is not None and epoch % self.keep_every == 0:
+                continue
+            logger.debug(f"Removing checkpoint of epoch {epoch}")
+            os.remove(checkpoint_path(self.folder, epoch))
+
+    def wait(self):
+        """Wait for all pending checkpoints to be written."""
+        if self._worker is not None:
+            self._worker.wait()
+
+    def close(self):
+        if self._worker is not None:
+            self._worker.close()
+            self._worker = None
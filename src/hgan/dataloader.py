@@ -0,0 +1,99 @@
+import queue
+import threading
+
+
+class _ExceptionWrapper:
+    """Carries an exception raised in the producer thread over to the consumer."""
+
+    def __init__(self, exc):
+        self.exc = exc
+
+
+class BatchStream:
+    """
+    An endless stream of batches drawn from a DataLoader.
+
+    A single long-lived iterator is kept over the DataLoader, and is transparently
+    restarted whenever the DataLoader is exhausted. If prefetch > 0, a background
+    thread keeps up to <prefetch> batches ready in a queue, so that asking for the
+    next batch costs nothing more than a queue lookup.
+    """
+
+    def __init__(self, dataloader, prefetch=2):
+        """
+        Parameters
+        ----------
+        dataloader : torch.utils.data.DataLoader
+            DataLoader to draw batches from.
+        prefetch : int
+            Number of batches to keep ready in the background.
+            0 disables the background thread; batches are then produced on demand.
+        """
+        self.dataloader = dataloader
+        self.prefetch = prefetch
+
+        self._iterator = None
+        self._queue = None
+        self._thread = None
+        self._stop = threading.Event()
+
+        if prefetch > 0:
+            self._queue = queue.Queue(maxsize=prefetch)
+            self._thread = threading.Thread(target=self._produce, daemon=True)
+            self._thread.start()
+
+    def _next_batch(self):
+        if self._iterator is None:
+            self._iterator = iter(self.dataloader)
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            # Start a new pass over the DataLoader. Any persistent workers are reused.
+            self._iterator = iter(self.dataloader)
+            return next(self._iterator)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        while not self._stop.is_set():
+            try:
+                item = self._next_batch()
+            except Exception as e:
+                self._put(_ExceptionWrapper(e))
+                return
+            if not self._put(item):
+                return
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._thread is None:
+            return self._next_batch()
+
+        while True:
+            try:
+                item = self._queue.get(timeout=0.1)
+                break
+            except queue.Empty:
+                if not self._thread.is_alive():
+                    raise RuntimeError("Batch producer thread has stopped")
+
+        if isinstance(item, _ExceptionWrapper):
+            raise item.exc
+        return item
+
+    def close(self):
+        """Stop the background thread (if any) and release the DataLoader iterator."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._iterator = None
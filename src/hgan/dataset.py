@@ -1,5 +1,10 @@
 import os
 import glob
+import json
+import hashlib
+import logging
+import multiprocessing
+import time
 import skvideo.io
 from skimage.transform import resize
 import numpy as np
@@ -15,7 +20,13 @@ from hgan.hgn_datasets import (
     constant_physics_hgn,
     variable_physics_hgn,
 )
-from hgan.hgn.environments.environment_factory import EnvFactory
+from hgan.hgn.environments.environment_factory import (
+    EnvFactory,
+    IntegrationBudgetExceeded,
+)
+from hgan.hgn.environments.rendering import render_balls_torch
+
+logger = logging.getLogger(__name__)
 
 
 class AviDataset(Dataset):
@@ -134,6 +145,116 @@ class ToyPhysicsDatasetNPZ(Dataset):
         return vid.astype(np.float32), torch.tensor([])
 
 
+def pack_npz_videos(input_folder, output_folder, img_size=None):
+    """
+    Pack the videos of a folder of <index>.npz files (with values in [0, 1], of shape
+    (n_frames, img_size, img_size, nc)) into a single uint8 array of shape
+    (n_videos, n_frames, img_size, img_size, nc), saved as videos.npy, along with a
+    metadata.json file. Videos are resized to img_size first, if given.
+    """
+    files = sorted(
+        glob.glob(os.path.join(input_folder, "*.npz")),
+        key=lambda f: int(os.path.splitext(os.path.basename(f))[0]),
+    )
+    assert files, f"No videos found in {input_folder}"
+
+    videos = None
+    for i, file in enumerate(files):
+        vid = np.load(file)["arr_0"]
+        n_frames, _img_size, _, nc = vid.shape
+        if img_size is not None and _img_size != img_size:
+            vid = np.asarray([resize(img, (img_size, img_size, nc)) for img in vid])
+
+        if videos is None:
+            os.makedirs(output_folder, exist_ok=True)
+            videos = np.lib.format.open_memmap(
+                os.path.join(output_folder, "videos.npy"),
+                mode="w+",
+                dtype=np.uint8,
+                shape=(len(files), *vid.shape),
+            )
+        videos[i] = np.round(np.clip(vid, 0, 1) * 255)
+
+    videos.flush()
+    metadata = {
+        "n_videos": videos.shape[0],
+        "n_frames": videos.shape[1],
+        "img_size": videos.shape[2],
+        "n_channels": videos.shape[4],
+        "scale": 255,
+    }
+    with open(os.path.join(output_folder, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+
+    return metadata
+
+
+class PackedVideoDataset(Dataset):
+    """
+    Videos packed by pack_npz_videos, read through a memory map, so that each
+    sample is a window sliced out of the packed array.
+    """
+
+    def __init__(self, *, datapath, num_frames, delta=1, train=True):
+        train_test = "train" if train else "test"
+        self.num_frames = num_frames
+        self.delta = delta
+        self.datapath = os.path.join(datapath, train_test)
+        with open(os.path.join(self.datapath, "metadata.json")) as f:
+            self.metadata = json.load(f)
+        # Opened lazily, in each DataLoader worker
+        self._videos = None
+
+    @staticmethod
+    def is_packed(datapath, train=True):
+        train_test = "train" if train else "test"
+        return os.path.exists(os.path.join(datapath, train_test, "metadata.json"))
+
+    @property
+    def videos(self):
+        if self._videos is None:
+            self._videos = np.load(
+                os.path.join(self.datapath, "videos.npy"), mmap_mode="r"
+            )
+        return self._videos
+
+    def __getstate__(self):
+        # The memory map is not pickled along with the dataset
+        return {**self.__dict__, "_videos": None}
+
+    def __len__(self):
+        return self.metadata["n_videos"]
+
+    def __getitem__(self, idx):
+        n_frames = len(range(0, self.metadata["n_frames"], self.delta))  # orig dt 0.05
+
+        start = np.random.randint(0, n_frames - (self.num_frames + 1))
+        end = start + self.num_frames
+        vid = self.videos[idx, start * self.delta : end * self.delta : self.delta]
+
+        img_size = self.metadata["img_size"]
+        if img_size != config.experiment.img_size:
+            nc = self.metadata["n_channels"]
+            vid = np.asarray(
+                [
+                    resize(
+                        img,
+                        (config.experiment.img_size, config.experiment.img_size, nc),
+                        preserve_range=True,
+                    )
+                    for img in vid
+                ]
+            )
+
+        # transpose each video to (nc, n_frames, img_size, img_size), and divide by 255
+        vid = vid.transpose(3, 0, 1, 2).astype(np.float32) / self.metadata["scale"]
+
+        if config.video.normalize:
+            vid = (vid - 0.5) / 0.5
+
+        return vid, torch.tensor([])
+
+
 class RealtimeDataset(Dataset):
     def __init__(
         self,
@@ -180,6 +301,7 @@ class RealtimeDataset(Dataset):
         self.img_size = img_size
         self.normalize = normalize
 
+        self.systems = {}  # dm system objects, keyed by system
         self.generate_fn = {}  # Generate functions, keyed by system
         self.features = {}  # Fixed features across all trajectories, keyed by system
 
@@ -209,6 +331,7 @@ class RealtimeDataset(Dataset):
                 steps_per_dt=1,
             )
 
+            self.systems[system_name] = obj
             self.generate_fn[system_name] = f
             self.features[system_name] = f(0)["other"]
 
@@ -240,15 +363,8 @@ class RealtimeDataset(Dataset):
 
         return props
 
-    def __getitem__(self, item):
-        system_name_index = np.random.choice(len(self.system_names))
-        system_name = self.system_names[system_name_index]
-
-        data = self.generate_fn[system_name](item)  # num_steps + 1, L, L, num_channels
-        image = data["image"]
-        # assert isinstance(image, jax.numpy.ndarray)
-        # assert image.dtype == np.uint8
-
+    def _process_video(self, image):
+        # image: (n_frames, img_size, img_size, nc) uint8 -> (nc, num_frames, H, W)
         vid = np.array(image / 255)
         n_frames, img_size, _, nc = vid.shape
 
@@ -277,11 +393,349 @@ class RealtimeDataset(Dataset):
         if self.normalize:
             vid = (vid - 0.5) / 0.5
 
+        return vid.astype(np.float32)
+
+    def _get_batch(self, items):
+        """
+        Generate a whole batch of videos of a single, randomly chosen, system with one
+        `generate_and_render_dt` call, instead of one call per video. Used when `items`
+        is a list of indices, as yielded by a `BatchSampler`.
+
+        Every call generates len(items) trajectories, so that JAX only traces the
+        generation once per system, rather than for every number of videos of a system
+        that a mixed batch can hold.
+        """
+        system_name_index = np.random.choice(len(self.system_names))
+        data = generate_batch(
+            items[0],
+            system=self.systems[self.system_names[system_name_index]],
+            num_trajectories=len(items),
+            dt=0.05,  # Blanchette 2021
+            num_steps=self.total_frames - 1,
+        )
+        videos = [self._process_video(image) for image in data["image"]]
+        props = [
+            self._physics_vector_from_data(
+                {"other": {k: v[j] for k, v in data["other"].items()}}
+            )
+            for j in range(len(items))
+        ]
+
+        return (
+            torch.from_numpy(np.stack(videos)),
+            torch.full((len(items),), system_name_index, dtype=torch.int64),
+            torch.from_numpy(np.stack(props)),
+        )
+
+    def __getitem__(self, item):
+        if isinstance(item, (list, tuple, np.ndarray)):
+            return self._get_batch(list(item))
+
+        system_name_index = np.random.choice(len(self.system_names))
+        system_name = self.system_names[system_name_index]
+
+        data = self.generate_fn[system_name](item)  # num_steps + 1, L, L, num_channels
+        vid = self._process_video(data["image"])
         props = self._physics_vector_from_data(data)
-        return vid.astype(np.float32), system_name_index, props
+        return vid, system_name_index, props
+
+
+def generate_batch(index, system, num_trajectories, dt, num_steps):
+    """
+    Simulate `num_trajectories` trajectories of a dm system in a single call.
+    The batched counterpart of `datasets.generate_sample`; every array in the
+    returned dict has a leading batch dimension.
+    """
+    seed = np.random.randint(0, 2**31 - 1)
+    prng_key = jax.random.fold_in(jax.random.PRNGKey(seed), index)
+    result = system.generate_and_render_dt(
+        num_trajectories=num_trajectories,
+        rng_key=prng_key,
+        t0=0.0,
+        dt=dt,
+        num_steps=num_steps,
+    )
+
+    def to_numpy(x):
+        x = np.asarray(x)
+        if x.ndim == 0:
+            x = np.broadcast_to(x, (num_trajectories,))
+        return x
+
+    result = jax.tree_util.tree_map(to_numpy, result)
+    result["image"] = (result["image"] * 255.0).astype("uint8")
+    return result
+
+
+def sample_system_args(system_physics):
+    """Sample the arguments of a system from their ranges (BoxRegions)"""
+    return {
+        k: (v() if not isinstance(v, list) else [_v() for _v in v])
+        for k, v in system_physics.items()
+    }
+
+
+def _generate_hgn_rollouts(
+    seed,
+    n_rollouts,
+    system_names,
+    physics,
+    total_frames,
+    delta,
+    integrator,
+    environment_kwargs,
+):
+    # Generate a chunk of HGNRolloutCache rollouts (in a worker process)
+    np.random.seed(seed)
+    system_indices, system_args, rollouts = [], [], []
+    for _ in range(n_rollouts):
+        system_index = np.random.choice(len(system_names))
+        args = sample_system_args(physics[system_names[system_index]])
+        system = EnvFactory.get_environment(
+            HGNRealtimeDataset.SYSTEM_NAME_MAPPING[system_names[system_index]],
+            **args,
+            **environment_kwargs[system_names[system_index]],
+        )
+        rollout = system.sample_random_states(
+            number_of_frames=total_frames,
+            delta_time=delta,
+            number_of_rollouts=1,
+            radius_bound="auto",
+            integrator=integrator[system_names[system_index]],
+        )[0]
+        system_indices.append(system_index)
+        system_args.append(args)
+        rollouts.append(rollout.astype(np.float32))
+    return system_indices, system_args, rollouts
+
+
+class HGNRolloutCache:
+    """
+    A pool of noise-free (phase space) rollouts of the realtime hgn systems.
+
+    The pool is generated once (in parallel) and cached on disk, in a file keyed by
+    the systems and their physics ranges, the number of frames, time step, integrator,
+    other environment arguments, image size, size of the pool and seed. Observation noise, ball colors and the
+    window of frames are sampled anew each time a rollout is used.
+    """
+
+    def __init__(
+        self,
+        folder,
+        *,
+        system_names,
+        physics,
+        total_frames,
+        delta,
+        integrator,
+        img_size,
+        environment_kwargs=None,
+        size=10_000,
+        seed=0,
+        n_workers=None,
+    ):
+        """
+        Parameters
+        ----------
+        folder : str
+            Folder where pools of rollouts are cached.
+        system_names : list of str
+            Systems (keys of all_systems_hgn) to sample rollouts of, uniformly.
+        physics : dict
+            Dict of system arguments (BoxRegion or list of BoxRegion), keyed by system.
+        total_frames : int
+            Number of frames of each rollout.
+        delta : float
+            Time between frames.
+        integrator : dict
+            Integrator to use (see Environment.sample_random_rollouts), keyed by system.
+        environment_kwargs : dict or None
+            Arguments of the environments besides their physics (e.g. min_separation of
+            NObjectGravity), keyed by system.
+        img_size : int
+            Size of the frames the rollouts are rendered to.
+        size : int
+            Number of rollouts in the pool.
+        seed : int
+            Seed used to generate the pool.
+        n_workers : int or None
+            Number of processes to generate the pool with (default: no. of cpus).
+        """
+        self.system_names = list(system_names)
+        if environment_kwargs is None:
+            environment_kwargs = {k: {} for k in self.system_names}
+        key = {
+            "systems": self.system_names,
+            "physics": {k: repr(physics[k]) for k in self.system_names},
+            "total_frames": total_frames,
+            "delta": delta,
+            "integrator": integrator,
+            "environment_kwargs": environment_kwargs,
+            "img_size": img_size,
+            "size": size,
+            "seed": seed,
+        }
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        self.path = os.path.join(folder, f"hgn_rollouts_{digest[:16]}.npz")
+
+        if not os.path.exists(self.path):
+            logger.info(f"Generating {size} rollouts for {self.path}")
+            self._generate(
+                key,
+                physics,
+                total_frames,
+                delta,
+                integrator,
+                environment_kwargs,
+                size,
+                seed,
+                n_workers,
+            )
+
+        with np.load(self.path) as data:
+            self.system_indices = data["system_indices"]
+            self.state_sizes = data["state_sizes"]
+            self.rollouts = data["rollouts"]
+            self.system_args = json.loads(str(data["system_args"]))
+
+    def _generate(
+        self,
+        key,
+        physics,
+        total_frames,
+        delta,
+        integrator,
+        environment_kwargs,
+        size,
+        seed,
+        n_workers,
+    ):
+        n_workers = n_workers or os.cpu_count()
+        n_chunks = min(size, 4 * n_workers)
+        chunk_sizes = [len(c) for c in np.array_split(np.arange(size), n_chunks)]
+        jobs = [
+            (
+                seed * n_chunks + i,
+                chunk_size,
+                self.system_names,
+                physics,
+                total_frames,
+                delta,
+                integrator,
+                environment_kwargs,
+            )
+            for i, chunk_size in enumerate(chunk_sizes)
+        ]
+        with multiprocessing.Pool(n_workers) as pool:
+            chunks = pool.starmap(_generate_hgn_rollouts, jobs)
+
+        system_indices = np.concatenate([c[0] for c in chunks])
+        system_args = [args for c in chunks for args in c[1]]
+        _rollouts = [rollout for c in chunks for rollout in c[2]]
+
+        # Rollouts of the different systems are padded to the same state size
+        state_sizes = np.array([len(r) for r in _rollouts])
+        rollouts = np.zeros((size, state_sizes.max(), total_frames), dtype=np.float32)
+        for i, rollout in enumerate(_rollouts):
+            rollouts[i, : len(rollout)] = rollout
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            system_indices=system_indices,
+            state_sizes=state_sizes,
+            rollouts=rollouts,
+            system_args=json.dumps(system_args),
+            key=json.dumps(key),
+        )
+        os.replace(tmp_path, self.path)
+
+    def __len__(self):
+        return len(self.rollouts)
+
+    def sample(self, num_frames):
+        """
+        A random window of num_frames frames of a random rollout in the pool.
+
+        Returns the index of its system (in system_names), the arguments of the
+        system, and the rollout, of shape (state_size, num_frames).
+        """
+        i = np.random.randint(len(self))
+        start = np.random.randint(0, self.rollouts.shape[-1] - num_frames + 1)
+        rollout = self.rollouts[i, : self.state_sizes[i], start : start + num_frames]
+        return self.system_indices[i], self.system_args[i], rollout
+
+
+class RolloutStats:
+    """
+    Counters of the rollouts generated by a realtime dataset, per system.
+
+    Counters are kept in shared memory, so that they add up across all the DataLoader
+    worker processes that the dataset is handed to.
+    """
+
+    FIELDS = ("rollouts", "retries", "rejected", "abandoned", "solve_time")
+
+    def __init__(self, system_names):
+        """
+        Parameters
+        ----------
+        system_names : list of str
+            Names of the systems to keep counters for.
+        """
+        self.system_names = list(system_names)
+        self._counters = multiprocessing.Array(
+            "d", len(self.system_names) * len(self.FIELDS)
+        )
+
+    def add(self, system_index, **counts):
+        """Add to the counters (<FIELDS> as keyword arguments) of a system."""
+        offset = system_index * len(self.FIELDS)
+        with self._counters.get_lock():
+            for field, count in counts.items():
+                self._counters[offset + self.FIELDS.index(field)] += count
+
+    def get(self, system_index):
+        """Return the counters of a system, as a dict."""
+        offset = system_index * len(self.FIELDS)
+        with self._counters.get_lock():
+            values = self._counters[offset : offset + len(self.FIELDS)]
+        return dict(zip(self.FIELDS, values))
+
+    def summary(self):
+        """Return a one-line summary of the counters of all systems with rollouts."""
+        summaries = []
+        for system_index, system_name in enumerate(self.system_names):
+            counters = self.get(system_index)
+            attempts = counters["rollouts"] + counters["abandoned"]
+            if attempts == 0:
+                continue
+            summaries.append(
+                f"{system_name}: {counters['rollouts']:.0f} rollouts,"
+                f" {counters['retries']:.0f} retries,"
+                f" {counters['rejected']:.0f} rejected,"
+                f" {counters['abandoned']:.0f} abandoned,"
+                f" {1000 * counters['solve_time'] / attempts:.2f} ms/rollout"
+            )
+        return "; ".join(summaries)
 
 
 class HGNRealtimeDataset(Dataset):
+    # Max. number of objects drawn in a rollout of any of the systems
+    MAX_OBJECTS = 3
+
+    SYSTEM_NAME_MAPPING = {
+        "mass_spring": "Spring",
+        "pendulum": "Pendulum",
+        "double_pendulum": "ChaoticPendulum",
+        "two_body": "NObjectGravity",
+        "three_body": "NObjectGravity",
+    }
+
+    # Systems with close encounters, that fixed step integrators do not resolve
+    CHAOTIC_SYSTEMS = ("double_pendulum", "three_body")
+
     def __init__(
         self,
         *,
@@ -298,6 +752,19 @@ class HGNRealtimeDataset(Dataset):
         total_frames=100,
         img_size=32,
         normalize=False,
+        integrator="rk4",
+        chaotic_integrator="solve_ivp",
+        min_separation=None,
+        render=True,
+        cache_folder=None,
+        cache_size=10_000,
+        cache_fresh=0.1,
+        cache_seed=0,
+        cache_workers=None,
+        max_attempts=None,
+        max_evaluations=None,
+        timeout=None,
+        max_abandoned=10,
     ):
 
         self.system_names = all_systems_hgn
@@ -316,6 +783,36 @@ class HGNRealtimeDataset(Dataset):
         self.ndim_color = ndim_color
         self.img_size = img_size
         self.normalize = normalize
+        # Integrator of each system; chaotic_integrator (if not None) for chaotic ones
+        self.integrators = {
+            system_name: (
+                chaotic_integrator
+                if system_name in self.CHAOTIC_SYSTEMS and chaotic_integrator
+                else integrator
+            )
+            for system_name in self.system_names
+        }
+        # Arguments of the environment of each system, besides its physics. Rollouts of
+        # gravity systems with objects closer than min_separation are sampled again.
+        self.environment_kwargs = {
+            system_name: (
+                {"min_separation": min_separation}
+                if self.SYSTEM_NAME_MAPPING[system_name] == "NObjectGravity"
+                and min_separation
+                else {}
+            )
+            for system_name in self.system_names
+        }
+        self.render = render
+
+        # Budgets for a single rollout (see Environment.sample_random_rollouts). Systems
+        # that exceed max_attempts are given up on, and new physical parameters sampled,
+        # up to max_abandoned times in a row.
+        self.max_attempts = max_attempts
+        self.max_evaluations = max_evaluations
+        self.timeout = timeout
+        self.max_abandoned = max_abandoned
+        self.stats = RolloutStats(self.system_names)
 
         assert not bool(system_friction), "No friction supported yet"
 
@@ -323,74 +820,79 @@ class HGNRealtimeDataset(Dataset):
         self.system_color_constant = system_color_constant
         self.system_friction = system_friction
 
-        self.system_name_mapping = {
-            "mass_spring": "Spring",
-            "pendulum": "Pendulum",
-            "double_pendulum": "ChaoticPendulum",
-            "two_body": "NObjectGravity",
-            "three_body": "NObjectGravity",
-        }
+        self.system_name_mapping = self.SYSTEM_NAME_MAPPING
 
         self.system_embedding = torch.nn.Embedding(self.n_systems, self.ndim_label)
 
+        # Rollouts can be drawn from a pool of rollouts cached on disk, mixed with a
+        # fraction <cache_fresh> of freshly generated ones
+        self.cache = None
+        self.cache_fresh = cache_fresh
+        if cache_folder is not None:
+            system_names = (
+                self.system_names
+                if self.system_index is None
+                else [self.system_names[self.system_index]]
+            )
+            self.cache = HGNRolloutCache(
+                cache_folder,
+                system_names=system_names,
+                physics=self._physics(),
+                total_frames=max(total_frames, num_frames),
+                delta=delta,
+                integrator={k: self.integrators[k] for k in system_names},
+                img_size=img_size,
+                environment_kwargs={
+                    k: self.environment_kwargs[k] for k in system_names
+                },
+                size=cache_size,
+                seed=cache_seed,
+                n_workers=cache_workers,
+            )
+
     def __len__(self):
         return 50_000 if self.train else 10_000  # Blanchette 2021
 
-    def __getitem__(self, item):
-        if self.system_index is None:
-            system_index = np.random.choice(self.n_systems)
-        else:
-            system_index = self.system_index
-
-        system_name = self.system_names[system_index]
-
-        system_args_which = {True: constant_physics_hgn, False: variable_physics_hgn}[
+    def _physics(self):
+        return {True: constant_physics_hgn, False: variable_physics_hgn}[
             self.system_physics_constant
-        ][system_name]
-
-        system_args = {
-            k: (v() if not isinstance(v, list) else [_v() for _v in v])
-            for k, v in system_args_which.items()
-        }
+        ]
 
-        system_name = self.system_name_mapping[system_name]
-        system = EnvFactory.get_environment(system_name, **system_args)
-        # We're not using self.total_frames here at all, since we only want self.num_frames from
-        # the rollout, and the rollouts are randomly initialized anyway.
-
-        vid = None
-        colors = None
-        # Rollouts are not guaranteed to give us self.num_frames in certain
-        # cases where solve_ivp fails - keep trying till they do.
-        while vid is None or vid.shape[0] != self.num_frames:
-            vids, colors = system.sample_random_rollouts(
-                number_of_frames=self.num_frames,
-                delta_time=self.delta,
-                number_of_rollouts=1,
-                img_size=self.img_size,
-                noise_level=0.1,
-                radius_bound="auto",
-                color=True,
-                seed=None,
-                constant_color=self.system_color_constant,
+    def __getitem__(self, item):
+        rollouts = None
+        if self.cache is not None and np.random.random() >= self.cache_fresh:
+            system_index, system_args, rollout = self.cache.sample(self.num_frames)
+            system_index = self.system_names.index(
+                self.cache.system_names[system_index]
             )
-            vid = vids[0]
+            rollouts = rollout[np.newaxis]
+        else:
+            if self.system_index is None:
+                system_index = np.random.choice(self.n_systems)
+            else:
+                system_index = self.system_index
+            # Unless rollouts are cached, we're not using self.total_frames here at all,
+            # since we only want self.num_frames from the rollout, and the rollouts are
+            # randomly initialized anyway.
+            system_args, rollouts = self._fresh_rollouts(system_index)
 
-        # transpose each video to (nc, n_frames, img_size, img_size)
-        vid = vid.transpose(3, 0, 1, 2)
+        system_name = self.system_name_mapping[self.system_names[system_index]]
+        system = EnvFactory.get_environment(system_name, **system_args)
 
-        if self.normalize:
-            vid = (vid - 0.5) / 0.5
+        if not self.render:
+            vid, colors = self._get_scene(system, rollouts)
+        else:
+            vid, colors = self._get_video(system, rollouts)
 
+        # The embedding is not trained, so we detach its output, which also allows
+        # samples to be passed between DataLoader worker processes.
         labels_and_props = torch.cat(
             (
-                self.system_embedding(torch.tensor([system_index])).squeeze(),
+                self.system_embedding(torch.tensor([system_index])).squeeze().detach(),
                 torch.tensor(system.physical_properties(vec_length=self.ndim_physics)),
             )
         )
 
-        vid = vid.astype(np.float32)
-
         color_vec = torch.zeros(self.ndim_color)
         colors = torch.tensor(np.array(colors).flatten().astype(np.float32))[
             : self.ndim_color
@@ -398,3 +900,125 @@ class HGNRealtimeDataset(Dataset):
         color_vec[: len(colors)] = colors
 
         return vid, labels_and_props, color_vec
+
+    def _fresh_rollouts(self, system_index):
+        """
+        Sample physical parameters for a system, and a rollout with them, within the
+        budgets of the dataset. If the rollout exceeds max_attempts, other physical
+        parameters are sampled, so that a single pathological sample cannot stall a
+        batch. With constant physics, the same parameters are sampled again, so a system
+        that always exceeds its budgets is given up on after max_abandoned tries.
+
+        Returns the physical parameters, and rollouts of shape (1, state_size, num_frames)
+
+        Raises IntegrationBudgetExceeded if max_abandoned physical parameters in a row
+        exceed their budgets.
+        """
+        physics = self._physics()[self.system_names[system_index]]
+        system_name = self.system_name_mapping[self.system_names[system_index]]
+        environment_kwargs = self.environment_kwargs[self.system_names[system_index]]
+        for _ in range(self.max_abandoned):
+            system_args = sample_system_args(physics)
+            system = EnvFactory.get_environment(
+                system_name, **system_args, **environment_kwargs
+            )
+            start = time.perf_counter()
+            try:
+                rollouts = system.sample_random_states(
+                    number_of_frames=self.num_frames,
+                    delta_time=self.delta,
+                    number_of_rollouts=1,
+                    radius_bound="auto",
+                    seed=None,
+                    integrator=self.integrators[self.system_names[system_index]],
+                    max_attempts=self.max_attempts,
+                    max_evaluations=self.max_evaluations,
+                    timeout=self.timeout,
+                )
+            except IntegrationBudgetExceeded:
+                rollouts = None
+            self.stats.add(
+                system_index,
+                rollouts=rollouts is not None,
+                abandoned=rollouts is None,
+                solve_time=time.perf_counter() - start,
+                **system.sampling_stats,
+            )
+            if rollouts is not None:
+                return system_args, rollouts
+
+        raise IntegrationBudgetExceeded(
+            f"No rollout of {self.system_names[system_index]} within budget, after"
+            f" sampling physical parameters {self.max_abandoned} times"
+        )
+
+    def _sample_rollouts(self, system, rollouts, render=True):
+        # Noise, colors and rendering for the given rollouts
+        return system.render_rollouts(
+            rollouts,
+            img_size=self.img_size,
+            noise_level=0.1,
+            color=True,
+            constant_color=self.system_color_constant,
+            render=render,
+        )
+
+    def _get_video(self, system, rollouts):
+        vids, colors = self._sample_rollouts(system, rollouts)
+        vid = vids[0]
+        colors = colors[0]
+
+        # transpose each video to (nc, n_frames, img_size, img_size)
+        vid = vid.transpose(3, 0, 1, 2)
+
+        if self.normalize:
+            vid = (vid - 0.5) / 0.5
+
+        return vid.astype(np.float32), colors
+
+    def _get_scene(self, system, rollouts):
+        """
+        Add noise and colors to the given rollout, without rendering it.
+
+        Returns a dict of (small) tensors with the pixel coordinates, radii and colors of
+        the objects in the rollout, padded to MAX_OBJECTS objects (with a radius of -1), that
+        can be batched together and rendered with render_scenes().
+        """
+        scene, colors = self._sample_rollouts(system, rollouts, render=False)
+        colors = colors[0]
+
+        n_objects = len(scene["radii"])
+        assert n_objects <= self.MAX_OBJECTS
+        centers = np.zeros((self.num_frames, self.MAX_OBJECTS, 2), dtype=np.int16)
+        centers[:, :n_objects] = scene["centers"][0]
+        radii = np.full(self.MAX_OBJECTS, -1)
+        radii[:n_objects] = scene["radii"]
+        ball_colors = np.zeros((self.MAX_OBJECTS, 3), dtype=np.float32)
+        ball_colors[:n_objects] = colors[:n_objects]
+
+        scene = {
+            "centers": torch.from_numpy(centers),
+            "radii": torch.from_numpy(radii),
+            "colors": torch.from_numpy(ball_colors),
+            "background": torch.tensor(scene["background"], dtype=torch.float32),
+        }
+        return scene, colors
+
+    def render_scenes(self, scenes):
+        """
+        Render a batch of scenes returned by the dataset when render=False.
+
+        Rendering happens on the device that the scene tensors are on.
+
+        Returns a tensor of videos of shape (batch_size, nc, n_frames, img_size, img_size)
+        """
+        vid = render_balls_torch(
+            scenes["centers"],
+            scenes["radii"],
+            scenes["colors"],
+            self.img_size,
+            scenes["background"],
+        )
+        if self.normalize:
+            vid = (vid - 0.5) / 0.5
+        return vid
@@ -22,6 +22,7 @@ from hgan.dm_hamiltonian_dynamics_suite.hamiltonian_systems import utils
 import jax
 import jax.numpy as jnp
 import jax.random as jnr
+import numpy as np
 from scipy import integrate
 
 Integrator = Callable[
@@ -522,30 +523,33 @@ class HamiltonianSystem(abc.ABC):
     x = jax.tree_map(lambda i, j: jnp.concatenate([i[:, None], j], axis=1),
                           y0, x)
     if within_canvas_bounds:
-      # Check for valid trajectories
+      # Check for valid trajectories, for the whole batch at once
+      def within_bounds(q, params_idx):
+        position = self.canvas_position(q, params_idx)
+        return (jnp.all(position >= self.canvas_bounds().min) &
+                jnp.all(position <= self.canvas_bounds().max))
       valid = []
-      while len(valid) < num_trajectories:
-        for idx in range(x.q.shape[0]):
-          x_idx, params_idx = jax.tree_map(lambda a, i=idx: a[i], (x, params))
-          position = self.canvas_position(x_idx.q, params_idx)
-          if (jnp.all(position >= self.canvas_bounds().min) and
-              jnp.all(position <= self.canvas_bounds().max)):
-            valid.append((x_idx, params_idx))
-        if len(valid) == num_trajectories:
+      num_valid = 0
+      while True:
+        mask = np.asarray(jax.vmap(within_bounds)(x.q, params))
+        valid.append(jax.tree_util.tree_map(lambda a, m=mask: a[m], (x, params)))
+        num_valid += int(mask.sum())
+        if num_valid >= num_trajectories:
           break
-        new_trajectories = num_trajectories - len(valid)
-        print(f"Generating {new_trajectories} new trajectories.")
+        print(f"Generating {num_trajectories - num_valid} new trajectories.")
+        # Resample a whole batch, to keep the shapes (and compiled functions)
         rng_key, key = jnr.split(rng_key)
-        params = self.sample_params(new_trajectories, rng_key, **kwargs)
+        params = self.sample_params(num_trajectories, rng_key, **kwargs)
         rng_key, key = jnr.split(rng_key)
-        y0 = self.sample_y(new_trajectories, params, key, **kwargs)
+        y0 = self.sample_y(num_trajectories, params, key, **kwargs)
         x = self.generate_trajectories_dt(y0, t0, dt, params, num_steps,
                                           **kwargs)
         x = jax.tree_map(lambda x_: jnp.swapaxes(x_, 0, 1), x)
         x = jax.tree_map(lambda i, j:  # pylint:disable=g-long-lambda
                               jnp.concatenate([i[:, None], j], axis=1), y0, x)
-      x, params = jax.tree_map(lambda *args: jnp.stack(args, axis=0),
-                                    *valid)
+      x, params = jax.tree_util.tree_map(
+          lambda *args: jnp.concatenate(args, axis=0)[:num_trajectories],
+          *valid)
 
     hamiltonian = self.hamiltonian_from_params(params, **kwargs)
     df_dt = jax.vmap(phase_space.poisson_bracket_with_q_and_p(hamiltonian),
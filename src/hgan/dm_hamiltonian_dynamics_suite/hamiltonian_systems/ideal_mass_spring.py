@@ -60,10 +60,13 @@ class IdealMassSpring(hamiltonian.TimeIndependentHamiltonianSystem):
     self.radius_range = radius_range
     self.uniform_annulus = uniform_annulus
     self.randomize_x = randomize_x
+    # Radius of the heaviest particle, which bounds the rendering boxes
+    max_radius = float(jnp.sqrt(jnp.max(m_range.max) / jnp.pi))
     render = functools.partial(utils.render_particles_trajectory,
                                canvas_limits=self.full_canvas_bounds(),
                                resolution=self.resolution,
-                               num_colors=self.num_colors)
+                               num_colors=self.num_colors,
+                               max_radius=max_radius)
     self._batch_render = jax.vmap(render)
 
   def _hamiltonian(
@@ -62,10 +62,13 @@ class NBodySystem(hamiltonian.TimeIndependentHamiltonianSystem):
     self.m_range = m_range
     self.g_range = g_range
     self.provided_canvas_bounds = provided_canvas_bounds
+    # Radius of the heaviest particle, which bounds the rendering boxes
+    max_radius = float(jnp.sqrt(jnp.max(m_range.max) / jnp.pi))
     render = functools.partial(utils.render_particles_trajectory,
                                canvas_limits=self.full_canvas_bounds(),
                                resolution=self.resolution,
-                               num_colors=self.num_colors)
+                               num_colors=self.num_colors,
+                               max_radius=max_radius)
     self._batch_render = jax.vmap(render)
 
   def _hamiltonian(
@@ -170,12 +170,19 @@ def render_particles_trajectory(
     resolution: int,
     num_colors: int,
     background_color: Tuple[float, float, float] = (0.321, 0.349, 0.368),
-    temperature: FloatArray = 80.0):
+    temperature: FloatArray = 80.0,
+    max_radius: Optional[float] = None):
   """Renders n particles in different colors for a full trajectory.
 
   NB: The default background color is not black as we have experienced issues
     when training models with black background.
 
+  The particles are composited front to back, one at a time. When `max_radius`
+  is given, the soft mask of a particle is only evaluated inside a square box
+  around it, outside of which the mask is below float32 precision, and
+  scattered into the frames. Memory then scales as O(t * resolution^2 +
+  t * box^2) instead of O(t * n * resolution^2).
+
   Args:
     particles: Array of size (t, n, 2)
       The last 2 dimensions define the x, y coordinates of each particle.
@@ -193,7 +200,11 @@ def render_particles_trajectory(
       The color for the background. Default to black.
     temperature: float
       The temperature of the sigmoid distance metric used to the center of the
-      particles.
+      particles. Must be a concrete value when `max_radius` is given.
+    max_radius: float or None
+      An upper bound of `particles_radius` (in canvas units), which sets the
+      size of the box around every particle. If None, the box is the whole
+      canvas.
 
   Returns:
     An array of size (t, resolution, resolution, 3) with the produced images.
@@ -217,33 +228,49 @@ def render_particles_trajectory(
   canvas_size = canvas_limits.max - canvas_limits.min
   canvas_size = canvas_size[0] if canvas_size.ndim == 1 else canvas_size
   particles_radius = particles_radius / canvas_size
-  images = jnp.ones([t, resolution, resolution, 3]) * background_color
 
   hues = jnp.linspace(0, 1, num=num_colors, endpoint=False)
-  colors = hues[color_indices][None, :, None, None]
-  s_channel = jnp.ones((t, n, resolution, resolution))
-  v_channel = jnp.ones((t, n, resolution, resolution))
-  h_channel = jnp.ones((t, n, resolution, resolution)) * colors
-  hsv_imgs = jnp.stack((h_channel, s_channel, v_channel), axis=-1)
-  rgb_imgs = hsv2rgb(hsv_imgs)
-  images = [img[:, 0] for img in jnp.split(rgb_imgs, n, axis=1)] + [images]
+  colors = hsv2rgb(jnp.stack(
+      (hues[color_indices], jnp.ones([n]), jnp.ones([n])), axis=-1))
 
+  if max_radius is None:
+    box_size = resolution
+  else:
+    # Distance from the border of a particle at which its mask vanishes
+    margin = np.log(1.0 / np.finfo(np.float32).eps) / float(temperature)
+    max_radius = max_radius / np.min(
+        np.asarray(canvas_limits.max) - np.asarray(canvas_limits.min))
+    half_size = int(np.ceil((max_radius + margin) * (resolution - 1))) + 1
+    box_size = min(2 * half_size + 1, resolution)
+  # Top left corner of the box of every particle, kept inside the canvas
+  pixels = jnp.round(particles * (resolution - 1)).astype(jnp.int32)
+  corners = jnp.clip(pixels - box_size // 2, 0, resolution - box_size)
   grid = jnp.linspace(0.0, 1.0, resolution)
-  dx, dy = jnp.meshgrid(grid, grid)
-  dx, dy = dx[None, None], dy[None, None]
-  x, y = particles[..., 0][..., None, None], particles[..., 1][..., None, None]
-  d = jnp.sqrt((x - dx) ** 2 + (y - dy) ** 2)
-  particles_radius = particles_radius[..., None, None]
-  mask = 1.0 / (1.0 + jnp.exp((d - particles_radius) * temperature))
-  masks = ([m[:, 0, ..., None] for m in jnp.split(mask, n, axis=1)] +
-           [jnp.ones_like(images[0])])
+  offsets = jnp.arange(box_size)
+  frames = jnp.arange(t)[:, None, None]
+
+  def draw(carry, particle):
+    final_image, c = carry
+    position, corner, radius, color = particle
+    cols = corner[:, 0, None] + offsets
+    rows = corner[:, 1, None] + offsets
+    dx, dy = grid[cols][:, None, :], grid[rows][:, :, None]
+    d = jnp.sqrt((position[:, 0, None, None] - dx) ** 2 +
+                 (position[:, 1, None, None] - dy) ** 2)
+    m = 1.0 / (1.0 + jnp.exp((d - radius) * temperature))
+    index = (frames, rows[:, :, None], cols[:, None, :])
+    c_box = c[index]
+    final_image = final_image.at[index].add(c_box * m[..., None] * color)
+    c = c.at[index].set(c_box * (1 - m[..., None]))
+    return (final_image, c), None
 
   final_image = jnp.zeros([t, resolution, resolution, 3])
-  c = jnp.ones_like(images[0])
-  for img, m in zip(images, masks):
-    final_image = final_image + c * m * img
-    c = c * (1 - m)
-  return final_image
+  c = jnp.ones([t, resolution, resolution, 1])
+  (final_image, c), _ = lax.scan(
+      draw, (final_image, c),
+      (jnp.swapaxes(particles, 0, 1), jnp.swapaxes(corners, 0, 1),
+       particles_radius, colors))
+  return final_image + c * background_color
 
 
 def uniform_annulus(
@@ -122,7 +122,8 @@ def render_images(
       color_indices=colors,
       canvas_limits=box_region,
       resolution=resolution,
-      num_colors=num_particles)
+      num_colors=num_particles,
+      max_radius=particle_radius)
   return images
 
 
@@ -68,7 +68,13 @@ def get_parser():
         "--fvd-batch-size",
         type=int,
         default=16,
-        help="Number of real/fake videos to consider for fvd calculation (default (%default)s)",
+        help="Number of real/fake videos to consider for fvd calculation, over as many batches as needed (default (%default)s)",
+    )
+    parser.add_argument(
+        "--fvd-stats",
+        type=str,
+        default=None,
+        help="Folder of cached FVD statistics of real videos (default [paths].fvd_stats)",
     )
     parser.add_argument(
         "--fvd-on-cpu",
@@ -222,6 +228,8 @@ def main(*args):
     config = load_config(args.config_path)
 
     output_folder = args.output_folder
+    if args.fvd_stats is not None:
+        config.paths.fvd_stats = args.fvd_stats
     config.save(output_folder)
 
     experiment = Experiment(config)
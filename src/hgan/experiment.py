@@ -1,23 +1,47 @@
+import hashlib
+import json
 import logging
 import os.path
 import time
 import glob
 import numpy as np
 import skvideo.io
-from skimage.transform import resize
-import importlib
 import torch
-from torch.utils.data import DataLoader
+from torch.utils.data import BatchSampler, DataLoader, RandomSampler
 from torch.autograd import Variable
 
-import hgan.data
+from hgan.checkpoint import (
+    CheckpointWriter,
+    checkpoint_path,
+    load_checkpoint,
+    saved_checkpoints,
+)
 from hgan.configuration import save_config
 from hgan.models import GRU, HNNSimple, HNNPhaseSpace, HNNMass
-from hgan.dataset import RealtimeDataset, HGNRealtimeDataset, ToyPhysicsDatasetNPZ
-from hgan.utils import setup_reproducibility, timeSince
-from hgan.fvd import compute_fvd
+from hgan.dataset import (
+    RealtimeDataset,
+    HGNRealtimeDataset,
+    PackedVideoDataset,
+    ToyPhysicsDatasetNPZ,
+)
+from hgan.dataloader import BatchStream
+from hgan.utils import (
+    compile_forward,
+    MixedPrecision,
+    setup_reproducibility,
+    VideoSink,
+    seed_worker,
+    timeSince,
+)
+from hgan.fvd import (
+    ActivationStatistics,
+    frechet_distance,
+    get_detector,
+    load_statistics,
+    save_statistics,
+)
 from hgan.models import Discriminator_I, Discriminator_V, Generator_I
-from hgan.updates import update_models
+from hgan.updates import lazy_r1_gamma, update_models
 
 
 logger = logging.getLogger(__name__)
@@ -26,6 +50,9 @@ logger = logging.getLogger(__name__)
 class Experiment:
     def __init__(self, config):
         self.dataloader = None
+        self.batch_stream = None
+        self.checkpoint_writer = None
+        self.video_sink = None
         self.model_names = (
             "Di",
             "Dv",
@@ -66,6 +93,7 @@ class Experiment:
         else:
             self.device = f"cuda:{config.experiment.gpu}"
 
+        self.amp = MixedPrecision(config.experiment.amp, self.device)
         self.criterion = torch.nn.BCELoss().to(self.device)
         self.label = torch.FloatTensor().to(self.device)
 
@@ -97,6 +125,19 @@ class Experiment:
                 total_frames=config.video.real_total_frames,
                 img_size=config.experiment.img_size,
                 normalize=config.video.normalize,
+                integrator=config.experiment.rt_data_integrator,
+                chaotic_integrator=config.experiment.rt_data_chaotic_integrator,
+                min_separation=config.experiment.rt_data_min_separation,
+                render=not config.experiment.rt_data_render_on_device,
+                cache_folder=config.paths.rollout_cache,
+                cache_size=config.experiment.rt_data_cache_size,
+                cache_fresh=config.experiment.rt_data_cache_fresh,
+                cache_seed=config.experiment.seed,
+                cache_workers=config.experiment.rt_data_cache_workers,
+                max_attempts=config.experiment.rt_data_max_attempts,
+                max_evaluations=config.experiment.rt_data_max_evaluations,
+                timeout=config.experiment.rt_data_timeout,
+                max_abandoned=config.experiment.rt_data_max_abandoned,
             )
         elif config.experiment.rt_data_generator == "dm":
             dataset = RealtimeDataset(
@@ -112,6 +153,10 @@ class Experiment:
                 img_size=config.experiment.img_size,
                 normalize=config.video.normalize,
             )
+        elif PackedVideoDataset.is_packed(self.datapath):
+            dataset = PackedVideoDataset(
+                datapath=self.datapath, num_frames=config.video.generator_frames
+            )
         else:
             dataset = ToyPhysicsDatasetNPZ(
                 datapath=self.datapath, num_frames=config.video.generator_frames
@@ -120,11 +165,56 @@ class Experiment:
         if len(dataset) == 0:
             raise RuntimeError("No videos found!")
 
-        self.dataloader = DataLoader(
+        self.dataloader = self._build_dataloader(
+            config, dataset, torch.Generator().manual_seed(config.experiment.seed)
+        )
+
+    def _build_dataloader(self, config, dataset, generator):
+        num_workers = config.experiment.num_workers
+        if num_workers < 0:
+            num_workers = os.cpu_count()
+
+        worker_kwargs = {}
+        if num_workers > 0:
+            worker_kwargs = dict(
+                prefetch_factor=config.experiment.prefetch_factor,
+                persistent_workers=True,
+                worker_init_fn=seed_worker,
+            )
+
+        if isinstance(dataset, RealtimeDataset):
+            # The dm dataset generates a whole batch per call, so hand it
+            # lists of indices and let it do its own collation. Batches all have
+            # the same size, so that their generation is only compiled once.
+            batch_kwargs = dict(
+                sampler=BatchSampler(
+                    RandomSampler(dataset, generator=generator),
+                    batch_size=config.experiment.batch_size,
+                    drop_last=True,
+                ),
+                batch_size=None,
+            )
+        else:
+            # Training reshapes every batch with the configured batch size, so
+            # a short last batch would break the (persistent) batch stream.
+            if len(dataset) < config.experiment.batch_size:
+                raise RuntimeError(
+                    f"Found {len(dataset)} videos, fewer than the batch size "
+                    f"{config.experiment.batch_size}!"
+                )
+            batch_kwargs = dict(
+                batch_size=config.experiment.batch_size,
+                shuffle=True,
+                generator=generator,
+                drop_last=True,
+            )
+
+        return DataLoader(
             dataset,
-            batch_size=config.experiment.batch_size,
-            shuffle=True,
             pin_memory=True,
+            num_workers=num_workers,
+            **batch_kwargs,
+            **worker_kwargs,
         )
 
     def _init_models(self, config):
@@ -167,6 +257,16 @@ class Experiment:
                 output_size=self.ndim_epsilon,
                 ndim_physics=self.ndim_physics,
                 ndim_label=self.ndim_label,
+                leapfrog=config.experiment.hnn_leapfrog,
+                energy=config.experiment.hnn_energy,
+            ).to(self.device)
+        elif config.experiment.architecture == "hnn_simple":
+            self.rnn = rnn_class(
+                device=self.device,
+                input_size=self.ndim_epsilon,
+                hidden_size=self.hidden_size,
+                leapfrog=config.experiment.hnn_leapfrog,
+                energy=config.experiment.hnn_energy,
             ).to(self.device)
         else:
             self.rnn = rnn_class(
@@ -177,6 +277,17 @@ class Experiment:
 
         self.rnn.initWeight()
 
+        if config.experiment.compile_rnn is not None:
+            if (
+                config.experiment.architecture != "gru"
+                and config.experiment.hnn_energy != "analytic"
+            ):
+                # torch.compile does not support the double backward needed to train
+                # through autograd gradients of the energy
+                logger.warning("Not compiling rnn: requires hnn_energy = analytic")
+            else:
+                compile_forward(self.rnn, mode=config.experiment.compile_rnn)
+
         self.optim_Di = torch.optim.Adam(
             self.Di.parameters(), lr=self.learning_rate, betas=self.betas
         )
@@ -190,29 +301,86 @@ class Experiment:
             self.rnn.parameters(), lr=self.learning_rate, betas=self.betas
         )
 
+    @property
+    def batches(self):
+        # The stream is created lazily, so that any seeding done before training
+        # starts also applies to the batches generated in the background.
+        if self.batch_stream is None:
+            # Without workers, a background thread would generate data with the global
+            # random number generators, concurrently with training, and runs would no
+            # longer be reproducible.
+            prefetch = 0
+            if self.dataloader.num_workers > 0:
+                prefetch = self.config.experiment.prefetch_batches
+            self.batch_stream = BatchStream(self.dataloader, prefetch=prefetch)
+        return self.batch_stream
+
+    def close(self):
+        if self.batch_stream is not None:
+            self.batch_stream.close()
+            self.batch_stream = None
+        # Pending videos and checkpoints are written out first. A failure to write a
+        # video is re-raised, but only after the checkpoints have been written.
+        video_sink, self.video_sink = self.video_sink, None
+        checkpoint_writer, self.checkpoint_writer = self.checkpoint_writer, None
+        try:
+            if video_sink is not None:
+                video_sink.close()
+        finally:
+            if checkpoint_writer is not None:
+                checkpoint_writer.close()
+
     @property
     def system_embedding(self):
         return self.dataloader.dataset.system_embedding
 
     def saved_epochs(self):
+        if self.checkpoint_writer is not None:
+            self.checkpoint_writer.wait()
+        # Consolidated checkpoints, and older checkpoints saved as one file per model
+        epochs = saved_checkpoints(self.config.paths.output)
         saved_pths = sorted(glob.glob(self.config.paths.output + "/Di_*.pth"))
         filenames = [os.path.splitext(os.path.basename(p))[0] for p in saved_pths]
-        epochs = [int(filename.split("_")[-1]) for filename in filenames]
-        return epochs
+        epochs += [int(filename.split("_")[-1]) for filename in filenames]
+        return sorted(set(epochs))
 
     def load_epoch(self, epoch=None, device=None):
+        # Batches generated ahead of time use the current system embedding
+        self.close()
+
         if epoch is None:
             saved_epochs = self.saved_epochs()
             if not saved_epochs:
                 return 0
             epoch = saved_epochs[-1]
 
-        for which in self.model_names:
-            file_path = os.path.join(
-                self.config.paths.output, f"{which}_{epoch:0>6}.pth"
+        if os.path.exists(checkpoint_path(self.config.paths.output, epoch)):
+            state_dicts = load_checkpoint(
+                self.config.paths.output, epoch, map_location=device
             )
+        else:
+            state_dicts = {
+                which: torch.load(
+                    os.path.join(self.config.paths.output, f"{which}_{epoch:0>6}.pth"),
+                    map_location=device,
+                )
+                for which in self.model_names
+            }
+
+        for which in self.model_names:
             model = getattr(self, which)
-            model.load_state_dict(torch.load(file_path, map_location=device))
+            model.load_state_dict(state_dicts[which])
+        # Checkpoints of older versions, or without loss scaling, have no scaler state
+        if state_dicts.get("grad_scaler") and self.amp.scaler.is_enabled():
+            self.amp.scaler.load_state_dict(state_dicts["grad_scaler"])
+
+        # Persistent data workers keep the copy of the dataset, and of its system
+        # embedding, they were started with, so they are replaced by workers that
+        # copy the embedding just loaded.
+        if self.dataloader.num_workers > 0:
+            self.dataloader = self._build_dataloader(
+                self.config, self.dataloader.dataset, self.dataloader.generator
+            )
 
         return epoch
 
@@ -237,12 +405,18 @@ class Experiment:
         skvideo.io.vwrite(file_path, outputdata, verbosity=0)
 
     def save_epoch(self, epoch):
-        for which in self.model_names:
-            file_path = os.path.join(
-                self.config.paths.output, f"{which}_{epoch:0>6}.pth"
+        if self.checkpoint_writer is None:
+            self.checkpoint_writer = CheckpointWriter(
+                self.config.paths.output,
+                keep_last=self.keep_checkpoints,
+                keep_every=self.keep_checkpoints_every,
             )
-            model = getattr(self, which)
-            torch.save(model.state_dict(), file_path)
+        state_dicts = {
+            which: getattr(self, which).state_dict() for which in self.model_names
+        }
+        # The loss scale of fp16 training, which would otherwise restart at its default
+        state_dicts["grad_scaler"] = self.amp.scaler.state_dict()
+        self.checkpoint_writer.save(epoch, state_dicts)
 
     def get_random_content_vector(self, batch_size, d_C, device, n_frames):
         z_C = Variable(torch.randn(batch_size, d_C))
@@ -410,7 +584,9 @@ class Experiment:
         )
         Z_reshape = torch.cat((Z_reshape, label_and_colors_reshape), dim=1)
 
-        fake_videos = self.Gi(Z_reshape)
+        with self.amp.autocast():
+            fake_videos = self.Gi(Z_reshape)
+        fake_videos = fake_videos.float()
 
         fake_videos = fake_videos.view(
             self.batch_size, n_frames, self.ndim_channel, self.img_size, self.img_size
@@ -436,10 +612,12 @@ class Experiment:
 
     def get_real_data(self, device=None, dataloader=None):
         device = device or self.device
-        dataloader = dataloader or self.dataloader
         label_and_props = torch.tensor([])
         colors = torch.tensor([])
-        next_item = next(iter(dataloader))
+        if dataloader is None:
+            next_item = next(self.batches)
+        else:
+            next_item = next(iter(dataloader))
         if isinstance(next_item, (tuple, list)):
             real_videos = next_item[0]
             if len(next_item) > 2:
@@ -449,13 +627,20 @@ class Experiment:
         else:
             real_videos = next_item
 
-        real_videos = real_videos.to(
-            device
-        )  # (batch_size, ndim_channels, n_frames, img_size, img_size)
+        # Batches come from pinned memory, so host-to-device copies need not block
+        if isinstance(real_videos, dict):
+            # Scenes to be rendered on the device (see rt_data_render_on_device)
+            scenes = {
+                k: v.to(device, non_blocking=True) for k, v in real_videos.items()
+            }
+            real_videos = (dataloader or self.dataloader).dataset.render_scenes(scenes)
+        else:
+            real_videos = real_videos.to(device, non_blocking=True)
+        # real_videos: (batch_size, ndim_channels, n_frames, img_size, img_size)
         real_videos = Variable(real_videos)
-        label_and_props = label_and_props.to(device)
+        label_and_props = label_and_props.to(device, non_blocking=True)
         label_and_props = Variable(label_and_props)
-        colors = colors.to(device)
+        colors = colors.to(device, non_blocking=True)
         colors = Variable(colors)
 
         real_videos_frames = real_videos.shape[2]
@@ -481,70 +666,112 @@ class Experiment:
         colors=None,
     ):
 
-        if real_videos is None:
-            real_data = self.get_real_data()
-            real_videos = real_data[
-                "videos"
-            ]  # (batch_size, n_channels, n_frames, height, width)
-            label_and_props = real_data[
-                "label_and_props"
-            ]  # (batch_size, 1, ndim_label+ndim_physics)
-            colors = real_data["colors"]  # (batch_size, 1, ndim_color)
-
-        if fake_videos is None:
-            fake_data = self.get_fake_data(
-                label_and_props=label_and_props, colors=colors
+        detector = get_detector(str(device))
+        # Compare against cached statistics of a large sample of real videos if asked
+        cached = self.config.paths.fvd_stats is not None
+        real_statistics = ActivationStatistics()
+        fake_statistics = ActivationStatistics()
+
+        # Unless videos are given, as many batches as needed for max_videos are used
+        given = real_videos is not None or fake_videos is not None
+        if max_videos is None:
+            max_videos = (
+                len(fake_videos) if fake_videos is not None else self.batch_size
             )
-            fake_videos = fake_data[
-                "videos"
-            ]  # (batch_size, n_channels, n_frames, height, width)
-
-        # Use shape (samples, n_frames, n_channels, height, width)
-        real_videos = real_videos.detach().cpu().numpy().transpose(0, 2, 1, 3, 4)
-        fake_videos = fake_videos.detach().cpu().numpy().transpose(0, 2, 1, 3, 4)
-
-        with importlib.resources.path(hgan.data, "i3d_torchscript.pt") as i3d_path:
-            detector = torch.jit.load(i3d_path).eval().to(device)
-
-        batch_size, num_frames, num_channels, height, width = real_videos.shape
-        assert num_channels == 3, "Inputs should be 3 channels"
-
-        resized_real_videos = []
-        for vid in real_videos[:max_videos]:
-            resized_video = np.asarray([resize(img, (3, 224, 224)) for img in vid])
-            resized_real_videos.append(resized_video)
-        resized_real_videos = np.array(resized_real_videos)
-
-        resized_fake_videos = []
-        for vid in fake_videos[:max_videos]:
-            resized_video = np.asarray([resize(img, (3, 224, 224)) for img in vid])
-            resized_fake_videos.append(resized_video)
-        resized_fake_videos = np.array(resized_fake_videos)
-
-        # detector expects inputs of shape (batch_size, num_channels, num_frames, height, width)
-        resized_real_videos = (
-            torch.from_numpy(resized_real_videos).to(device).permute(0, 2, 1, 3, 4)
-        )
-        resized_fake_videos = (
-            torch.from_numpy(resized_fake_videos).to(device).permute(0, 2, 1, 3, 4)
+
+        while fake_statistics.n_samples < max_videos:
+            _real_videos, _fake_videos = real_videos, fake_videos
+            if _real_videos is None:
+                real_data = self.get_real_data()
+                _real_videos = real_data[
+                    "videos"
+                ]  # (batch_size, n_channels, n_frames, height, width)
+                label_and_props = real_data[
+                    "label_and_props"
+                ]  # (batch_size, 1, ndim_label+ndim_physics)
+                colors = real_data["colors"]  # (batch_size, 1, ndim_color)
+
+            if _fake_videos is None:
+                fake_data = self.get_fake_data(
+                    label_and_props=label_and_props, colors=colors
+                )
+                _fake_videos = fake_data[
+                    "videos"
+                ]  # (batch_size, n_channels, n_frames, height, width)
+
+            n_videos = max_videos - fake_statistics.n_samples
+            fake_statistics.update(detector.features(_fake_videos[:n_videos].detach()))
+            if not cached:
+                real_statistics.update(
+                    detector.features(_real_videos[:n_videos].detach())
+                )
+
+            if given:
+                break
+
+        if cached:
+            real_statistics = self.real_fvd_statistics(device=device)
+        else:
+            real_statistics = real_statistics.statistics()
+
+        # The matrix square root is done on the gpu as well, if that is where we are
+        return frechet_distance(
+            *real_statistics,
+            *fake_statistics.statistics(),
+            device=None if str(device) == "cpu" else device,
         )
 
-        detector_kwargs = {
-            "rescale": False,
-            "resize": False,
-            "return_features": True,  # Return raw features before the softmax layer.
+    def real_fvd_statistics_path(self):
+        # Keyed by all the settings that the real videos depend on
+        experiment = self.config.experiment
+        key = {
+            "system_name": experiment.system_name,
+            "img_size": experiment.img_size,
+            "generator_frames": self.config.video.generator_frames,
+            "real_total_frames": self.config.video.real_total_frames,
+            "normalize": self.config.video.normalize,
+            "rt_data_generator": experiment.rt_data_generator,
+            "rt_data_integrator": experiment.rt_data_integrator,
+            "rt_data_chaotic_integrator": experiment.rt_data_chaotic_integrator,
+            "rt_data_min_separation": experiment.rt_data_min_separation,
+            "system_physics_constant": experiment.system_physics_constant,
+            "system_color_constant": experiment.system_color_constant,
+            "system_friction": experiment.system_friction,
+            "datapath": (
+                None if experiment.rt_data_generator is not None else self.datapath
+            ),
         }
-        feats_real = (
-            detector(resized_real_videos, **detector_kwargs).detach().cpu().numpy()
-        )
-        feats_fake = (
-            detector(resized_fake_videos, **detector_kwargs).detach().cpu().numpy()
+        digest = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return os.path.join(
+            self.config.paths.fvd_stats,
+            f"{experiment.system_name or 'all_systems'}_{experiment.img_size}px_"
+            f"{self.config.video.generator_frames}frames_{digest[:16]}.npz",
         )
 
-        fvd = compute_fvd(real_activations=feats_real, generated_activations=feats_fake)
-        return fvd
+    def real_fvd_statistics(self, device="cpu"):
+        """
+        Mean and covariance of the I3D features of fvd_real_videos real videos.
+        These are computed once, and cached on disk under paths.fvd_stats, keyed by
+        the settings of the real videos (see real_fvd_statistics_path).
+        """
+        path = self.real_fvd_statistics_path()
+        if not os.path.exists(path):
+            logger.info(f"Computing FVD statistics of {self.fvd_real_videos} videos")
+            detector = get_detector(str(device))
+            real_statistics = ActivationStatistics()
+            while real_statistics.n_samples < self.fvd_real_videos:
+                n_videos = self.fvd_real_videos - real_statistics.n_samples
+                real_videos = self.get_real_data()["videos"][:n_videos]
+                real_statistics.update(detector.features(real_videos))
+
+            save_statistics(
+                path, *real_statistics.statistics(), real_statistics.n_samples
+            )
+            logger.info(f"Saved FVD statistics to {path}")
+
+        return load_statistics(path)
 
-    def train_step(self):
+    def train_step(self, epoch=0):
         real_data = self.get_real_data()
         label_and_props = real_data["label_and_props"]
         colors = real_data["colors"]
@@ -558,7 +785,7 @@ class Experiment:
             q_size=self.ndim_q,
             batch_size=self.batch_size,
             cyclic_coord_loss=self.cyclic_coord_loss,
-            r1_gamma=self.r1_gamma,
+            r1_gamma=lazy_r1_gamma(self.r1_gamma, self.r1_every, epoch),
             model_di=self.Di,
             model_dv=self.Dv,
             model_gi=self.Gi,
@@ -571,6 +798,7 @@ class Experiment:
             fake_data=fake_data,
             discriminator_gamma=self.discriminator_gamma,
             generator_gamma=self.generator_gamma,
+            amp=self.amp,
         )
 
         return err, mean, real_data, fake_data
@@ -590,55 +818,65 @@ class Experiment:
         else:
             start_epoch = self.load_epoch()
 
-        start_time = time.time()
-        for epoch in range(start_epoch + 1, self.n_epoch + 1):
-            err, mean, real_data, fake_data = self.train_step()
-
-            real_videos = real_data["videos"]
-            fake_videos = fake_data["videos"]
-
-            last_epoch = epoch == self.n_epoch
-
-            if epoch % self.calculate_fvd_every == 0 or last_epoch:
-                fvd = self.fvd(real_videos=real_videos, fake_videos=fake_videos)
-                logger.info(f"FVD = {fvd}")
-
-            if epoch % self.print_every == 0 or last_epoch:
-                logger.info(
-                    "[%d/%d] (%s) Loss_Di: %.4f Loss_Dv: %.4f Loss_Gi: %.4f Loss_Gv: %.4f Di_real_mean %.4f Di_fake_mean %.4f Dv_real_mean %.4f Dv_fake_mean %.4f"
-                    % (
-                        epoch,
-                        self.n_epoch,
-                        timeSince(start_time),
-                        err["Di"],
-                        err["Dv"],
-                        err["Gi"],
-                        err["Gv"],
-                        mean["Di_real"],
-                        mean["Di_fake"],
-                        mean["Dv_real"],
-                        mean["Dv_fake"],
+        # Sample videos are encoded in the background, off the training loop
+        self.video_sink = VideoSink(self.save_video)
+
+        # Pending checkpoints and videos are written out even if training fails
+        try:
+            start_time = time.time()
+            for epoch in range(start_epoch + 1, self.n_epoch + 1):
+                err, mean, real_data, fake_data = self.train_step(epoch)
+
+                real_videos = real_data["videos"]
+                fake_videos = fake_data["videos"]
+
+                last_epoch = epoch == self.n_epoch
+
+                if epoch % self.calculate_fvd_every == 0 or last_epoch:
+                    fvd = self.fvd(real_videos=real_videos, fake_videos=fake_videos)
+                    logger.info(f"FVD = {fvd}")
+
+                if epoch % self.print_every == 0 or last_epoch:
+                    logger.info(
+                        "[%d/%d] (%s) Loss_Di: %.4f Loss_Dv: %.4f Loss_Gi: %.4f Loss_Gv: %.4f Di_real_mean %.4f Di_fake_mean %.4f Dv_real_mean %.4f Dv_fake_mean %.4f"
+                        % (
+                            epoch,
+                            self.n_epoch,
+                            timeSince(start_time),
+                            err["Di"],
+                            err["Dv"],
+                            err["Gi"],
+                            err["Gv"],
+                            mean["Di_real"],
+                            mean["Di_fake"],
+                            mean["Dv_real"],
+                            mean["Dv_fake"],
+                        )
+                    )
+                    rollout_stats = getattr(self.dataloader.dataset, "stats", None)
+                    if rollout_stats is not None:
+                        logger.info(f"Realtime rollouts: {rollout_stats.summary()}")
+
+                if epoch % self.save_fake_video_every == 0 or last_epoch:
+                    self.video_sink.submit(
+                        self.config.paths.output,
+                        fake_videos[0].detach().cpu().numpy().transpose(1, 2, 3, 0),
+                        epoch=epoch,
+                        prefix="fake_",
                     )
-                )
-
-            if epoch % self.save_fake_video_every == 0 or last_epoch:
-                self.save_video(
-                    self.config.paths.output,
-                    fake_videos[0].detach().cpu().numpy().transpose(1, 2, 3, 0),
-                    epoch=epoch,
-                    prefix="fake_",
-                )
 
-            if epoch % self.save_real_video_every == 0 or last_epoch:
-                self.save_video(
-                    self.config.paths.output,
-                    real_videos[0].detach().cpu().numpy().transpose(1, 2, 3, 0),
-                    epoch=epoch,
-                    prefix="real_",
-                )
+                if epoch % self.save_real_video_every == 0 or last_epoch:
+                    self.video_sink.submit(
+                        self.config.paths.output,
+                        real_videos[0].detach().cpu().numpy().transpose(1, 2, 3, 0),
+                        epoch=epoch,
+                        prefix="real_",
+                    )
 
-            if epoch % self.save_model_every == 0 or last_epoch:
-                self.save_epoch(epoch)
+                if epoch % self.save_model_every == 0 or last_epoch:
+                    self.save_epoch(epoch)
+        finally:
+            self.close()
 
 
 class ExperimentOld(Experiment):
@@ -1,6 +1,10 @@
+import functools
+import importlib.resources
+import os
 import numpy as np
 import scipy
-import tensorflow as tf
+import torch
+import hgan.data
 
 
 # FVD implementation mostly copied from
@@ -24,10 +28,21 @@ def _symmetric_matrix_square_root(mat, eps=1e-10):
     Returns:
       Matrix square root of mat.
     """
-    u, s, vT = scipy.linalg.svd(mat)
-    # sqrt is unstable around 0, just use 0 in such case
-    si = np.where(s < eps, s, np.sqrt(s))
-    return np.matmul(np.matmul(u, tf.linalg.tensor_diag(si)), vT)
+    # For a symmetric matrix, the singular values are the absolute eigenvalues, so
+    # the symmetric eigendecomposition gives the same root as an SVD, faster.
+    w, v = scipy.linalg.eigh(mat)
+    return np.matmul(v * _signed_sqrt(w, eps), v.T)
+
+
+def _trace_symmetric_matrix_square_root(mat, eps=1e-10):
+    """Trace of _symmetric_matrix_square_root(mat), from the eigenvalues alone."""
+    return _signed_sqrt(scipy.linalg.eigvalsh(mat), eps).sum()
+
+
+def _signed_sqrt(w, eps=1e-10):
+    # sqrt is unstable around 0, just use the (absolute) value in such case
+    s = np.abs(w)
+    return np.sign(w) * np.where(s < eps, s, np.sqrt(s))
 
 
 def trace_sqrt_product(sigma, sigma_v):
@@ -65,26 +80,51 @@ def trace_sqrt_product(sigma, sigma_v):
     # Note sqrt_sigma is called "A" in the proof above
     sqrt_sigma = _symmetric_matrix_square_root(sigma)
 
-    # This is sqrt(A sigma_v A) above
-    sqrt_a_sigmav_a = np.matmul(sqrt_sigma, np.matmul(sigma_v, sqrt_sigma))
+    # This is A sigma_v A above, only the trace of whose root is needed
+    a_sigmav_a = np.matmul(sqrt_sigma, np.matmul(sigma_v, sqrt_sigma))
 
-    return np.trace(_symmetric_matrix_square_root(sqrt_a_sigmav_a))
+    return _trace_symmetric_matrix_square_root(a_sigmav_a)
 
 
-def compute_fvd(real_activations: np.ndarray, generated_activations: np.ndarray):
-    m = real_activations.mean(axis=0)
-    m_w = generated_activations.mean(axis=0)
-    n_samples = real_activations.shape[0]
+def trace_sqrt_product_torch(sigma, sigma_v, device="cpu", eps=1e-10):
+    """
+    trace_sqrt_product, computed (in float64) with torch on the given device.
+    """
+    sigma = torch.as_tensor(sigma, dtype=torch.float64, device=device)
+    sigma_v = torch.as_tensor(sigma_v, dtype=torch.float64, device=device)
+
+    def signed_sqrt(w):
+        s = torch.abs(w)
+        return torch.sign(w) * torch.where(s < eps, s, torch.sqrt(s))
+
+    w, v = torch.linalg.eigh(sigma)
+    sqrt_sigma = (v * signed_sqrt(w)) @ v.T
+    a_sigmav_a = sqrt_sigma @ sigma_v @ sqrt_sigma
+    # Symmetrize, to guard against round-off before the eigendecomposition
+    a_sigmav_a = (a_sigmav_a + a_sigmav_a.T) / 2
+
+    return float(signed_sqrt(torch.linalg.eigvalsh(a_sigmav_a)).sum())
+
+
+def activation_statistics(activations: np.ndarray):
+    """Mean and (unbiased) covariance of activations of shape (n_samples, n_features)"""
+    m = activations.mean(axis=0)
+    n_samples = activations.shape[0]
 
     # sigma = (1 / (n - 1)) * (X - mu) (X - mu)^T
-    real_centered = real_activations - m
-    sigma = np.matmul(real_centered.T, real_centered) / (n_samples - 1)
+    centered = activations - m
+    sigma = np.matmul(centered.T, centered) / (n_samples - 1)
+
+    return m, sigma
 
-    gen_centered = generated_activations - m_w
-    sigma_w = np.matmul(gen_centered.T, gen_centered) / (n_samples - 1)
 
+def frechet_distance(m, sigma, m_w, sigma_w, device=None):
     # Find the Tr(sqrt(sigma sigma_w)) component of FID
-    sqrt_trace_component = trace_sqrt_product(sigma, sigma_w)
+    # (with torch on the given device, if any)
+    if device is None:
+        sqrt_trace_component = trace_sqrt_product(sigma, sigma_w)
+    else:
+        sqrt_trace_component = trace_sqrt_product_torch(sigma, sigma_w, device=device)
 
     # Compute the two components of FID.
 
@@ -99,3 +139,158 @@ def compute_fvd(real_activations: np.ndarray, generated_activations: np.ndarray)
     assert fid >= 0, "Unexpected condition!"
 
     return float(fid)
+
+
+def compute_fvd(
+    real_activations: np.ndarray = None,
+    generated_activations: np.ndarray = None,
+    real_statistics=None,
+):
+    """
+    FVD between real and generated activations. Precomputed (mean, covariance) of
+    the real activations can be given as real_statistics instead.
+    """
+    if real_statistics is None:
+        real_statistics = activation_statistics(real_activations)
+    return frechet_distance(
+        *real_statistics, *activation_statistics(generated_activations)
+    )
+
+
+class ActivationStatistics:
+    """
+    Streaming mean and (unbiased) covariance of activations, accumulated in float64
+    from chunks of shape (n_samples, n_features), so that FVD can be computed over
+    any number of videos in bounded memory.
+    Chunks are merged with the parallel update of Chan et al.
+    (https://en.wikipedia.org/wiki/Algorithms_for_calculating_variance#Parallel_algorithm)
+    """
+
+    def __init__(self):
+        self.n_samples = 0
+        self.mean = None
+        # Sum of outer products of deviations from the mean
+        self.scatter = None
+
+    def update(self, activations: np.ndarray):
+        activations = np.asarray(activations, dtype=np.float64)
+        n_chunk = activations.shape[0]
+        if n_chunk == 0:
+            return
+
+        chunk_mean = activations.mean(axis=0)
+        centered = activations - chunk_mean
+        chunk_scatter = np.matmul(centered.T, centered)
+
+        if self.n_samples == 0:
+            self.n_samples, self.mean, self.scatter = n_chunk, chunk_mean, chunk_scatter
+            return
+
+        n_samples = self.n_samples + n_chunk
+        delta = chunk_mean - self.mean
+        self.mean = self.mean + delta * n_chunk / n_samples
+        self.scatter = (
+            self.scatter
+            + chunk_scatter
+            + np.outer(delta, delta) * self.n_samples * n_chunk / n_samples
+        )
+        self.n_samples = n_samples
+
+    @property
+    def covariance(self):
+        return self.scatter / (self.n_samples - 1)
+
+    def statistics(self):
+        return self.mean, self.covariance
+
+
+def save_statistics(path, m, sigma, n_samples):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    np.savez(path, mean=m, sigma=sigma, n_samples=n_samples)
+
+
+def load_statistics(path):
+    with np.load(path) as data:
+        return data["mean"], data["sigma"]
+
+
+def bilinear_resize_matrix(n_in, n_out):
+    """
+    Matrix W of shape (n_out, n_in) such that W @ x linearly interpolates x (along
+    its first axis) to n_out samples, the way skimage.transform.resize does when
+    upsampling (pixel centers aligned, mirrored boundaries).
+    """
+    coords = (np.arange(n_out) + 0.5) * n_in / n_out - 0.5
+    lower = np.floor(coords).astype(int)
+    weight = coords - lower
+
+    def mirror(i):
+        i = np.abs(i)
+        return np.where(i > n_in - 1, 2 * (n_in - 1) - i, i)
+
+    matrix = np.zeros((n_out, n_in))
+    np.add.at(matrix, (np.arange(n_out), mirror(lower)), 1 - weight)
+    np.add.at(matrix, (np.arange(n_out), mirror(lower + 1)), weight)
+    return matrix
+
+
+class I3D:
+    """
+    The I3D video classifier whose features are used for FVD.
+    The torchscript model is loaded once, and kept on its device; use get_detector
+    to share a single instance per device across the process.
+    """
+
+    # Spatial resolution expected by the detector
+    RESOLUTION = 224
+
+    def __init__(self, device="cpu", chunk_size=16):
+        self.device = device
+        self.chunk_size = chunk_size
+        with importlib.resources.path(hgan.data, "i3d_torchscript.pt") as i3d_path:
+            self.detector = torch.jit.load(i3d_path, map_location=device).eval()
+        self._resize_matrices = {}
+
+    def _resize_matrix(self, n_in):
+        if n_in not in self._resize_matrices:
+            self._resize_matrices[n_in] = torch.tensor(
+                bilinear_resize_matrix(n_in, self.RESOLUTION),
+                dtype=torch.float32,
+                device=self.device,
+            )
+        return self._resize_matrices[n_in]
+
+    def resize(self, videos):
+        """
+        Resize videos of shape (batch_size, num_channels, num_frames, height, width)
+        to the resolution expected by the detector, interpolating all frames at once.
+        """
+        rows = self._resize_matrix(videos.shape[3])
+        cols = self._resize_matrix(videos.shape[4])
+        return torch.einsum("yh,bcthw,xw->bctyx", rows, videos, cols)
+
+    def features(self, videos):
+        """
+        Features (before the softmax layer) of videos of shape
+        (batch_size, num_channels, num_frames, height, width), as a numpy array of
+        shape (batch_size, n_features).
+        Videos are resized and passed through the detector in chunks of chunk_size.
+        """
+        assert videos.shape[1] == 3, "Inputs should be 3 channels"
+
+        features = []
+        with torch.inference_mode():
+            for chunk in torch.split(videos, self.chunk_size):
+                chunk = self.resize(chunk.to(self.device, torch.float32))
+                features.append(
+                    self.detector(
+                        chunk, rescale=False, resize=False, return_features=True
+                    ).cpu()
+                )
+
+        return torch.cat(features).numpy()
+
+
+@functools.lru_cache(maxsize=None)
+def get_detector(device="cpu"):
+    return I3D(device=device)
@@ -1,4 +1,3 @@
-import cv2
 import numpy as np
 
 from environment import Environment, visualize_rollout
@@ -16,6 +15,7 @@ class ChaoticPendulum(Environment):
     """
 
     WORLD_SIZE = 2.5
+    N_BALL_COLORS = 3
     PHYSICAL_PROPERTIES = ("mass", "length", "g")
 
     def __init__(self, mass, length, g, q=None, p=None):
@@ -121,48 +121,71 @@ class ChaoticPendulum(Environment):
 
         return dyn.reshape(-1)
 
-    def _draw(self, res=32, color=True, constant_color=True):
-        """Returns array of the environment evolution
+    def _dynamics_batch(self, t, states):
+        """Defines system dynamics for a batch of phase states
 
         Args:
-            res (int): Image resolution (images are square).
-            color (bool): True if RGB, false if grayscale.
-            constant_color (bool): True if rollout uses default ball color
+            t (float): Time parameter of the dynamic equations.
+            states (np.ndarray): Phase states at time t, of shape (batch_size, 4)
+
+        Returns:
+            equations (np.ndarray): Movement equations of the physical system,
+                of shape (batch_size, 4)
+        """
+        return self._vector_field(states, self._dynamics_params())
+
+    @staticmethod
+    def _vector_field(states, params, xp=np):
+        mass, length, g = params["mass"], params["length"], params["g"]
+        q_1, q_2, p_1, p_2 = states[:, 0], states[:, 1], states[:, 2], states[:, 3]
+        sin_diff = xp.sin(q_1 - q_2)
+        cos_diff = xp.cos(q_1 - q_2)
+
+        # dq_1 and dq_2
+        quot = mass * (length**2) * (1 + sin_diff**2)
+        dq_1 = (p_1 - p_2 * cos_diff) / quot
+        dq_2 = (p_2 - p_1 * cos_diff) / quot
+
+        # dp_1 and dp_2
+        cst = 1 / (2 * mass * (length**2))
+        term1 = p_1**2 + p_2**2 + 2 * p_1 * p_2 * cos_diff
+        term2 = 1 + sin_diff**2
+
+        dterm1_dq_1 = 2 * p_1 * p_2 * sin_diff
+        dterm1_dq_2 = -dterm1_dq_1
+
+        dterm2_dq_1 = 2 * cos_diff
+        dterm2_dq_2 = -dterm2_dq_1
+
+        dp_1 = -2 * mass * g * length * xp.sin(q_1) - cst * (
+            dterm1_dq_1 * term2 - term1 * dterm2_dq_1
+        ) / (term2**2)
+        dp_2 = -2 * mass * g * length * xp.sin(q_2) - cst * (
+            dterm1_dq_2 * term2 - term1 * dterm2_dq_2
+        ) / (term2**2)
+
+        return xp.stack([dq_1, dq_2, dp_1, dp_2], axis=1)
+
+    def _object_positions(self, rollouts):
+        """Returns the positions of both pendulum bobs, in world space
+
+        Args:
+            rollouts (np.ndarray): Rollouts of shape (batch_size, 4, n_frames)
         Returns:
-            vid (np.ndarray): Rendered rollout as a sequence of images
+            positions (np.ndarray): Array of shape (batch_size, n_frames, 2, 2)
         """
-        q = self._rollout.reshape(2, 2, -1)[0, :, :]
-        length = q.shape[-1]
-        vid = np.zeros((length, res, res, 3), dtype="float")
-        if constant_color:
-            ball_colors = self._default_ball_colors
-        else:
-            ball_colors = [
-                tuple(np.random.random(3))
-                for _ in range(len(self._default_ball_colors))
-            ]
+        q = rollouts[:, :2, :]
+        x_1 = self.length * np.sin(q[:, 0])
+        y_1 = self.length * np.cos(q[:, 0])
+        x_2 = x_1 + self.length * np.sin(q[:, 1])
+        y_2 = y_1 + self.length * np.cos(q[:, 1])
+        return np.stack(
+            [np.stack([x_1, y_1], axis=-1), np.stack([x_2, y_2], axis=-1)], axis=2
+        )
+
+    def _object_radii(self, res):
         space_res = 2.0 * self.get_world_size() / res
-        for t in range(length):
-            coords_1 = self._world_to_pixels(
-                self.length * np.sin(q[0, t]), self.length * np.cos(q[0, t]), res
-            )
-            coords_2 = self._world_to_pixels(
-                self.length * np.sin(q[0, t]) + self.length * np.sin(q[1, t]),
-                self.length * np.cos(q[0, t]) + self.length * np.cos(q[1, t]),
-                res,
-            )
-            vid[t] = cv2.circle(
-                vid[t], coords_1, int(self.length / (space_res * 3)), ball_colors[0], -1
-            )
-            vid[t] = cv2.circle(
-                vid[t], coords_2, int(self.length / (space_res * 3)), ball_colors[1], -1
-            )
-            vid[t] = cv2.blur(cv2.blur(vid[t], (2, 2)), (2, 2))
-        vid += self._default_background_color
-        vid[vid > 1.0] = 1.0
-        if not color:
-            vid = np.expand_dims(np.max(vid, axis=-1), -1)
-        return vid, ball_colors
+        return np.full(2, int(self.length / (space_res * 3)))
 
     def _sample_init_conditions(self, radius):
         """Samples random initial conditions for the environment
@@ -1,11 +1,44 @@
 from abc import ABC, abstractmethod
+import time
 import cv2
 from matplotlib import pyplot as plt, animation
 import numpy as np
 from scipy.integrate import solve_ivp
 
+from integrators import leapfrog, rk4
+from rendering import render_balls
+
+
+class IntegrationBudgetExceeded(RuntimeError):
+    """Raised when rollouts could not be sampled within the given number of attempts."""
+
+
+class _EvaluationBudgetExceeded(Exception):
+    pass
+
+
+def _budgeted(fun, max_evaluations=None, timeout=None):
+    """Wraps dynamics fun(t, y), so that they raise _EvaluationBudgetExceeded after
+    max_evaluations calls or timeout seconds."""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    evaluations = 0
+
+    def wrapped(t, y):
+        nonlocal evaluations
+        evaluations += 1
+        if (max_evaluations is not None and evaluations > max_evaluations) or (
+            deadline is not None and time.monotonic() > deadline
+        ):
+            raise _EvaluationBudgetExceeded
+        return fun(t, y)
+
+    return wrapped
+
 
 class Environment(ABC):
+    # Number of ball colors sampled for each rollout
+    N_BALL_COLORS = 1
+
     def __init__(self, q=None, p=None):
         """Instantiate new environment with the provided position and momentum
 
@@ -20,6 +53,8 @@ class Environment(ABC):
             (0.0, 146.0 / 255, 0.0),
         ]
         self._rollout = None
+        # Counters of the last call to sample_random_states
+        self.sampling_stats = {"retries": 0, "rejected": 0}
         self.q = None
         self.p = None
         self.set(q=q, p=p)
@@ -50,19 +85,172 @@ class Environment(ABC):
         """
         raise NotImplementedError
 
+    def _dynamics_params(self):
+        """Returns the physical parameters of the dynamics, as passed to _vector_field
+
+        Returns:
+            params (dict): Arrays of the PHYSICAL_PROPERTIES of the system, by name
+        """
+        return {
+            prop: np.asarray(getattr(self, prop), dtype=float)
+            for prop in self.PHYSICAL_PROPERTIES
+        }
+
+    @staticmethod
+    def _vector_field(states, params, xp=np):
+        """Defines the (time independent) dynamics of a batch of phase states, given the
+        physical parameters, for any array module
+
+        Args:
+            states (array): Phase states of shape (batch_size, state_size)
+            params (dict): Physical parameters, as returned by _dynamics_params
+            xp (module): Array module of states and params (numpy or jax.numpy)
+
+        Raises:
+            NotImplementedError: Class instantiation has no implementation
+        """
+        raise NotImplementedError
+
+    def _dynamics_batch(self, t, states):
+        """Defines system dynamics for a batch of phase states
+
+        Args:
+            t (float): Time parameter of the dynamic equations.
+            states (np.ndarray): Phase states at time t, of shape (batch_size, state_size)
+
+        Returns:
+            equations (np.ndarray): Derivatives of the phase states w.r.t. time,
+                of shape (batch_size, state_size)
+        """
+        return np.array([self._dynamics(t, s) for s in states])
+
+    def _is_separable(self):
+        """Whether dq/dt depends only on p and dp/dt only on q."""
+        return False
+
+    def _simulate_analytically(self, y0, t_eval):
+        """Evaluates the analytic solution of the dynamics, if there is one
+
+        Args:
+            y0 (np.ndarray): Initial phase states of shape (batch_size, state_size),
+                at time t_eval[0].
+            t_eval ([float]): Times at which to evaluate the solution.
+
+        Returns:
+            (np.ndarray): Rollouts of shape (batch_size, state_size, len(t_eval)), or
+                None if there is no analytic solution (for the current parameters).
+        """
+        return None
+
     @abstractmethod
-    def _draw(self, img_size, color):
-        """Returns array of the environment evolution.
+    def _object_positions(self, rollouts):
+        """Returns the positions of the objects to draw, in world space
 
         Args:
-            img_size (int): Size of the frames (in pixels).
-            color (bool): Whether to have colored or grayscale frames.
+            rollouts (np.ndarray): Rollouts of shape (batch_size, state_size, n_frames)
+
+        Raises:
+            NotImplementedError: Class instantiation has no implementation
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def _object_radii(self, res):
+        """Returns the radii of the objects to draw, in pixels
+
+        Args:
+            res (int): Image resolution (images are square).
 
         Raises:
             NotImplementedError: Class instantiation has no implementation
         """
         raise NotImplementedError
 
+    def _sample_ball_colors(self, constant_color):
+        """Returns the colors of the balls of a rollout
+
+        Args:
+            constant_color (bool): True if rollout uses default ball colors
+
+        Returns:
+            ball_colors (np.ndarray): Array of shape (N_BALL_COLORS, 3)
+        """
+        if constant_color:
+            return np.array(self._default_ball_colors[: self.N_BALL_COLORS])
+        return np.random.random((self.N_BALL_COLORS, 3))
+
+    def _scene_batch(self, rollouts, res=32, constant_color=True):
+        """Returns what is needed to render a batch of rollouts, in pixel space
+
+        Args:
+            rollouts (np.ndarray): Rollouts of shape (batch_size, state_size, n_frames)
+            res (int): Image resolution (images are square).
+            constant_color (bool): True if rollouts use default ball colors
+        Returns:
+            centers (np.ndarray): Pixel coordinates (x, y) of the objects, of shape
+                (batch_size, n_frames, n_objects, 2)
+            radii (np.ndarray): Pixel radii of the objects, of shape (n_objects,).
+                Objects with a negative radius are not drawn.
+            ball_colors (np.ndarray): Ball colors of shape (batch_size, N_BALL_COLORS, 3)
+        """
+        ball_colors = np.array(
+            [self._sample_ball_colors(constant_color) for _ in range(len(rollouts))]
+        )
+        positions = self._object_positions(rollouts)
+        world_size = self.get_world_size()
+        # Same truncation as _world_to_pixels
+        centers = (res * (positions + world_size) / (2 * world_size)).astype(int)
+        radii = self._object_radii(res)
+        return centers, radii, ball_colors
+
+    def _draw_batch(
+        self, rollouts, res=32, color=True, constant_color=True, dtype=np.float32
+    ):
+        """Returns array of the environment evolution for a batch of rollouts
+
+        Args:
+            rollouts (np.ndarray): Rollouts of shape (batch_size, state_size, n_frames)
+            res (int): Image resolution (images are square).
+            color (bool): True if RGB, false if grayscale.
+            constant_color (bool): True if rollouts use default ball colors
+            dtype (np.dtype): np.float32/np.float64 for values in [0, 1], or np.uint8 for
+                values in [0, 255].
+        Returns:
+            vids (np.ndarray): Rendered rollouts of shape (batch_size, n_frames, res, res,
+                channels)
+            ball_colors (np.ndarray): Ball colors of shape (batch_size, N_BALL_COLORS, 3)
+        """
+        centers, radii, ball_colors = self._scene_batch(rollouts, res, constant_color)
+        vids = render_balls(
+            centers,
+            radii,
+            # Objects beyond N_BALL_COLORS reuse the ball colors
+            ball_colors[:, np.arange(len(radii)) % self.N_BALL_COLORS],
+            res,
+            self._default_background_color,
+            color=color,
+            dtype=dtype,
+        )
+        return vids, ball_colors
+
+    def _draw(self, res=32, color=True, constant_color=True, dtype=np.float32):
+        """Returns array of the environment evolution
+
+        Args:
+            res (int): Image resolution (images are square).
+            color (bool): True if RGB, false if grayscale.
+            constant_color (bool): True if rollout uses default ball colors
+            dtype (np.dtype): np.float32/np.float64 for values in [0, 1], or np.uint8 for
+                values in [0, 255].
+        Returns:
+            vid (np.ndarray): Rendered rollout as a sequence of images
+            ball_colors (np.ndarray): Ball colors of shape (N_BALL_COLORS, 3)
+        """
+        vids, ball_colors = self._draw_batch(
+            self._rollout[np.newaxis], res, color, constant_color, dtype
+        )
+        return vids[0], ball_colors[0]
+
     @abstractmethod
     def get_world_size(self):
         """Returns the world size for the environment."""
@@ -92,6 +280,19 @@ class Environment(ABC):
         """
         raise NotImplementedError
 
+    def _reject_rollouts(self, rollouts):
+        """Which (finite) rollouts to reject after integrating them, e.g. because of a
+        near collision.
+
+        Args:
+            rollouts (np.ndarray): Rollouts of shape (batch_size, state_size, n_frames).
+
+        Returns:
+            (np.ndarray): Boolean array of shape (batch_size,), True for the rollouts
+                to sample other initial conditions for instead.
+        """
+        return np.zeros(len(rollouts), dtype=bool)
+
     def _world_to_pixels(self, x, y, res):
         """Maps coordinates from world space to pixel space
 
@@ -128,9 +329,91 @@ class Environment(ABC):
 
         t_eval = np.linspace(0, total_time, round(total_time / delta_time) + 1)[:-1]
         t_span = [0, total_time]
-        y0 = np.array([np.array(self.q), np.array(self.p)]).reshape(-1)
+        y0 = self._initial_state()
         self._rollout = solve_ivp(self._dynamics, t_span, y0, t_eval=t_eval).y
 
+    def _initial_state(self):
+        """Returns the current initial conditions as a 1-D phase state [q, p]."""
+        return np.array([np.array(self.q), np.array(self.p)]).reshape(-1)
+
+    def _evolution_batch(
+        self,
+        y0,
+        total_time=10,
+        delta_time=0.1,
+        integrator="rk4",
+        steps_per_frame=2,
+        try_analytic_solution=True,
+        max_evaluations=None,
+        timeout=None,
+    ):
+        """Performs rollouts of the physical system for a batch of initial conditions.
+
+        Args:
+            y0 (np.ndarray): Initial phase states of shape (batch_size, state_size)
+            total_time (float): Total duration of the rollout (in seconds)
+            delta_time (float): Sample interval in the rollout (in seconds)
+            integrator (str): One of 'rk4', 'leapfrog' or 'solve_ivp'.
+                'rk4' and 'leapfrog' advance the whole batch at once with a fixed step size
+                of delta_time / steps_per_frame. 'leapfrog' is only valid for separable
+                systems, and falls back to 'rk4' otherwise.
+                'solve_ivp' integrates each rollout separately with an adaptive step size.
+            steps_per_frame (int): Number of fixed size integration steps per sample interval.
+            try_analytic_solution (bool): Whether to evaluate the analytic solution of the
+                dynamics instead, if there is one (see _simulate_analytically).
+            max_evaluations (int, optional): Max. number of evaluations of the dynamics that
+                'solve_ivp' may take for a rollout, before giving up on it.
+            timeout (float, optional): Max. number of seconds that 'solve_ivp' may take for a
+                rollout, before giving up on it.
+
+        Returns:
+            (np.ndarray): Rollouts of shape (batch_size, state_size, n_frames). Rollouts for
+                which the integration failed are filled with NaNs.
+        """
+        t_eval = np.linspace(0, total_time, round(total_time / delta_time) + 1)[:-1]
+
+        if try_analytic_solution:
+            rollouts = self._simulate_analytically(np.asarray(y0, dtype=float), t_eval)
+            if rollouts is not None:
+                return rollouts
+
+        if integrator == "leapfrog" and not self._is_separable():
+            integrator = "rk4"
+
+        if integrator in ("rk4", "leapfrog"):
+            return self._integrate_fixed_step(y0, t_eval, integrator, steps_per_frame)
+        elif integrator == "solve_ivp":
+            rollouts = np.full(y0.shape + (len(t_eval),), np.nan)
+            for i, _y0 in enumerate(y0):
+                fun = self._dynamics
+                if max_evaluations is not None or timeout is not None:
+                    fun = _budgeted(fun, max_evaluations, timeout)
+                try:
+                    y = solve_ivp(fun, [0, total_time], _y0, t_eval=t_eval).y
+                except _EvaluationBudgetExceeded:
+                    continue
+                # solve_ivp returns fewer samples than requested if the integration fails
+                if y.shape[-1] == len(t_eval):
+                    rollouts[i] = y
+            return rollouts
+        else:
+            raise ValueError(f"Unknown integrator {integrator}")
+
+    def _integrate_fixed_step(self, y0, t_eval, integrator, steps_per_frame):
+        """Integrates a batch of rollouts with a fixed step integrator.
+
+        Args:
+            y0 (np.ndarray): Initial phase states of shape (batch_size, state_size)
+            t_eval (np.ndarray): Times of the frames of the rollouts (in seconds)
+            integrator (str): 'rk4', or 'leapfrog' (for separable systems only).
+            steps_per_frame (int): Number of integration steps per sample interval.
+
+        Returns:
+            (np.ndarray): Rollouts of shape (batch_size, state_size, n_frames).
+        """
+        integrate = {"rk4": rk4, "leapfrog": leapfrog}[integrator]
+        return integrate(self._dynamics_batch, y0, t_eval, substeps=steps_per_frame)
+
     def sample_random_rollouts(
         self,
         number_of_frames=100,
@@ -142,6 +425,14 @@ class Environment(ABC):
         radius_bound=(1.3, 2.3),
         seed=None,
         constant_color=True,
+        integrator="rk4",
+        steps_per_frame=2,
+        dtype=np.float32,
+        render=True,
+        try_analytic_solution=True,
+        max_attempts=None,
+        max_evaluations=None,
+        timeout=None,
     ):
         """Samples random rollouts for a given environment
 
@@ -160,13 +451,83 @@ class Environment(ABC):
                 get_default_radius_bounds() will be returned.
             seed (int): Seed for reproducibility.
             constant_color (bool): Whether to do all rollouts using the default ball color
+            integrator (str): One of 'rk4', 'leapfrog' (fixed step, all rollouts integrated
+                together) or 'solve_ivp' (adaptive step, one rollout at a time).
+            steps_per_frame (int): Number of integration steps per frame for fixed step
+                integrators.
+            try_analytic_solution (bool): Whether to evaluate the analytic solution of the
+                dynamics instead of integrating them, for systems that have one.
+            max_attempts (int, optional): Max. number of initial conditions to try for a
+                rollout, counting the rejected ones and the failed integrations.
+            max_evaluations (int, optional): Max. number of evaluations of the dynamics per
+                rollout, for 'solve_ivp'. Integrations that take more fail.
+            timeout (float, optional): Max. number of seconds per rollout, for 'solve_ivp'.
+                Integrations that take longer fail.
+            dtype (np.dtype): np.float32/np.float64 for frames with values in [0, 1], or
+                np.uint8 for frames with values in [0, 255].
+            render (bool): Whether to render the rollouts. If False, the scenes to render
+                are returned instead of the frames, as a dict with the pixel coordinates
+                of the objects ('centers', of shape (Batch, Nframes, Nobjects, 2)), their
+                pixel radii ('radii', of shape (Nobjects,)) and the background color
+                ('background', of shape (3,)), to be drawn with rendering.render_balls.
         Raises:
             AssertError: If radius_bound[0] > radius_bound[1]
+            IntegrationBudgetExceeded: If a rollout takes more than max_attempts attempts
         Returns:
             (ndarray): Array of shape (Batch, Nframes, Height, Width, Channels).
                 Contains sampled rollouts
+            (ndarray): Array of shape (Batch, N_BALL_COLORS, 3).
+                Contains the ball colors of each rollout
+        """
+        rollouts = self.sample_random_states(
+            number_of_frames=number_of_frames,
+            delta_time=delta_time,
+            number_of_rollouts=number_of_rollouts,
+            radius_bound=radius_bound,
+            seed=seed,
+            integrator=integrator,
+            steps_per_frame=steps_per_frame,
+            try_analytic_solution=try_analytic_solution,
+            max_attempts=max_attempts,
+            max_evaluations=max_evaluations,
+            timeout=timeout,
+        )
+        return self.render_rollouts(
+            rollouts,
+            img_size=img_size,
+            color=color,
+            noise_level=noise_level,
+            constant_color=constant_color,
+            dtype=dtype,
+            render=render,
+        )
+
+    def sample_random_states(
+        self,
+        number_of_frames=100,
+        delta_time=0.1,
+        number_of_rollouts=16,
+        radius_bound=(1.3, 2.3),
+        seed=None,
+        integrator="rk4",
+        steps_per_frame=2,
+        try_analytic_solution=True,
+        max_attempts=None,
+        max_evaluations=None,
+        timeout=None,
+    ):
+        """Samples random (noise-free) phase space rollouts for a given environment
+
+        The number of failed integrations that had to be retried, and of rejected
+        rollouts (see _reject_rollouts), are kept in self.sampling_stats.
+
+        Args:
+            See sample_random_rollouts.
+        Raises:
+            See sample_random_rollouts.
+        Returns:
+            (ndarray): Array of shape (Batch, state_size, Nframes).
         """
-        ball_color = None
         if radius_bound == "auto":
             radius_bound = self.get_default_radius_bounds()
         radius_lb, radius_ub = radius_bound
@@ -174,20 +535,88 @@ class Environment(ABC):
         if seed is not None:
             np.random.seed(seed)
         total_time = number_of_frames * delta_time
-        batch_sample = []
-        for i in range(number_of_rollouts):
-            self._sample_init_conditions(radius_bound)
-            self._evolution(total_time, delta_time)
-            if noise_level > 0.0:
-                self._rollout += (
-                    np.random.randn(*self._rollout.shape)
-                    * noise_level
-                    * self.get_max_noise_std()
+
+        self.sampling_stats = stats = {"retries": 0, "rejected": 0}
+        attempts = np.zeros(number_of_rollouts, dtype=int)
+
+        def attempt(i):
+            if max_attempts is not None and attempts[i] >= max_attempts:
+                raise IntegrationBudgetExceeded(
+                    f"No rollout of {type(self).__name__} after {max_attempts} attempts"
                 )
-            vid, ball_color = self._draw(img_size, color, constant_color)
-            batch_sample.append(vid)
+            attempts[i] += 1
+
+        rollouts = None
+        failed = np.arange(number_of_rollouts)
+        # Integration is not guaranteed to succeed for all initial conditions -
+        # keep sampling new ones for the failed rollouts till it does.
+        while len(failed) > 0:
+            y0 = []
+            for i in failed:
+                attempt(i)
+                self._sample_init_conditions(radius_bound)
+                y0.append(self._initial_state())
+            _rollouts = self._evolution_batch(
+                np.array(y0),
+                total_time,
+                delta_time,
+                integrator=integrator,
+                steps_per_frame=steps_per_frame,
+                try_analytic_solution=try_analytic_solution,
+                max_evaluations=max_evaluations,
+                timeout=timeout,
+            )
+            if rollouts is None:
+                rollouts = _rollouts
+            else:
+                rollouts[failed] = _rollouts
+            finite = np.isfinite(_rollouts).all(axis=(1, 2))
+            rejected = np.zeros_like(finite)
+            rejected[finite] = self._reject_rollouts(_rollouts[finite])
+            stats["retries"] += int(np.sum(~finite))
+            stats["rejected"] += int(np.sum(rejected))
+            failed = failed[~finite | rejected]
 
-        return np.array(batch_sample), np.array(ball_color)
+        return rollouts
+
+    def render_rollouts(
+        self,
+        rollouts,
+        img_size=32,
+        color=True,
+        noise_level=0.1,
+        constant_color=True,
+        dtype=np.float32,
+        render=True,
+    ):
+        """Adds noise to phase space rollouts, and renders them
+
+        Args:
+            rollouts (ndarray): Array of shape (Batch, state_size, Nframes), as returned
+                by sample_random_states. It is not modified.
+            See sample_random_rollouts for the other arguments.
+        Returns:
+            See sample_random_rollouts.
+        """
+        if noise_level > 0.0:
+            rollouts = rollouts + (
+                np.random.randn(*rollouts.shape)
+                * noise_level
+                * self.get_max_noise_std()
+            )
+
+        self._rollout = rollouts[-1]
+        if not render:
+            centers, radii, ball_colors = self._scene_batch(
+                rollouts, img_size, constant_color
+            )
+            scene = dict(
+                centers=centers,
+                radii=radii,
+                background=np.array(self._default_background_color),
+            )
+            return scene, ball_colors
+        return self._draw_batch(rollouts, img_size, color, constant_color, dtype)
 
     def physical_properties(self, vec_length, dtype=np.float32):
         if vec_length <= 0:
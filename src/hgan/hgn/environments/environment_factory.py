@@ -5,7 +5,7 @@ import sys
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from environment import Environment  # noqa: E402
+from environment import Environment, IntegrationBudgetExceeded  # noqa: F401, E402
 from pendulum import Pendulum  # noqa: F401, E402
 from spring import Spring  # noqa: F401, E402
 from gravity import NObjectGravity  # noqa: F401, E402
@@ -19,25 +19,38 @@ class EnvFactory:
     _name_to_env = {cl.__name__: cl for cl in Environment.__subclasses__()}
 
     @staticmethod
-    def get_environment(name, **kwargs):
+    def get_environment(name, backend="numpy", **kwargs):
         """Return an environment object based on the environment identifier.
 
         Args:
             name (string); name of the class of the concrete Environment.
+            backend (string): 'numpy', or 'jax' for an Environment that integrates and
+                renders rollouts with jit-compiled JAX functions (see jax_backend).
             **kwargs: args supplied to the constructor of the object of class name.
 
         Raises:
             (NameError): if the given environment type is not supported.
+            (ValueError): if the given backend is not supported.
 
         Returns:
             (Environment): concrete instantiation of the Environment.
         """
+        if backend == "numpy":
+            name_to_env = EnvFactory._name_to_env
+        elif backend == "jax":
+            # JAX is only imported when it is used
+            from jax_backend import JAX_ENVIRONMENTS
+
+            name_to_env = JAX_ENVIRONMENTS
+        else:
+            raise ValueError(f"Unknown backend {backend}")
+
         try:
-            return EnvFactory._name_to_env[name](**kwargs)
+            return name_to_env[name](**kwargs)
         except KeyError:
             msg = "%s is not a supported type by Environment." % (name)
             msg += "Available types are: " + "".join(
-                "%s " % eef for eef in EnvFactory._name_to_env.keys()
+                "%s " % eef for eef in name_to_env.keys()
             )
             raise NameError(msg)
 
@@ -1,11 +1,125 @@
-import warnings
-
-import cv2
 import numpy as np
 
 from environment import Environment, visualize_rollout
 
 
+def gravitational_forces(q, mass, g, softening=0.0, xp=np):
+    """Exact pairwise gravitational forces, for a batch of systems (O(N^2))
+
+    Args:
+        q (np.ndarray): Object positions of shape (batch_size, n_objects, 2)
+        mass (np.ndarray): Object masses of shape (n_objects,) or (batch_size, n_objects)
+        g (float or np.ndarray): Gravitational constant, or one per system (batch_size,)
+        softening (float): Softening length eps. Distances r are replaced with
+            sqrt(r^2 + eps^2), to avoid the singularity at r = 0.
+        xp (module): Array module of the inputs (numpy or jax.numpy)
+
+    Returns:
+        forces (np.ndarray): Forces on each object, of shape (batch_size, n_objects, 2)
+    """
+    n_objects = q.shape[1]
+    mass = xp.broadcast_to(mass, q.shape[:-1])
+    g = xp.reshape(g, (-1, 1, 1))
+
+    # (batch_size, i, j, d) array of q_j - q_i
+    displacement = q[:, np.newaxis, :, :] - q[:, :, np.newaxis, :]
+    distance2 = xp.sum(displacement**2, axis=-1) + softening**2
+    # No self-interaction
+    distance2 = xp.where(xp.eye(n_objects, dtype=bool), xp.inf, distance2)
+
+    weights = mass[:, np.newaxis, :] * distance2**-1.5
+    return g * mass[..., np.newaxis] * xp.einsum("bij,bijd->bid", weights, displacement)
+
+
+def cell_gravitational_forces(q, mass, g, softening=0.0, objects_per_cell=None):
+    """Approximate gravitational forces, for a batch of systems, using a cell list
+
+    Each system is divided into a square grid of cells. Objects in the same or in
+    adjacent cells interact directly; all other cells act as a single object with
+    the total mass of the cell, at its center of mass. This is a single level grid,
+    not a tree code such as Barnes-Hut, so it does not reach O(N log N): every object
+    interacts with all O(sqrt(N)) cells and with the O(sqrt(N)) objects of its
+    neighbouring cells, i.e. O(N^1.5) time and memory instead of O(N^2). That holds
+    for objects spread evenly over their bounding box. The near field is padded to the
+    most populated cell, so when objects cluster in a few cells, it degrades towards
+    O(N^2).
+
+    Args:
+        objects_per_cell (float, optional): Average number of objects per cell.
+            Defaults to sqrt(n_objects) / 4.
+        See gravitational_forces for the other arguments.
+
+    Returns:
+        forces (np.ndarray): Forces on each object, of shape (batch_size, n_objects, 2)
+    """
+    batch_size, n_objects, _ = q.shape
+    mass = np.broadcast_to(mass, q.shape[:-1])
+    g = np.reshape(g, (-1, 1, 1))
+    batch = np.arange(batch_size)[:, np.newaxis]
+
+    if objects_per_cell is None:
+        objects_per_cell = max(np.sqrt(n_objects) / 4, 1)
+    n_side = max(1, int(np.ceil(np.sqrt(n_objects / objects_per_cell))))
+    n_cells = n_side**2
+
+    # Grid coordinates and index of the cell of every object
+    lo = q.min(axis=1, keepdims=True)
+    extent = np.maximum(q.max(axis=1, keepdims=True) - lo, 1e-12)
+    object_xy = np.clip(((q - lo) / extent * n_side).astype(int), 0, n_side - 1)
+    object_cell = object_xy[..., 0] * n_side + object_xy[..., 1]
+
+    # Total mass and center of mass of every cell
+    cell_mass = np.zeros((batch_size, n_cells))
+    np.add.at(cell_mass, (batch, object_cell), mass)
+    cell_com = np.zeros((batch_size, n_cells, 2))
+    np.add.at(cell_com, (batch, object_cell), mass[..., np.newaxis] * q)
+    cell_com /= np.maximum(cell_mass, 1e-300)[..., np.newaxis]
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Far field: cells that are not adjacent to the cell of the object
+        cell_xy = np.stack(np.divmod(np.arange(n_cells), n_side), axis=-1)
+        far = np.abs(cell_xy - object_xy[:, :, np.newaxis]).max(axis=-1) > 1
+        far &= cell_mass[:, np.newaxis] > 0
+        displacement = cell_com[:, np.newaxis] - q[:, :, np.newaxis]
+        distance2 = np.sum(displacement**2, axis=-1) + softening**2
+        weights = np.where(far, cell_mass[:, np.newaxis] * distance2**-1.5, 0.0)
+        forces = np.einsum("bnc,bncd->bnd", weights, displacement)
+
+        # Near field: objects in the same and adjacent cells, padded to the size of the
+        # largest cell with index n_objects
+        order = np.argsort(object_cell, axis=1, kind="stable")
+        sorted_cells = np.take_along_axis(object_cell, order, axis=1)
+        counts = np.zeros((batch_size, n_cells), dtype=int)
+        np.add.at(counts, (batch, object_cell), 1)
+        starts = np.cumsum(counts, axis=1) - counts
+        slots = np.arange(n_objects) - np.take_along_axis(starts, sorted_cells, axis=1)
+        members = np.full((batch_size, n_cells, counts.max()), n_objects)
+        members[batch, sorted_cells, slots] = order
+
+        offsets = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+        neighbour_xy = object_xy[:, :, np.newaxis] + offsets
+        inside = ((neighbour_xy >= 0) & (neighbour_xy < n_side)).all(axis=-1)
+        neighbour_cell = np.where(
+            inside, neighbour_xy[..., 0] * n_side + neighbour_xy[..., 1], 0
+        )
+        neighbours = members[batch[..., np.newaxis], neighbour_cell]
+        neighbours = np.where(inside[..., np.newaxis], neighbours, n_objects)
+        neighbours = neighbours.reshape(batch_size, n_objects, -1)
+        # No self-interaction
+        neighbours[neighbours == np.arange(n_objects)[:, np.newaxis]] = n_objects
+        valid = neighbours < n_objects
+        neighbours = np.minimum(neighbours, n_objects - 1)
+
+        displacement = q[batch[..., np.newaxis], neighbours] - q[:, :, np.newaxis]
+        distance2 = np.sum(displacement**2, axis=-1) + softening**2
+        weights = np.where(
+            valid, mass[batch[..., np.newaxis], neighbours] * distance2**-1.5, 0.0
+        )
+        forces += np.einsum("bnk,bnkd->bnd", weights, displacement)
+
+    return g * mass[..., np.newaxis] * forces
+
+
 class NObjectGravity(Environment):
 
     """N Object Gravity Atraction System
@@ -17,31 +131,46 @@ class NObjectGravity(Environment):
     """
 
     WORLD_SIZE = 3.0
+    N_BALL_COLORS = 3
     PHYSICAL_PROPERTIES = ("mass", "g")
 
-    def __init__(self, mass, g, orbit_noise=0.01, q=None, p=None):
+    def __init__(
+        self,
+        mass,
+        g,
+        orbit_noise=0.01,
+        softening=0.0,
+        approximation_threshold=256,
+        min_separation=None,
+        q=None,
+        p=None,
+    ):
         """Contructor for spring system
 
         Args:
             mass (list): List of floats corresponding to object masses (kg).
             g (float): Constant for the intensity of gravitational field (m^3/kg*s^2)
             orbit_noise (float, optional): Noise for object orbits when sampling initial conditions
+            softening (float, optional): Softening length (m) of the gravitational
+                interaction, to avoid singular forces on close encounters. Defaults to 0
+            approximation_threshold (int, optional): Forces are approximated with a cell
+                list in O(N^1.5) (see cell_gravitational_forces) for more objects than
+                this. None to always compute exact forces. Defaults to 256
+            min_separation (float, optional): Rollouts in which objects get closer than
+                this (m) are rejected, and sampled again (see _reject_rollouts). Objects
+                start out 2 * radius * sin(pi / n_objects) apart, so with many objects
+                this has to be well below that. Defaults to None (no rejection)
             q (ndarray, optional): Object generalized positions in 2-D space: Positions (m). Defaults to None
             p (ndarray, optional): Object generalized momentums in 2-D space : Linear momentums (kg*m/s). Defaults to None
-        Raises:
-            NotImplementedError: If more than 7 objects are considered
         """
         self.mass = mass
         self.colors = ["r", "y", "g", "b", "c", "p", "w"]
         self.n_objects = len(mass)
         self.g = g
         self.orbit_noise = orbit_noise
-        if self.n_objects > 3:
-            raise NotImplementedError(
-                "Gravity interaction for "
-                + str(self.n_objects)
-                + " bodies is not implemented."
-            )
+        self.softening = softening
+        self.approximation_threshold = approximation_threshold
+        self.min_separation = min_separation
         super().__init__(q=q, p=p)
 
     def set(self, q, p):
@@ -89,8 +218,7 @@ class NObjectGravity(Environment):
         elif self.n_objects == 3:
             return (0.9, 1.2)
         else:
-            warnings.warn("Gravity for n > 3 objects can have undefined behavior.")
-            return (0.3, 0.5)
+            return (1.0, 2.0)
 
     def _dynamics(self, t, states):
         """Defines system dynamics
@@ -103,94 +231,94 @@ class NObjectGravity(Environment):
         Returns:
             equations (numpy.ndarray): Numpy array with derivatives of q and p w.r.t. time
         """
-        # Convert states to n_object arrays of q and p
-        states_resh = states.reshape(2, self.n_objects, 2)
-        dyn = np.zeros_like(states_resh)
-        states_q = states_resh[0, :, :]
-        states_p = states_resh[1, :, :]
-        dyn[0, :, :] = states_p / (np.array(self.mass)[:, np.newaxis])
-
-        # Distance calculation
-        object_distance = np.zeros((self.n_objects, self.n_objects))
-        for i in range(self.n_objects):
-            for j in range(i, self.n_objects):
-                object_distance[i, j] = np.linalg.norm(states_q[i] - states_q[j])
-                object_distance[j, i] = object_distance[i, j]
-        object_distance = np.power(object_distance, 3) / self.g
-
-        for d in range(2):
-            for i in range(self.n_objects):
-                mom_term = 0
-                for j in range(self.n_objects):
-                    if i != j:
-                        mom_term += (
-                            self.mass[j]
-                            * (states_q[j, d] - states_q[i, d])
-                            / object_distance[i, j]
-                        )
-                dyn[1, i, d] += mom_term * self.mass[i]
-        return dyn.reshape(-1)
-
-    def _draw(self, res=32, color=True, constant_color=True):
-        """Returns array of the environment evolution
+        return self._dynamics_batch(t, states[np.newaxis])[0]
+
+    def _dynamics_batch(self, t, states):
+        """Defines system dynamics for a batch of phase states
 
         Args:
-            res (int): Image resolution (images are square).
-            color (bool): True if RGB, false if grayscale.
-            constant_color (bool): True if rollout uses default ball color
+            t (float): Time parameter of the dynamic equations.
+            states (numpy.ndarray): Array of shape (batch_size, state_size) that contains
+                the phase states, each in the format of np.array([q,p]).reshape(-1).
+
         Returns:
-            vid (np.ndarray): Numpy array of shape (seq_len, height, width, channels)
-                containing the rendered rollout as a sequence of images.
+            equations (numpy.ndarray): Numpy array of shape (batch_size, state_size) with
+                derivatives of q and p w.r.t. time
         """
-        q = self._rollout.reshape(2, self.n_objects, 2, -1)[0]
-        length = q.shape[-1]
-        vid = np.zeros((length, res, res, 3), dtype="float")
-        if constant_color:
-            ball_colors = self._default_ball_colors
-        else:
-            ball_colors = [
-                tuple(np.random.random(3))
-                for _ in range(len(self._default_ball_colors))
-            ]
+        if (
+            self.approximation_threshold is None
+            or self.n_objects <= self.approximation_threshold
+        ):
+            return self._vector_field(states, self._dynamics_params())
+
+        states_resh = states.reshape(-1, 2, self.n_objects, 2)
+        mass = np.array(self.mass)
+        dq = states_resh[:, 1] / mass[:, np.newaxis]
+        dp = cell_gravitational_forces(states_resh[:, 0], mass, self.g, self.softening)
+        return np.stack([dq, dp], axis=1).reshape(states.shape)
+
+    def _dynamics_params(self):
+        return super()._dynamics_params() | {"softening": np.float64(self.softening)}
+
+    @staticmethod
+    def _vector_field(states, params, xp=np):
+        # Forces are always exact here
+        mass = params["mass"]
+        states_resh = states.reshape(-1, 2, mass.shape[-1], 2)
+        dq = states_resh[:, 1] / mass[:, np.newaxis]
+        dp = gravitational_forces(
+            states_resh[:, 0], mass, params["g"], params["softening"], xp=xp
+        )
+        return xp.stack([dq, dp], axis=1).reshape(states.shape)
+
+    def _reject_rollouts(self, rollouts):
+        """Rejects rollouts with a near collision
+
+        Rollouts are rejected if any two objects are closer than min_separation, in
+        any of their frames (including the initial conditions). Close approaches in
+        between frames go unnoticed.
+
+        Args:
+            rollouts (np.ndarray): Rollouts of shape (batch_size, state_size, n_frames).
+
+        Returns:
+            (np.ndarray): Boolean array of shape (batch_size,), True for rollouts with a
+                near collision.
+        """
+        rejected = np.zeros(len(rollouts), dtype=bool)
+        if not self.min_separation or self.n_objects < 2:
+            return rejected
+        i, j = np.triu_indices(self.n_objects, k=1)
+        # One frame at a time, to keep memory linear in the number of frames
+        for q in self._object_positions(rollouts).transpose(1, 0, 2, 3):
+            distance = np.linalg.norm(q[:, j] - q[:, i], axis=-1)
+            rejected |= distance.min(axis=-1) < self.min_separation
+        return rejected
+
+    def _is_separable(self):
+        return True
+
+    def _object_positions(self, rollouts):
+        """Returns the positions of all objects, in world space
+
+        Args:
+            rollouts (np.ndarray): Rollouts of shape (batch_size, 4 * n_objects, n_frames)
+        Returns:
+            positions (np.ndarray): Array of shape (batch_size, n_frames, n_objects, 2)
+        """
+        q = rollouts.reshape(len(rollouts), 2, self.n_objects, 2, -1)[:, 0]
+        return q.transpose(0, 3, 1, 2)
+
+    def _object_radii(self, res):
         space_res = 2.0 * self.get_world_size() / res
         if self.n_objects == 2:
             factor = 0.55
         else:
             factor = 0.25
-        for t in range(length):
-            for n in range(self.n_objects):
-                brush = self.colors[n]
-                if brush == "r":
-                    vid[t] = cv2.circle(
-                        vid[t],
-                        self._world_to_pixels(q[n, 0, t], q[n, 1, t], res),
-                        int(self.mass[n] * factor / space_res),
-                        ball_colors[0],
-                        -1,
-                    )
-                elif brush == "y":
-                    vid[t] = cv2.circle(
-                        vid[t],
-                        self._world_to_pixels(q[n, 0, t], q[n, 1, t], res),
-                        int(self.mass[n] * factor / space_res),
-                        ball_colors[1],
-                        -1,
-                    )
-
-                elif brush == "g":
-                    vid[t] = cv2.circle(
-                        vid[t],
-                        self._world_to_pixels(q[n, 0, t], q[n, 1, t], res),
-                        int(self.mass[n] * factor / space_res),
-                        ball_colors[2],
-                        -1,
-                    )
-            vid[t] = cv2.blur(cv2.blur(vid[t], (2, 2)), (2, 2))
-        vid += self._default_background_color
-        vid[vid > 1.0] = 1.0
-        if not color:
-            vid = np.expand_dims(np.max(vid, axis=-1), -1)
-        return vid, ball_colors
+        # Ball colors (r, y, g) are reused for more than N_BALL_COLORS objects
+        return np.array(
+            [int(self.mass[n] * factor / space_res) for n in range(self.n_objects)]
+        )
 
     def _sample_init_conditions(self, radius_bound):
         """Samples random initial conditions for the environment
@@ -206,17 +334,14 @@ class NObjectGravity(Environment):
         pos = np.random.rand(2) * 2.0 - 1
         pos = (pos / np.sqrt((pos**2).sum())) * radius
 
-        # velocity that yields a circular orbit
+        # velocity that yields a circular orbit of (unit mass) objects on a regular
+        # polygon: v^2 = sum_k 1 / sin(k * pi / n) / (4 * radius)
         vel = self.__rotate2d(pos, theta=np.pi / 2)
         if np.random.randn() < 0.5:
             vel = -vel
-        if self.n_objects == 2:
-            factor = 2
-            vel /= factor * radius**1.5
-
-        else:
-            factor = np.sqrt(np.sin(np.pi / 3) / (2 * np.cos(np.pi / 6) ** 2))
-            vel *= factor / (radius**1.5)
+        k = np.arange(1, self.n_objects)
+        factor = np.sqrt(np.sum(1 / np.sin(k * np.pi / self.n_objects)) / 4)
+        vel *= factor / (radius**1.5)
 
         states[0, 0, :] = pos
         states[1, 0, :] = vel
@@ -0,0 +1,78 @@
+"""Fixed-step integrators that advance a whole batch of phase states at once.
+
+All integrators take a function f(t, states) -> derivatives, where states is an
+array of shape (batch_size, state_size), and return an array of shape
+(batch_size, state_size, len(t_eval)) with the states at each of the times t_eval.
+The integration starts at t_eval[0], from the initial states y0.
+"""
+import numpy as np
+
+
+def rk4(f, y0, t_eval, substeps=1):
+    """Integrates a batch of states with the classical 4th order Runge-Kutta method.
+
+    Args:
+        f (callable): Batched dynamics f(t, states).
+        y0 (np.ndarray): Initial states of shape (batch_size, state_size).
+        t_eval ([float]): Times at which to store the states.
+        substeps (int): Number of integration steps between consecutive times in t_eval.
+
+    Returns:
+        (np.ndarray): States of shape (batch_size, state_size, len(t_eval)).
+    """
+    y = np.array(y0, dtype=float)
+    ys = np.empty(y.shape + (len(t_eval),))
+    ys[..., 0] = y
+
+    for i in range(1, len(t_eval)):
+        t = t_eval[i - 1]
+        h = (t_eval[i] - t_eval[i - 1]) / substeps
+        for _ in range(substeps):
+            k1 = f(t, y)
+            k2 = f(t + h / 2, y + h / 2 * k1)
+            k3 = f(t + h / 2, y + h / 2 * k2)
+            k4 = f(t + h, y + h * k3)
+            y = y + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+            t += h
+        ys[..., i] = y
+
+    return ys
+
+
+def leapfrog(f, y0, t_eval, substeps=1):
+    """Integrates a batch of states with the (symplectic) leapfrog method.
+
+    The states are expected to be of the form [q, p], with the generalized positions
+    in the first half and the generalized momenta in the second half. The Hamiltonian
+    must be separable, i.e. dq/dt must only depend on p and dp/dt only on q, which lets
+    us reuse the momentum update at the end of a step for the start of the next one.
+
+    Args:
+        f (callable): Batched dynamics f(t, states).
+        y0 (np.ndarray): Initial states of shape (batch_size, state_size).
+        t_eval ([float]): Times at which to store the states.
+        substeps (int): Number of integration steps between consecutive times in t_eval.
+
+    Returns:
+        (np.ndarray): States of shape (batch_size, state_size, len(t_eval)).
+    """
+    y = np.array(y0, dtype=float)
+    n = y.shape[-1] // 2
+    ys = np.empty(y.shape + (len(t_eval),))
+    ys[..., 0] = y
+
+    q, p = y[..., :n], y[..., n:]
+    dpdt = f(t_eval[0], y)[..., n:]
+    for i in range(1, len(t_eval)):
+        t = t_eval[i - 1]
+        h = (t_eval[i] - t_eval[i - 1]) / substeps
+        for _ in range(substeps):
+            p_half = p + h / 2 * dpdt
+            dqdt = f(t + h / 2, np.concatenate((q, p_half), axis=-1))[..., :n]
+            q = q + h * dqdt
+            dpdt = f(t + h, np.concatenate((q, p_half), axis=-1))[..., n:]
+            p = p_half + h / 2 * dpdt
+            t += h
+        ys[..., i] = np.concatenate((q, p), axis=-1)
+
+    return ys
@@ -0,0 +1,220 @@
+"""JAX backend for the environments.
+
+Rollouts of a whole batch of initial conditions are integrated by a single
+jit-compiled function, vmapped over the initial conditions and scanned over time, and
+rendered with render_balls_jax. Both run in double precision, like with NumPy, with
+64-bit types only enabled for the duration of the calls.
+Compiled functions are cached by system class, so that new instances of a system
+(e.g. with other physical parameters) do not trigger a recompilation.
+
+Initial conditions, noise and ball colors are still sampled with NumPy, so that for the
+same seed, sample_random_rollouts returns the same videos and colors as with the
+NumPy backend.
+"""
+import functools
+
+import jax
+import jax.numpy as jnp
+import numpy as np
+
+from chaotic_pendulum import ChaoticPendulum
+from gravity import NObjectGravity
+from pendulum import Pendulum
+from spring import Spring
+
+
+def _rk4_step(f, y, h):
+    k1 = f(y)
+    k2 = f(y + h / 2 * k1)
+    k3 = f(y + h / 2 * k2)
+    k4 = f(y + h * k3)
+    return y + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+
+
+def _leapfrog_step(f, y, dpdt, h):
+    # dp/dt at the end of a step is reused at the start of the next one
+    n = y.shape[-1] // 2
+    q, p = y[:n], y[n:]
+    p_half = p + h / 2 * dpdt
+    q = q + h * f(jnp.concatenate((q, p_half)))[:n]
+    dpdt = f(jnp.concatenate((q, p_half)))[n:]
+    p = p_half + h / 2 * dpdt
+    return jnp.concatenate((q, p)), dpdt
+
+
+@functools.partial(jax.jit, static_argnames=("res", "color", "dtype"))
+def render_balls_jax(
+    centers, radii, colors, res, background_color, color=True, dtype=np.float32
+):
+    """Renders filled balls on a uniform background, as a jit-compiled JAX function.
+
+    The JAX counterpart of rendering.render_balls, with the same arguments and outputs.
+
+    Args:
+        See rendering.render_balls.
+
+    Returns:
+        (jax.Array): Frames of shape (batch_size, n_frames, res, res, 3 if color else 1)
+    """
+    batch_size, n_frames, n_objects, _ = centers.shape
+    radii = jnp.broadcast_to(radii, (batch_size, n_objects))
+    colors = jnp.broadcast_to(colors, (batch_size, n_objects, 3)).astype(jnp.float32)
+
+    pixels = jnp.arange(res)
+    vid = jnp.zeros((batch_size, n_frames, res, res, 3), dtype=jnp.float32)
+    # Later balls are drawn on top
+    for n in range(n_objects):
+        x = centers[:, :, n, 0, None, None]
+        y = centers[:, :, n, 1, None, None]
+        radius = radii[:, n, None, None, None]
+        inside = (pixels[None, :] - x) ** 2 + (pixels[:, None] - y) ** 2 <= radius**2
+        inside &= radius >= 0
+        vid = jnp.where(inside[..., None], colors[:, n, None, None, None, :], vid)
+
+    # cv2.blur with a (2, 2) kernel: mean of each pixel with its predecessors, with a
+    # reflect-101 border.
+    for _ in range(2):
+        vid = jnp.pad(vid, ((0, 0), (0, 0), (1, 0), (1, 0), (0, 0)), mode="reflect")
+        vid = (
+            vid[:, :, :-1, :-1]
+            + vid[:, :, 1:, :-1]
+            + vid[:, :, :-1, 1:]
+            + vid[:, :, 1:, 1:]
+        ) / 4
+
+    vid = vid + jnp.asarray(background_color, dtype=jnp.float32)
+    vid = jnp.minimum(vid, 1.0)
+    if not color:
+        vid = vid.max(axis=-1, keepdims=True)
+
+    if dtype == np.uint8:
+        return jnp.round(vid * 255).astype(jnp.uint8)
+    return vid.astype(dtype)
+
+
+@functools.lru_cache(maxsize=None)
+def _rollout_function(vector_field, integrator, n_frames, steps_per_frame):
+    def rollout(params, y0, h):
+        def f(y):
+            return vector_field(y[np.newaxis], params, jnp)[0]
+
+        if integrator == "rk4":
+
+            def frame(y, _):
+                y = jax.lax.fori_loop(
+                    0, steps_per_frame, lambda _, y: _rk4_step(f, y, h), y
+                )
+                return y, y
+
+            _, ys = jax.lax.scan(frame, y0, None, length=n_frames - 1)
+        elif integrator == "leapfrog":
+
+            def frame(carry, _):
+                carry = jax.lax.fori_loop(
+                    0, steps_per_frame, lambda _, c: _leapfrog_step(f, *c, h), carry
+                )
+                return carry, carry[0]
+
+            dpdt = f(y0)[y0.shape[-1] // 2 :]
+            _, ys = jax.lax.scan(frame, (y0, dpdt), None, length=n_frames - 1)
+        else:
+            raise ValueError(f"Unknown integrator {integrator}")
+
+        # (n_frames, state_size) => (state_size, n_frames)
+        return jnp.concatenate([y0[np.newaxis], ys]).T
+
+    return jax.jit(jax.vmap(rollout, in_axes=(None, 0, None)))
+
+
+def simulate(
+    vector_field,
+    params,
+    y0,
+    delta_time,
+    n_frames,
+    integrator="rk4",
+    steps_per_frame=2,
+):
+    """Integrates a batch of rollouts with a jit-compiled fixed step integrator.
+
+    Args:
+        vector_field (callable): Dynamics vector_field(states, params, xp) of a system,
+            as defined by Environment._vector_field.
+        params (dict): Physical parameters of the system, as returned by
+            Environment._dynamics_params.
+        y0 (np.ndarray): Initial phase states of shape (batch_size, state_size).
+        delta_time (float): Frame interval (in seconds).
+        n_frames (int): Number of frames, including the initial states.
+        integrator (str): One of 'rk4' or 'leapfrog' (for separable systems only).
+        steps_per_frame (int): Number of integration steps per frame.
+
+    Returns:
+        (np.ndarray): Rollouts of shape (batch_size, state_size, n_frames).
+    """
+    rollout = _rollout_function(vector_field, integrator, n_frames, steps_per_frame)
+    # Integrate in double precision, without switching on 64-bit types globally
+    with jax.enable_x64(True):
+        return np.asarray(rollout(params, y0, delta_time / steps_per_frame))
+
+
+class JaxEnvironment:
+    """Mixin for an Environment, that integrates and renders rollouts with JAX.
+
+    Only the fixed step integrators ('rk4' and 'leapfrog', see _integrate_fixed_step)
+    and the rendering run in JAX. Analytic solutions and 'solve_ivp' are left to the
+    Environment, and forces are always exact (i.e. NObjectGravity.approximation_threshold
+    is ignored).
+    """
+
+    def _integrate_fixed_step(self, y0, t_eval, integrator, steps_per_frame):
+        return simulate(
+            type(self)._vector_field,
+            self._dynamics_params(),
+            np.asarray(y0, dtype=float),
+            t_eval[1] - t_eval[0] if len(t_eval) > 1 else 0.0,
+            len(t_eval),
+            integrator=integrator,
+            steps_per_frame=steps_per_frame,
+        )
+
+    def _draw_batch(
+        self, rollouts, res=32, color=True, constant_color=True, dtype=np.float32
+    ):
+        centers, radii, ball_colors = self._scene_batch(rollouts, res, constant_color)
+        with jax.enable_x64(True):
+            vids = render_balls_jax(
+                centers,
+                radii,
+                # Objects beyond N_BALL_COLORS reuse the ball colors
+                ball_colors[:, np.arange(len(radii)) % self.N_BALL_COLORS],
+                res,
+                np.asarray(self._default_background_color),
+                color=color,
+                dtype=dtype,
+            )
+            return np.asarray(vids), ball_colors
+
+
+class JaxSpring(JaxEnvironment, Spring):
+    pass
+
+
+class JaxPendulum(JaxEnvironment, Pendulum):
+    pass
+
+
+class JaxChaoticPendulum(JaxEnvironment, ChaoticPendulum):
+    pass
+
+
+class JaxNObjectGravity(JaxEnvironment, NObjectGravity):
+    pass
+
+
+# JAX environments, by the name of the Environment they derive from
+JAX_ENVIRONMENTS = {
+    "Spring": JaxSpring,
+    "Pendulum": JaxPendulum,
+    "ChaoticPendulum": JaxChaoticPendulum,
+    "NObjectGravity": JaxNObjectGravity,
+}
@@ -1,5 +1,5 @@
-import cv2
 import numpy as np
+from scipy.special import ellipj, ellipk, ellipkinc
 
 from environment import Environment, visualize_rollout
 
@@ -80,40 +80,104 @@ class Pendulum(Environment):
             -self.g * self.mass * self.length * np.sin(states[0]),
         ]
 
-    def _draw(self, res=32, color=True, constant_color=True):
-        """Returns array of the environment evolution
+    def _dynamics_batch(self, t, states):
+        """Defines system dynamics for a batch of phase states
 
         Args:
-            res (int): Image resolution (images are square).
-            color (bool): True if RGB, false if grayscale.
-            constant_color (bool): True if rollout uses default ball color
+            t (float): Time parameter of the dynamic equations.
+            states (np.ndarray): Phase states at time t, of shape (batch_size, 2)
+
         Returns:
-            vid (np.ndarray): Rendered rollout as a sequence of images
+            equations (np.ndarray): Movement equations of the physical system,
+                of shape (batch_size, 2)
         """
-        q = self._rollout[0, :]
-        length = len(q)
-        vid = np.zeros((length, res, res, 3), dtype="float")
-        if constant_color:
-            ball_color = self._default_ball_colors[0]
-        else:
-            ball_color = tuple(np.random.random(3))
+        return self._vector_field(states, self._dynamics_params())
+
+    @staticmethod
+    def _vector_field(states, params, xp=np):
+        mass, length, g = params["mass"], params["length"], params["g"]
+        return xp.stack(
+            [
+                states[:, 1] / (mass * length * length),
+                -g * mass * length * xp.sin(states[:, 0]),
+            ],
+            axis=1,
+        )
+
+    def _is_separable(self):
+        return True
+
+    def _simulate_analytically(self, y0, t_eval):
+        """Evaluates the exact solution of the pendulum, in Jacobi elliptic functions
+
+        With w0 = sqrt(g/l) and k^2 = sin^2(q0/2) + (q0' / (2*w0))^2 (the energy):
+            if k < 1 (oscillation): sin(q/2) = k * sn(w0*t + u0 | k^2)
+            else (rotation): q/2 = am(k*w0*t + u0 | 1/k^2)
+
+        Args:
+            y0 (np.ndarray): Initial phase states of shape (batch_size, 2)
+            t_eval ([float]): Times at which to evaluate the solution.
+
+        Returns:
+            (np.ndarray): Rollouts of shape (batch_size, 2, len(t_eval))
+        """
+        inertia = self.mass * self.length * self.length
+        w0 = np.sqrt(self.g / self.length)
+        t = np.asarray(t_eval) - t_eval[0]
+
+        q0, dq0 = y0[:, 0], y0[:, 1] / inertia
+        # Oscillations are about the closest multiple of 2*pi
+        turns = np.round(q0 / (2 * np.pi)) * 2 * np.pi
+        q0 = q0 - turns
+        k = np.sqrt(np.sin(q0 / 2) ** 2 + (dq0 / (2 * w0)) ** 2)
+        oscillates = k < 1
+
+        q = np.empty((len(y0), len(t)))
+        dq = np.empty((len(y0), len(t)))
+
+        # Oscillation: q = 2 * arcsin(k * sn(u)), q' = 2 * k * w0 * cn(u)
+        _k = k[oscillates, np.newaxis]
+        _q0, _dq0 = q0[oscillates, np.newaxis], dq0[oscillates, np.newaxis]
+        m = _k**2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            sn0 = np.where(_k > 0, np.clip(np.sin(_q0 / 2) / _k, -1, 1), 0.0)
+        u0 = ellipkinc(np.arcsin(sn0), m)
+        # The half period past the turning point has the same sn but a negative cn
+        u0 = np.where(_dq0 < 0, 2 * ellipk(m) - u0, u0)
+        sn, cn, _, _ = ellipj(w0 * t + u0, m)
+        q[oscillates] = 2 * np.arcsin(_k * sn)
+        dq[oscillates] = 2 * _k * w0 * cn
+
+        # Rotation: q = 2 * am(u), q' = +-2 * k * w0 * dn(u)
+        _k = k[~oscillates, np.newaxis]
+        _q0, _dq0 = q0[~oscillates, np.newaxis], dq0[~oscillates, np.newaxis]
+        m = 1 / _k**2
+        direction = np.sign(_dq0)
+        u0 = ellipkinc(_q0 / 2, m)
+        _, _, dn, am = ellipj(direction * _k * w0 * t + u0, m)
+        q[~oscillates] = 2 * am
+        dq[~oscillates] = direction * 2 * _k * w0 * dn
+
+        q += turns[:, np.newaxis]
+        return np.stack([q, dq * inertia], axis=1)
+
+    def _object_positions(self, rollouts):
+        """Returns the position of the pendulum bob, in world space
+
+        Args:
+            rollouts (np.ndarray): Rollouts of shape (batch_size, 2, n_frames)
+        Returns:
+            positions (np.ndarray): Array of shape (batch_size, n_frames, 1, 2)
+        """
+        q = rollouts[:, 0, :]
+        positions = np.stack(
+            [self.length * np.sin(q), self.length * np.cos(q)], axis=-1
+        )
+        return positions[:, :, np.newaxis, :]
+
+    def _object_radii(self, res):
         space_res = 2.0 * self.get_world_size() / res
-        for t in range(length):
-            vid[t] = cv2.circle(
-                vid[t],
-                self._world_to_pixels(
-                    self.length * np.sin(q[t]), self.length * np.cos(q[t]), res
-                ),
-                int(self.mass / space_res),
-                ball_color,
-                -1,
-            )
-            vid[t] = cv2.blur(cv2.blur(vid[t], (2, 2)), (2, 2))
-        vid += self._default_background_color
-        vid[vid > 1.0] = 1.0
-        if not color:
-            vid = np.expand_dims(np.max(vid, axis=-1), -1)
-        return vid, ball_color
+        return np.array([int(self.mass / space_res)])
 
     def _sample_init_conditions(self, radius_bound):
         """Samples random initial conditions for the environment
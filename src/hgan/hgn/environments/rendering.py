@@ -0,0 +1,189 @@
+"""Vectorized rendering of balls for a batch of rollouts.
+
+Produces the same frames as drawing filled circles with cv2.circle, followed by two
+passes of cv2.blur with a (2, 2) kernel, for all frames of all rollouts at once.
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+# Number of pixels rendered at once; small enough for a chunk of frames to stay in cache
+# while it goes through all the rendering steps.
+CHUNK_PIXELS = 2**16
+
+
+def _disk_offsets(radius):
+    """Returns the (dy, dx) pixel offsets covered by a filled circle of the given radius."""
+    d = np.arange(-radius, radius + 1)
+    dy, dx = np.meshgrid(d, d, indexing="ij")
+    inside = dy**2 + dx**2 <= radius**2
+    return dy[inside], dx[inside]
+
+
+def _double_box_blur(x, axis, step):
+    """Applies a box blur of size 2 twice along axis, without normalization (i.e. x16).
+
+    cv2.blur with a kernel of size 2 averages each pixel with its predecessor, reflecting
+    the border (reflect-101), so that two passes amount to a (1, 2, 1) / 4 kernel, except
+    for the first 2 pixels, which both end up as the mean of the first 2 pixels.
+    Neighbouring pixels are step elements apart along axis.
+    """
+
+    def s(start, stop=None):
+        index = [slice(None)] * x.ndim
+        index[axis] = slice(start, stop)
+        return tuple(index)
+
+    k = step
+    out = np.empty_like(x)
+    np.add(x[s(None, -2 * k)], x[s(2 * k)], out=out[s(2 * k)])
+    out[s(2 * k)] += x[s(k, -k)]
+    out[s(2 * k)] += x[s(k, -k)]
+    np.add(x[s(0, k)], x[s(k, 2 * k)], out=out[s(0, k)])
+    out[s(0, k)] *= 2
+    out[s(k, 2 * k)] = out[s(0, k)]
+    return out
+
+
+def render_balls(
+    centers,
+    radii,
+    colors,
+    res,
+    background_color,
+    color=True,
+    dtype=np.float32,
+):
+    """Renders filled balls on a uniform background.
+
+    Args:
+        centers (np.ndarray): Integer pixel coordinates (x, y) of the ball centers, of shape
+            (batch_size, n_frames, n_objects, 2).
+        radii (np.ndarray): Integer pixel radii of the balls, of shape (n_objects,) or
+            (batch_size, n_objects). Balls with a negative radius are not drawn.
+        colors (np.ndarray): RGB colors (in [0, 1]) of the balls, of shape (n_objects, 3) or
+            (batch_size, n_objects, 3).
+        res (int): Image resolution (images are square).
+        background_color ([float]): RGB color (in [0, 1]) of the background.
+        color (bool): True if RGB, false if grayscale.
+        dtype (np.dtype): np.float32/np.float64 for values in [0, 1], or np.uint8 for values
+            in [0, 255].
+
+    Returns:
+        (np.ndarray): Frames of shape (batch_size, n_frames, res, res, 3 if color else 1)
+    """
+    batch_size, n_frames, n_objects, _ = centers.shape
+    radii = np.broadcast_to(radii, (batch_size, n_objects))
+    colors = np.broadcast_to(colors, (batch_size, n_objects, 3))
+
+    float_dtype = np.float64 if dtype == np.float64 else np.float32
+    # The blur is left unnormalized, and scaled back together with the background
+    scale = float_dtype(1 / 16)
+    background = np.tile(np.asarray(background_color, dtype=float_dtype), res)
+
+    n_channels = 3 if color else 1
+    total_frames = batch_size * n_frames
+    vids = np.empty((total_frames, res, res, n_channels), dtype=dtype)
+    centers = centers.reshape(total_frames, n_objects, 2)
+    # Index of the rollout that each frame belongs to
+    batch_index = np.repeat(np.arange(batch_size), n_frames)
+    disks = {r: _disk_offsets(r) for r in np.unique(radii) if r >= 0}
+
+    chunk_size = max(1, CHUNK_PIXELS // (res * res))
+    for start in range(0, total_frames, chunk_size):
+        stop = min(start + chunk_size, total_frames)
+        vid = np.zeros((stop - start, res, res, 3), dtype=float_dtype)
+
+        # Balls are drawn one object at a time, so that later objects are drawn on top,
+        # but for all frames at once, only touching the pixels covered by the balls.
+        for n in range(n_objects):
+            for radius, (dy, dx) in disks.items():
+                frames = start + np.flatnonzero(
+                    radii[batch_index[start:stop], n] == radius
+                )
+                if len(frames) == 0:
+                    continue
+                y = centers[frames, n, 1, np.newaxis] + dy
+                x = centers[frames, n, 0, np.newaxis] + dx
+                frames = np.broadcast_to(frames[:, np.newaxis], y.shape)
+                visible = (y >= 0) & (y < res) & (x >= 0) & (x < res)
+                frames = frames[visible]
+                vid[frames - start, y[visible], x[visible]] = colors[
+                    batch_index[frames], n
+                ]
+
+        # Blur with rows of (res * 3) values, where neighbouring columns are 3 values apart
+        vid = vid.reshape(-1, res, res * 3)
+        vid = _double_box_blur(_double_box_blur(vid, 1, 1), 2, 3)
+        vid *= scale
+        vid += background
+        np.minimum(vid, 1.0, out=vid)
+        vid = vid.reshape(-1, res, res, 3)
+        if not color:
+            vid = np.maximum(np.maximum(vid[..., 0], vid[..., 1]), vid[..., 2])
+            vid = vid[..., np.newaxis]
+
+        if dtype == np.uint8:
+            vid *= 255
+            np.round(vid, out=vid)
+        vids[start:stop] = vid
+
+    return vids.reshape(batch_size, n_frames, res, res, n_channels)
+
+
+def render_balls_torch(centers, radii, colors, res, background_color, color=True):
+    """Renders filled balls on a uniform background, on the device of the inputs.
+
+    The torch counterpart of render_balls, for rendering on the accelerator used for
+    training. Frames are returned in the (channels, n_frames, height, width) layout used
+    by the models.
+
+    Args:
+        centers (torch.Tensor): Integer pixel coordinates (x, y) of the ball centers, of
+            shape (batch_size, n_frames, n_objects, 2).
+        radii (torch.Tensor): Integer pixel radii of the balls, of shape (n_objects,) or
+            (batch_size, n_objects). Balls with a negative radius are not drawn.
+        colors (torch.Tensor): RGB colors (in [0, 1]) of the balls, of shape
+            (n_objects, 3) or (batch_size, n_objects, 3).
+        res (int): Image resolution (images are square).
+        background_color (torch.Tensor): RGB color (in [0, 1]) of the background, of shape
+            (3,) or (batch_size, 3).
+        color (bool): True if RGB, false if grayscale.
+
+    Returns:
+        (torch.Tensor): Frames of shape (batch_size, 3 if color else 1, n_frames, res, res)
+    """
+    batch_size, n_frames, n_objects, _ = centers.shape
+    device = centers.device
+    radii = radii.to(device).long().expand(batch_size, n_objects)
+    colors = colors.to(device, torch.float32).expand(batch_size, n_objects, 3)
+    background_color = torch.as_tensor(
+        background_color, dtype=torch.float32, device=device
+    ).expand(batch_size, 3)
+
+    centers = centers.long()
+    pixels = torch.arange(res, device=device)
+    vid = torch.zeros(
+        (batch_size, n_frames, 3, res, res), dtype=torch.float32, device=device
+    )
+    # Later balls are drawn on top
+    for n in range(n_objects):
+        x = centers[:, :, n, 0, None, None]
+        y = centers[:, :, n, 1, None, None]
+        radius = radii[:, n, None, None, None]
+        inside = (pixels[None, :] - x) ** 2 + (pixels[:, None] - y) ** 2 <= radius**2
+        inside &= radius >= 0
+        vid = torch.where(inside[:, :, None], colors[:, n, None, :, None, None], vid)
+
+    # cv2.blur with a (2, 2) kernel: mean of each pixel with its predecessors, with a
+    # reflect-101 border.
+    vid = vid.view(batch_size * n_frames, 3, res, res)
+    for _ in range(2):
+        vid = F.avg_pool2d(F.pad(vid, (1, 0, 1, 0), mode="reflect"), 2, stride=1)
+    vid = vid.view(batch_size, n_frames, 3, res, res)
+
+    vid = vid + background_color[:, None, :, None, None]
+    vid = vid.clamp(max=1.0)
+    if not color:
+        vid = vid.amax(dim=2, keepdim=True)
+    return vid.transpose(1, 2)
@@ -1,4 +1,3 @@
-import cv2
 import numpy as np
 
 from environment import Environment, visualize_rollout
@@ -85,39 +84,77 @@ class Spring(Environment):
             -2 * self.damping_ratio * w0 * states[1] - self.elastic_cst * states[0],
         ]
 
-    def _draw(self, res=32, color=True, constant_color=True):
-        """Returns array of the environment evolution
+    def _dynamics_batch(self, t, states):
+        """Defines system dynamics for a batch of phase states
 
         Args:
-            res (int): Image resolution (images are square).
-            color (bool): True if RGB, false if grayscale.
-            constant_color (bool): True if rollout uses default ball color
+            t (float): Time parameter of the dynamic equations.
+            states (np.ndarray): Phase states at time t, of shape (batch_size, 2)
+
+        Returns:
+            equations (np.ndarray): Movement equations of the physical system,
+                of shape (batch_size, 2)
+        """
+        return self._vector_field(states, self._dynamics_params())
+
+    @staticmethod
+    def _vector_field(states, params, xp=np):
+        mass, elastic_cst = params["mass"], params["elastic_cst"]
+        # angular freq of the undamped oscillator
+        w0 = xp.sqrt(elastic_cst / mass)
+        # dynamics of the damped oscillator
+        return xp.stack(
+            [
+                states[:, 1] / mass,
+                -2 * params["damping_ratio"] * w0 * states[:, 1]
+                - elastic_cst * states[:, 0],
+            ],
+            axis=1,
+        )
+
+    def _is_separable(self):
+        # Damping makes dp/dt depend on p
+        return self.damping_ratio == 0
+
+    def _simulate_analytically(self, y0, t_eval):
+        """Evaluates the solution of the undamped oscillator
+
+            q(t) = q0 * cos(w0*t) + p0 / (m*w0) * sin(w0*t)
+
+        Args:
+            y0 (np.ndarray): Initial phase states of shape (batch_size, 2)
+            t_eval ([float]): Times at which to evaluate the solution.
+
         Returns:
-            vid (np.ndarray): Rendered rollout as a sequence of images
-            ball_color (3-tuple): Color of the ball in the environment
+            (np.ndarray): Rollouts of shape (batch_size, 2, len(t_eval)), or None if the
+                oscillator is damped.
         """
-        q = self._rollout[0, :]
-        length = len(q)
-        vid = np.zeros((length, res, res, 3), dtype="float")
-        if constant_color:
-            ball_color = self._default_ball_colors[0]
-        else:
-            ball_color = tuple(np.random.random(3))
+        if self.damping_ratio != 0:
+            return None
+        # angular freq of the undamped oscillator
+        w0 = np.sqrt(self.elastic_cst / self.mass)
+        wt = w0 * (np.asarray(t_eval) - t_eval[0])
+        cos, sin = np.cos(wt), np.sin(wt)
+        q0, p0 = y0[:, 0:1], y0[:, 1:2]
+        q = q0 * cos + p0 / (self.mass * w0) * sin
+        p = p0 * cos - q0 * (self.mass * w0) * sin
+        return np.stack([q, p], axis=1)
+
+    def _object_positions(self, rollouts):
+        """Returns the position of the spring mass, in world space
+
+        Args:
+            rollouts (np.ndarray): Rollouts of shape (batch_size, 2, n_frames)
+        Returns:
+            positions (np.ndarray): Array of shape (batch_size, n_frames, 1, 2)
+        """
+        q = rollouts[:, 0, :]
+        positions = np.stack([np.zeros_like(q), q], axis=-1)
+        return positions[:, :, np.newaxis, :]
+
+    def _object_radii(self, res):
         space_res = 2.0 * self.get_world_size() / res
-        for t in range(length):
-            vid[t] = cv2.circle(
-                vid[t],
-                self._world_to_pixels(0, q[t], res),
-                int(self.mass / space_res),
-                ball_color,
-                -1,
-            )
-            vid[t] = cv2.blur(cv2.blur(vid[t], (2, 2)), (2, 2))
-        vid += self._default_background_color
-        vid[vid > 1.0] = 1.0
-        if not color:
-            vid = np.expand_dims(np.max(vid, axis=-1), -1)
-        return vid, ball_color
+        return np.array([int(self.mass / space_res)])
 
     def _sample_init_conditions(self, radius_bound):
         """Samples random initial conditions for the environment
@@ -16,6 +16,11 @@ class BoxRegion:
         self.max = max
         self.constant = max is None
 
+    def __repr__(self):
+        if self.constant:
+            return f"BoxRegion({self.min})"
+        return f"BoxRegion({self.min}, {self.max})"
+
     def __call__(self):
         if self.constant:
             return self.min
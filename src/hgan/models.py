@@ -405,7 +405,16 @@ class HNNSimple(nn.Module):
     """
 
     def __init__(
-        self, *, device, input_size, hidden_size, dt=0.05, ndim_physics=0, ndim_label=0
+        self,
+        *,
+        device,
+        input_size,
+        hidden_size,
+        dt=0.05,
+        ndim_physics=0,
+        ndim_label=0,
+        leapfrog="standard",
+        energy="autograd",
     ):
         """
         Parameters:
@@ -413,26 +422,81 @@ class HNNSimple(nn.Module):
             input_size (int): input size
             hidden_size (int): hidden dimension for mlp
             dt (float): timestep in integration
+            leapfrog (str): leapfrog integration scheme, one of:
+                'standard': 3 evaluations of the energy per step.
+                'fused': 2 evaluations of the energy per step, reusing the last
+                    half-kick of a step as the first half-kick of the next one.
+                    An approximation for separable Hamiltonians, identical to
+                    'standard' only if H(q, p) = T(p) + V(q).
+            energy (str): how gradients of the energy are computed, one of:
+                'autograd': with torch.autograd.grad, through a graph of the energy.
+                'analytic': in closed form, along with the energy (see AnalyticMLP).
+                    These are partial derivatives, so that with the 'standard'
+                    leapfrog scheme, the dependence of p_half on p is ignored.
         """
         super(HNNSimple, self).__init__()
 
+        assert leapfrog in ("standard", "fused"), f"Unknown leapfrog scheme {leapfrog}"
+        assert energy in ("autograd", "analytic"), f"Unknown energy gradient {energy}"
+
         self.device = device
         self.dt = dt
         self.ndim_physics = ndim_physics
         self.ndim_label = ndim_label
-        self.hnn = MLP(input_size, hidden_size, 1, nonlinearity="relu").to(device)
+        self.leapfrog = leapfrog
+        self.energy = energy
+        mlp_class = AnalyticMLP if energy == "analytic" else MLP
+        self.hnn = mlp_class(input_size, hidden_size, 1, nonlinearity="relu").to(device)
 
     def forward(self, x, n_frames):
         outputs = [x]
-        for i in range(n_frames - 1):
-            x_next, _ = self.leap_frog_step(x)
+        for x_next, _ in self.leap_frog_steps(x, n_frames - 1):
             outputs.append(x_next)
-            x = outputs[-1]
 
         outputs = torch.stack(outputs)
 
         return outputs
 
+    def _label_and_props(self, label_and_props, x):
+        if label_and_props is None:
+            label_and_props = torch.Tensor().to(
+                x.device
+            )  # Empty Tensor so we can concatenate without issues
+        return label_and_props.requires_grad_()
+
+    def _energy_grad(self, label_and_props, q, p, wrt):
+        """
+        gradient of the energy H(q, p) w.r.t. wrt
+
+        """
+        x = torch.cat((label_and_props, q, p), dim=1)
+        if self.energy == "analytic":
+            _, dx = self.hnn.energy_and_grad(x)
+            dq, dp = torch.split(
+                dx[:, -(q.shape[1] + p.shape[1]) :], [q.shape[1], p.shape[1]], dim=1
+            )
+            # Partial derivative w.r.t. q, or else p (even if the p passed in was
+            # derived from wrt)
+            return dq if wrt is q else dp
+        energy = self.hnn(x)
+        return grad(energy.sum(), wrt, create_graph=True)[0]
+
+    def leap_frog_steps(self, x, n_steps, label_and_props=None):
+        """
+        n_steps steps of leap frog integration, as a generator of (x_next, dx_next)
+
+        """
+        label_and_props = self._label_and_props(label_and_props, x)
+        if self.leapfrog == "fused":
+            dpdt = None
+            for _ in range(n_steps):
+                x, dx, dpdt = self.fused_leap_frog_step(x, label_and_props, dpdt)
+                yield x, dx
+        else:
+            for _ in range(n_steps):
+                x, dx = self.leap_frog_step(x, label_and_props)
+                yield x, dx
+
     def leap_frog_step(self, x, label_and_props=None):
         """
         one step of leap frog integration
@@ -441,27 +505,17 @@ class HNNSimple(nn.Module):
         q, p = torch.chunk(x, 2, dim=1)
         q.requires_grad_()
         p.requires_grad_()
-        if label_and_props is None:
-            label_and_props = torch.Tensor().to(
-                p.device
-            )  # Empty Tensor so we can concatenate without issues
-        label_and_props.requires_grad_()
+        label_and_props = self._label_and_props(label_and_props, x)
 
-        x = torch.cat((q, p), dim=1)
-        hnn_input = torch.cat((label_and_props, x), dim=1)
-        energy = self.hnn(hnn_input)
-        dpdt = -grad(energy.sum(), q, create_graph=True)[0]
+        dpdt = -self._energy_grad(label_and_props, q, p, wrt=q)
         p_half = p + dpdt * (self.dt / 2)
 
-        x_half = torch.cat((label_and_props, q, p_half), dim=1)
-        energy = self.hnn(x_half)
-        dqdt = grad(energy.sum(), p, create_graph=True)[0]
+        # Note that p_half depends on p, through dpdt, unless H is separable
+        dqdt = self._energy_grad(label_and_props, q, p_half, wrt=p)
 
         q_next = q + dqdt * self.dt
 
-        x_next = torch.cat((label_and_props, q_next, p_half), dim=1)
-        energy = self.hnn(x_next)
-        dpdt = -grad(energy.sum(), q_next, create_graph=True)[0]
+        dpdt = -self._energy_grad(label_and_props, q_next, p_half, wrt=q_next)
 
         p_next = p_half + dpdt * (self.dt / 2)
         x_next = torch.cat((q_next, p_next), dim=1)
@@ -469,6 +523,33 @@ class HNNSimple(nn.Module):
 
         return x_next, dx_next
 
+    def fused_leap_frog_step(self, x, label_and_props, dpdt=None):
+        """
+        one step of leap frog integration, starting with the half-kick dpdt of the
+        previous step (computed here if None), and returning the half-kick for the next
+        step, i.e. (x_next, dx_next, dpdt_next)
+
+        """
+        q, p = torch.chunk(x, 2, dim=1)
+        if dpdt is None:
+            q.requires_grad_()
+            dpdt = -self._energy_grad(label_and_props, q, p, wrt=q)
+        p_half = p + dpdt * (self.dt / 2)
+        if not p_half.requires_grad:
+            p_half.requires_grad_()
+
+        dqdt = self._energy_grad(label_and_props, q, p_half, wrt=p_half)
+
+        q_next = q + dqdt * self.dt
+
+        dpdt = -self._energy_grad(label_and_props, q_next, p_half, wrt=q_next)
+
+        p_next = p_half + dpdt * (self.dt / 2)
+        x_next = torch.cat((q_next, p_next), dim=1)
+        dx_next = torch.cat((dqdt, dpdt), dim=1)
+
+        return x_next, dx_next, dpdt
+
     def initWeight(self):
         # See details in https://github.com/pytorch/pytorch/blob/master/torch/nn/modules/rnn.py
         for name, params in self.named_parameters():
@@ -497,7 +578,9 @@ class HNNPhaseSpace(HNNSimple):
         output_size,
         dt=0.05,
         ndim_physics=0,
-        ndim_label=0
+        ndim_label=0,
+        leapfrog="standard",
+        energy="autograd",
     ):
         """
         Parameters:
@@ -506,6 +589,8 @@ class HNNPhaseSpace(HNNSimple):
             hidden_size (int): hidden dimension for mlp
             output_size (int): dimension of T*Q
             dt (float): timestep in integration
+            leapfrog (str): leapfrog integration scheme (see HNNSimple)
+            energy (str): how gradients of the energy are computed (see HNNSimple)
         """
         super(HNNPhaseSpace, self).__init__(
             device=device,
@@ -514,6 +599,8 @@ class HNNPhaseSpace(HNNSimple):
             dt=dt,
             ndim_physics=ndim_physics,
             ndim_label=ndim_label,
+            leapfrog=leapfrog,
+            energy=energy,
         )
         # Note: in Keras implementation the authors use a lrelu for the W map
         # https://keras.io/examples/generative/stylegan/
@@ -528,11 +615,9 @@ class HNNPhaseSpace(HNNSimple):
         )
         outputs = [x]
         doutputs = []
-        for i in range(n_frames - 1):
-            x_next, dx_next = self.leap_frog_step(x, label_and_props)
+        for x_next, dx_next in self.leap_frog_steps(x, n_frames - 1, label_and_props):
             outputs.append(x_next)
             doutputs.append(dx_next)
-            x = outputs[-1]
 
         outputs = torch.stack(outputs)
         doutputs = torch.stack(doutputs) if doutputs else None
@@ -548,7 +633,17 @@ class HNNMass(HNNPhaseSpace):
         3 * MLP
     """
 
-    def __init__(self, *, device, input_size, hidden_size, output_size, dt=0.05):
+    def __init__(
+        self,
+        *,
+        device,
+        input_size,
+        hidden_size,
+        output_size,
+        dt=0.05,
+        leapfrog="standard",
+        energy="autograd",
+    ):
         """
         Parameters:
         ----------
@@ -556,6 +651,8 @@ class HNNMass(HNNPhaseSpace):
             hidden_size (int): hidden dimension for mlp
             output_size (int): dimension of T*Q
             dt (float): timestep in integration
+            leapfrog (str): leapfrog integration scheme (see HNNSimple)
+            energy (str): how gradients of the energy are computed (see HNNSimple)
         """
         super(HNNMass, self).__init__(
             device=device,
@@ -563,6 +660,8 @@ class HNNMass(HNNPhaseSpace):
             hidden_size=hidden_size,
             output_size=output_size,
             dt=dt,
+            leapfrog=leapfrog,
+            energy=energy,
         )
         self.config_space_map = self.phase_space_map
         self.dim = int(output_size / 2)
@@ -588,15 +687,12 @@ class HNNMass(HNNPhaseSpace):
 
         qs = [q]
         outputs = [x]
-        for i in range(n_frames - 1):
-            x_next, _ = self.leap_frog_step(x)
+        for x_next, _ in self.leap_frog_steps(x, n_frames - 1):
             outputs.append(x_next)
 
             q_next, _ = torch.chunk(x_next, 2, dim=1)
             qs.append(q_next)
 
-            x = outputs[-1]
-
         outputs = torch.stack(outputs)
         qs = torch.stack(qs)
 
@@ -636,6 +732,47 @@ class MLP(nn.Module):
         return out
 
 
+class AnalyticMLP(MLP):
+    """
+    An MLP with a scalar output, whose gradient w.r.t. its input is computed in closed
+    form along with its output, instead of through autograd.
+
+    Notes
+    -----
+    The parameters are the same as those of MLP, so that either can be loaded from the
+    other's state dict.
+    """
+
+    def __init__(self, input_size, hidden_size, output_size, nonlinearity="relu"):
+        assert output_size == 1, "The gradient is only available for a scalar output"
+        super(AnalyticMLP, self).__init__(
+            input_size, hidden_size, output_size, nonlinearity=nonlinearity
+        )
+        self.nonlinearity_derivative = {
+            "tanh": lambda z, h: 1 - h**2,
+            "relu": lambda z, h: (z > 0).to(z.dtype),
+            "sigmoid": lambda z, h: h * (1 - h),
+            "softplus": lambda z, h: torch.sigmoid(z),
+            "leakyrelu": lambda z, h: torch.where(z > 0, 1.0, 0.01).to(z.dtype),
+        }[nonlinearity]
+
+    def energy_and_grad(self, x):
+        """
+        Returns the output (batch_size, 1) and its gradient w.r.t. x (batch_size, input_size)
+        """
+        z1 = self.linear1(x)
+        h1 = self.nonlinear(z1)
+        z2 = self.linear2(h1)
+        h2 = self.nonlinear(z2)
+        out = self.output(h2)
+
+        # Backpropagate d(out)/d(out) = 1 through the layers
+        dz2 = self.output.weight * self.nonlinearity_derivative(z2, h2)
+        dz1 = (dz2 @ self.linear2.weight) * self.nonlinearity_derivative(z1, h1)
+        dx = dz1 @ self.linear1.weight
+        return out, dx
+
+
 class Flatten(nn.Module):
     def forward(self, input):
         return input.view(input.size(0), -1)
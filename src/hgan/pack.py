@@ -0,0 +1,53 @@
+import os
+import sys
+import argparse
+import logging
+from hgan.dataset import pack_npz_videos
+
+
+logger = logging.getLogger("hgan")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Pack a folder of .npz videos (with train/test subfolders) into "
+        "memory-mappable uint8 arrays"
+    )
+    parser.add_argument(
+        "--input-folder",
+        type=str,
+        required=True,
+        help="Folder with train/test subfolders of <index>.npz videos",
+    )
+    parser.add_argument(
+        "--output-folder",
+        type=str,
+        required=True,
+        help="Output folder, to be used as the input folder for training",
+    )
+    parser.add_argument(
+        "--img-size",
+        type=int,
+        default=None,
+        help="Resize videos to this size when packing (default: keep their size)",
+    )
+    return parser
+
+
+def main(*args):
+    args = get_parser().parse_args(args)
+
+    for train_test in ("train", "test"):
+        input_folder = os.path.join(args.input_folder, train_test)
+        if not os.path.isdir(input_folder):
+            continue
+        metadata = pack_npz_videos(
+            input_folder,
+            os.path.join(args.output_folder, train_test),
+            img_size=args.img_size,
+        )
+        logger.info(f"Packed {train_test} videos: {metadata}")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -1,40 +1,83 @@
 import torch
 from torch.autograd import Variable, grad
+from hgan.utils import MixedPrecision
 
+# Used when no mixed precision is asked for
+FULL_PRECISION = MixedPrecision()
 
-def bp_i(*, label, criterion, dis_i, inputs, label_props_colors, y, retain=False):
+
+def bp_i(
+    *,
+    label,
+    criterion,
+    dis_i,
+    inputs,
+    label_props_colors,
+    y,
+    retain=False,
+    amp=FULL_PRECISION
+):
     label.resize_(inputs.size(0)).fill_(y)
     labelv = Variable(label)
 
-    outputs = dis_i(inputs, label_props_colors)
+    with amp.autocast():
+        outputs = dis_i(inputs, label_props_colors)
 
-    err = criterion(outputs, labelv)
-    err.backward(retain_graph=retain)
+    # BCE is not autocast-safe, so the loss is computed in full precision
+    err = criterion(outputs.float(), labelv)
+    amp.backward(err, retain_graph=retain)
 
     return err.item(), outputs  # .data.mean()
 
 
-def bp_v(*, label, criterion, dis_v, inputs, label_props_colors, y, retain=False):
+def bp_v(
+    *,
+    label,
+    criterion,
+    dis_v,
+    inputs,
+    label_props_colors,
+    y,
+    retain=False,
+    amp=FULL_PRECISION
+):
     label.resize_(inputs.size(0)).fill_(y)
     labelv = Variable(label)
 
-    outputs = dis_v(inputs, label_props_colors)
+    with amp.autocast():
+        outputs = dis_v(inputs, label_props_colors)
 
-    err = criterion(outputs, labelv)
-    err.backward(retain_graph=retain)
+    # BCE is not autocast-safe, so the loss is computed in full precision
+    err = criterion(outputs.float(), labelv)
+    amp.backward(err, retain_graph=retain)
 
     return err.item(), outputs  # .data.mean()
 
 
-def r1_loss(r1_gamma, real_out, real_input):
-    grad_real = grad(outputs=real_out.sum(), inputs=real_input, create_graph=True)[0]
+def r1_loss(r1_gamma, real_out, real_input, amp=FULL_PRECISION):
+    # Gradients of a scaled output, unscaled before computing the penalty in float32
+    # https://pytorch.org/docs/stable/notes/amp_examples.html#gradient-penalty
+    grad_real = grad(
+        outputs=amp.scale(real_out.float().sum()),
+        inputs=real_input,
+        create_graph=True,
+    )[0]
+    grad_real = grad_real.float() * amp.unscale_factor()
     grad_penalty = (grad_real.view(grad_real.size(0), -1).norm(2, dim=1) ** 2).mean()
     grad_penalty = r1_gamma / 2 * grad_penalty
-    grad_penalty.backward()
+    amp.backward(grad_penalty)
 
     return grad_penalty
 
 
+def lazy_r1_gamma(r1_gamma, r1_every, step):
+    # Lazy regularization (https://arxiv.org/abs/1912.04958, Appendix B): the R1
+    # penalty is only computed every r1_every steps, with gamma scaled to match
+    if r1_every <= 1:
+        return r1_gamma
+    return r1_gamma * r1_every if step % r1_every == 0 else 0
+
+
 def update_Dv(
     *,
     rnn_type,
@@ -45,7 +88,8 @@ def update_Dv(
     real_data,
     fake_data,
     optim_Dv,
-    gamma=0.9
+    gamma=0.9,
+    amp=FULL_PRECISION
 ):
 
     real_videos = real_data["videos"]
@@ -57,7 +101,7 @@ def update_Dv(
     dis_v.zero_grad()
 
     # needed for r1 loss
-    real_videos.requires_grad = False if rnn_type == "gru" else True
+    real_videos.requires_grad = r1_gamma != 0 and rnn_type != "gru"
 
     err_Dv_real, real_out = bp_v(
         label=label,
@@ -67,13 +111,14 @@ def update_Dv(
         label_props_colors=label_props_colors,
         y=gamma,
         retain=True,
+        amp=amp,
     )
     Dv_real_mean = real_out.data.mean()
 
     # https://github.com/rosinality/style-based-gan-pytorch/blob/a3d000e707b70d1a5fc277912dc9d7432d6e6069/train.py
     r1_loss_value = 0
     if r1_gamma != 0:
-        r1_loss_value = r1_loss(r1_gamma, real_out, real_videos)
+        r1_loss_value = r1_loss(r1_gamma, real_out, real_videos, amp=amp)
 
     err_Dv_fake, fake_out = bp_v(
         label=label,
@@ -82,12 +127,13 @@ def update_Dv(
         inputs=fake_videos.detach(),
         label_props_colors=label_props_colors,
         y=0,
+        amp=amp,
     )
     Dv_fake_mean = fake_out.data.mean()
 
     err_Dv = err_Dv_real + err_Dv_fake + r1_loss_value
 
-    optim_Dv.step()
+    amp.step(optim_Dv)
 
     err_Dv = {"Dv_real": err_Dv_real, "Dv_fake": err_Dv_fake, "Dv": err_Dv}
     mean_Dv = {"Dv_real": Dv_real_mean, "Dv_fake": Dv_fake_mean}
@@ -105,7 +151,8 @@ def update_Di(
     real_data,
     fake_data,
     optim_Di,
-    gamma=0.9
+    gamma=0.9,
+    amp=FULL_PRECISION
 ):
 
     real_img = real_data["img"]
@@ -117,7 +164,7 @@ def update_Di(
     dis_i.zero_grad()
 
     # needed for r1 loss
-    real_img.requires_grad = True
+    real_img.requires_grad = r1_gamma != 0
 
     err_Di_real, real_out = bp_i(
         label=label,
@@ -127,13 +174,14 @@ def update_Di(
         label_props_colors=label_props_colors,
         y=gamma,
         retain=True,
+        amp=amp,
     )
     Di_real_mean = real_out.data.mean()
 
     # https://github.com/rosinality/style-based-gan-pytorch/blob/a3d000e707b70d1a5fc277912dc9d7432d6e6069/train.py
     r1_loss_value = 0
     if r1_gamma != 0:
-        r1_loss_value = r1_loss(r1_gamma, real_out, real_img)
+        r1_loss_value = r1_loss(r1_gamma, real_out, real_img, amp=amp)
 
     err_Di_fake, fake_out = bp_i(
         label=label,
@@ -142,12 +190,13 @@ def update_Di(
         inputs=fake_img.detach(),
         label_props_colors=label_props_colors,
         y=0,
+        amp=amp,
     )
     Di_fake_mean = fake_out.data.mean()
 
     err_Di = err_Di_real + err_Di_fake + r1_loss_value
 
-    optim_Di.step()
+    amp.step(optim_Di)
 
     err_Di = {"Di_real": err_Di_real, "Di_fake": err_Di_fake, "Di": err_Di}
     mean_Di = {"Di_real": Di_real_mean, "Di_fake": Di_fake_mean}
@@ -171,43 +220,24 @@ def update_G(
     optim_Gi,
     optim_RNN,
     label_props_colors,
-    gamma=0.9
+    gamma=0.9,
+    amp=FULL_PRECISION
 ):
     model_gi.zero_grad()
     model_rnn.zero_grad()
 
-    # video. notice retain=True for back prop twice
-    # retain=True for back prop three times
-    err_Gv, _ = bp_v(
-        label=label,
-        criterion=criterion,
-        dis_v=model_dv,
-        inputs=fake_data["videos"],
-        label_props_colors=label_props_colors,
-        y=gamma,
-        retain=True,
-    )
-    # images
-    # retain=True for back prop three times
-    if rnn_type == "hnn_phase_space":
-        err_Gi, _ = bp_i(
-            label=label,
-            criterion=criterion,
-            dis_i=model_di,
-            inputs=fake_data["img"],
-            label_props_colors=label_props_colors,
-            y=gamma,
-            retain=True,
-        )
-    else:  # gru
-        err_Gi, _ = bp_i(
-            label=label,
-            criterion=criterion,
-            dis_i=model_di,
-            inputs=fake_data["img"],
-            y=gamma,
-            retain=False,
-        )
+    label.resize_(fake_data["videos"].size(0)).fill_(gamma)
+    labelv = Variable(label)
+
+    # video and images
+    with amp.autocast():
+        outputs_v = model_dv(fake_data["videos"], label_props_colors)
+        outputs_i = model_di(fake_data["img"], label_props_colors)
+
+    # BCE is not autocast-safe, so the losses are computed in full precision
+    err_Gv = criterion(outputs_v.float(), labelv)
+    err_Gi = criterion(outputs_i.float(), labelv)
+    err_G = err_Gv + err_Gi
 
     # latent
     if rnn_type == "hnn_phase_space":
@@ -216,12 +246,15 @@ def update_G(
         latent_loss = (
             torch.sum(torch.abs(dpdt)) / batch_size * cyclic_coord_loss
         )  # mean
-        latent_loss.backward()
+        err_G = err_G + latent_loss
+
+    # A single backward through the generator and the rnn rollout
+    amp.backward(err_G)
 
-    optim_Gi.step()
-    optim_RNN.step()
+    amp.step(optim_Gi)
+    amp.step(optim_RNN)
 
-    return {"Gv": err_Gv, "Gi": err_Gi}
+    return {"Gv": err_Gv.item(), "Gi": err_Gi.item()}
 
 
 def update_models(
@@ -244,7 +277,8 @@ def update_models(
     real_data,
     fake_data,
     discriminator_gamma=0.9,
-    generator_gamma=0.9
+    generator_gamma=0.9,
+    amp=FULL_PRECISION
 ):
     err_Dv, mean_Dv = update_Dv(
         rnn_type=rnn_type,
@@ -256,6 +290,7 @@ def update_models(
         fake_data=fake_data,
         optim_Dv=optim_dv,
         gamma=discriminator_gamma,
+        amp=amp,
     )
     err_Di, mean_Di = update_Di(
         rnn_type=rnn_type,
@@ -267,6 +302,7 @@ def update_models(
         fake_data=fake_data,
         optim_Di=optim_di,
         gamma=discriminator_gamma,
+        amp=amp,
     )
 
     label_props_colors = torch.concat(
@@ -288,7 +324,9 @@ def update_models(
         optim_RNN=optim_rnn,
         label_props_colors=label_props_colors,
         gamma=generator_gamma,
+        amp=amp,
     )
+    amp.update()
 
     err = {**err_Dv, **err_Di, **err_G}
     mean = {**mean_Dv, **mean_Di}
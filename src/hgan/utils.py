@@ -1,6 +1,10 @@
 import os
 import time
 import math
+import queue
+import logging
+import functools
+import threading
 from typing import Any, Mapping, Callable, Tuple
 import tensorflow as tf
 import torch
@@ -8,6 +12,8 @@ import numpy as np
 import random
 import moviepy.video.io.ImageSequenceClip
 
+logger = logging.getLogger(__name__)
+
 
 def setup_reproducibility(seed):
     torch.manual_seed(seed)
@@ -16,6 +22,176 @@ def setup_reproducibility(seed):
     random.seed(seed)
 
 
+def seed_worker(worker_id):
+    """
+    worker_init_fn for DataLoader workers.
+    torch seeds each worker with <base_seed> + <worker_id>, where <base_seed> is drawn
+    from the DataLoader's generator. Derive the numpy/python seeds from it as well, so
+    that workers produce independent, but reproducible, random samples.
+    """
+    worker_seed = torch.initial_seed() % 2**32
+    np.random.seed(worker_seed)
+    random.seed(worker_seed)
+
+
+def compile_forward(module, mode="default"):
+    """
+    Replace the forward method of a module with a version compiled with torch.compile.
+
+    Shapes are treated as static, so that the rollout of a recurrent module is compiled
+    (once) for the batch size and number of frames it is called with in training. If
+    compilation fails (a TorchDynamo or backend compiler error), the module falls back
+    to eager execution for good. Other errors, including errors raised by the module
+    itself while being traced, are re-raised.
+
+    Parameters
+    ----------
+    module : torch.nn.Module
+        Module to compile the forward method of.
+    mode : str
+        torch.compile mode, e.g. 'default', or 'reduce-overhead' to also capture CUDA
+        graphs when running on a GPU.
+    """
+    from torch._dynamo.exc import TorchDynamoException, TorchRuntimeError
+
+    eager_forward = module.forward
+    compiled_forward = torch.compile(eager_forward, mode=mode, dynamic=False)
+    state = {"compiled": True}
+
+    @functools.wraps(eager_forward)
+    def forward(*args, **kwargs):
+        if state["compiled"]:
+            try:
+                return compiled_forward(*args, **kwargs)
+            except TorchRuntimeError:
+                raise
+            except TorchDynamoException as e:
+                logger.warning(f"Compilation failed, running eagerly instead: {e}")
+                state["compiled"] = False
+        return eager_forward(*args, **kwargs)
+
+    module.forward = forward
+    return module
+
+
+class MixedPrecision:
+    """
+    Automatic mixed precision (autocast + loss scaling) for the parts of training that
+    opt in to it. All methods are passthroughs when mixed precision is disabled.
+    """
+
+    def __init__(self, dtype=None, device="cpu"):
+        """
+        Parameters
+        ----------
+        dtype : str
+            One of 'bf16'/'fp16', or None to disable mixed precision.
+            Losses are scaled with fp16, whose range is too narrow for small gradients.
+        device : str
+            Device that training runs on, e.g. 'cpu' or 'cuda:0'.
+        """
+        assert dtype in (None, "bf16", "fp16"), f"Unknown mixed precision type {dtype}"
+        self.enabled = dtype is not None
+        self.dtype = {"bf16": torch.bfloat16, "fp16": torch.float16, None: None}[dtype]
+        self.device_type = torch.device(device).type
+        self.scaler = torch.amp.GradScaler(self.device_type, enabled=dtype == "fp16")
+
+    def autocast(self):
+        return torch.autocast(self.device_type, dtype=self.dtype, enabled=self.enabled)
+
+    def scale(self, loss):
+        return self.scaler.scale(loss)
+
+    def unscale_factor(self):
+        """Factor to multiply gradients of scaled losses by, to get true gradients"""
+        return 1.0 / self.scaler.get_scale() if self.scaler.is_enabled() else 1.0
+
+    def backward(self, loss, **kwargs):
+        self.scaler.scale(loss).backward(**kwargs)
+
+    def step(self, optimizer):
+        self.scaler.step(optimizer)
+
+    def update(self):
+        """To be called once per training step, after all optimizer steps"""
+        self.scaler.update()
+
+
+class BackgroundWorker:
+    """
+    Runs submitted jobs, in order, on a single background thread.
+
+    At most <max_pending> jobs are queued at any time; submitting more blocks until
+    the worker catches up, which bounds the memory held by pending jobs. An exception
+    raised by a job is re-raised in the submitting thread, on the next call to
+    submit, wait or close.
+    """
+
+    def __init__(self, max_pending=2, name=None):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._work, name=name, daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                fn, args, kwargs = job
+                if self._error is None:
+                    fn(*args, **kwargs)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, fn, *args, **kwargs):
+        if self._thread is None:
+            raise RuntimeError("BackgroundWorker is closed")
+        self._raise()
+        self._queue.put((fn, args, kwargs))
+
+    def wait(self):
+        """Wait for all submitted jobs to finish."""
+        self._queue.join()
+        self._raise()
+
+    def close(self):
+        """Finish all submitted jobs and stop the background thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise()
+
+
+class VideoSink:
+    """
+    Writes videos with a given function on a background thread.
+
+    Frames are copied to (host) memory when submitted, so the caller is free to reuse
+    its buffers. At most <max_pending> videos wait to be written; submitting more
+    blocks until the writer catches up. close() writes out all pending videos.
+    """
+
+    def __init__(self, write, max_pending=4):
+        self.write = write
+        self._worker = BackgroundWorker(max_pending=max_pending, name="VideoSink")
+
+    def submit(self, folder, video, **kwargs):
+        self._worker.submit(self.write, folder, np.array(video), **kwargs)
+
+    def close(self):
+        self._worker.close()
+
+
 def timeSince(since):
     now = time.time()
     s = now - since
@@ -0,0 +1,156 @@
+import os
+import pytest
+import torch
+from hgan.checkpoint import (
+    CheckpointWriter,
+    checkpoint_path,
+    load_checkpoint,
+    saved_checkpoints,
+)
+from hgan.configuration import load_config
+from hgan.experiment import Experiment
+from hgan.utils import BackgroundWorker, MixedPrecision
+
+
+def test_background_worker():
+    results = []
+    worker = BackgroundWorker()
+    for i in range(5):
+        worker.submit(results.append, i)
+    worker.wait()
+    assert results == [0, 1, 2, 3, 4]
+
+    def fail():
+        raise ValueError("bad job")
+
+    worker.submit(fail)
+    with pytest.raises(ValueError):
+        worker.close()
+
+
+def test_checkpoint_writer(tmp_path):
+    model = torch.nn.Linear(3, 2)
+    writer = CheckpointWriter(str(tmp_path), keep_last=2, keep_every=4)
+    for epoch in range(1, 10):
+        writer.save(epoch, {"model": model.state_dict()})
+        # Changes made after saving do not affect the checkpoint
+        with torch.no_grad():
+            model.weight.add_(1)
+    writer.close()
+
+    assert saved_checkpoints(str(tmp_path)) == [4, 8, 9]
+    assert not any(f.endswith(".tmp") for f in os.listdir(tmp_path))
+    state_dicts = load_checkpoint(str(tmp_path), 9)
+    assert torch.equal(state_dicts["model"]["weight"] + 1, model.weight)
+
+    with pytest.raises(AssertionError):
+        CheckpointWriter(str(tmp_path), keep_last=0)
+
+
+def test_experiment_checkpoints(tmp_path):
+    config = load_config(os.path.join(os.path.dirname(__file__), "../src/hgan"))
+    config.paths.output = str(tmp_path)
+    experiment = Experiment(config)
+
+    # Checkpoints in the older format, with one file per model
+    for which in experiment.model_names:
+        model = getattr(experiment, which)
+        torch.save(model.state_dict(), tmp_path / f"{which}_{1:0>6}.pth")
+    expected = {k: v.clone() for k, v in experiment.Di.state_dict().items()}
+
+    experiment.save_epoch(2)
+    with torch.no_grad():
+        experiment.Di.main[0].weight.add_(1)
+
+    assert experiment.saved_epochs() == [1, 2]
+    assert experiment.load_epoch() == 2
+    for k, v in experiment.Di.state_dict().items():
+        assert torch.equal(v, expected[k])
+    assert experiment.load_epoch(1) == 1
+
+
+def test_experiment_checkpoints_grad_scaler(tmp_path):
+    config = load_config(os.path.join(os.path.dirname(__file__), "../src/hgan"))
+    config.paths.output = str(tmp_path)
+    experiment = Experiment(config)
+    experiment.amp = MixedPrecision("fp16", "cpu")
+    experiment.amp.scale(torch.ones(()))
+    experiment.amp.scaler.update(new_scale=128.0)
+    experiment.save_epoch(1)
+
+    # The loss scale is restored when resuming fp16 training
+    experiment.amp = MixedPrecision("fp16", "cpu")
+    assert experiment.load_epoch() == 1
+    assert experiment.amp.scaler.get_scale() == 128.0
+
+    # and checkpoints without loss scaling load into fp16 training, and vice versa
+    experiment.save_epoch(2)
+    experiment.amp = MixedPrecision(None, "cpu")
+    experiment.save_epoch(3)
+    assert experiment.load_epoch(2) == 2
+    experiment.amp = MixedPrecision("fp16", "cpu")
+    assert experiment.load_epoch(3) == 3
+    assert experiment.amp.scaler.get_scale() == 65536.0
+
+
+def test_experiment_checkpoints_data_workers(tmp_path, monkeypatch):
+    monkeypatch.delenv("HGAN_EXPERIMENT_RT_DATA_GENERATOR", raising=False)
+    config = load_config(os.path.join(os.path.dirname(__file__), "../src/hgan"))
+    config.paths.output = str(tmp_path)
+    config.experiment.num_workers = 1
+    config.experiment.batch_size = 2
+    experiment = Experiment(config)
+    next(experiment.batches)  # Starts the worker, with a copy of the embedding
+
+    with torch.no_grad():
+        experiment.system_embedding.weight.add_(1)
+    experiment.save_epoch(1)
+    expected = experiment.system_embedding.weight.clone()
+    with torch.no_grad():
+        experiment.system_embedding.weight.sub_(1)
+
+    # Batches are generated with the embedding of the checkpoint
+    assert experiment.load_epoch() == 1
+    _, labels_and_props, _ = next(experiment.batches)
+    labels = labels_and_props[:, : experiment.ndim_label]
+    assert all(any(torch.equal(label, e) for e in expected) for label in labels)
+    experiment.close()
+
+
+def test_interrupted_training(tmp_path, monkeypatch):
+    config = load_config(os.path.join(os.path.dirname(__file__), "../src/hgan"))
+    config.paths.output = str(tmp_path)
+    experiment = Experiment(config)
+    experiment.n_epoch = 3
+    experiment.save_model_every = 1
+    experiment.calculate_fvd_every = experiment.print_every = 100
+    experiment.save_fake_video_every = experiment.save_real_video_every = 1
+
+    videos = {"videos": torch.zeros(1, 3, 4, 8, 8)}
+
+    def train_step(epoch):
+        if epoch == 2:
+            raise KeyboardInterrupt
+        return None, None, videos, videos
+
+    monkeypatch.setattr(experiment, "train_step", train_step)
+    with pytest.raises(KeyboardInterrupt):
+        experiment.train()
+
+    # Videos and checkpoints pending in the background are still written out
+    assert experiment.video_sink is None and experiment.checkpoint_writer is None
+    assert saved_checkpoints(str(tmp_path)) == [1]
+    assert os.path.exists(tmp_path / "fake_000001.mp4")
+    assert os.path.exists(tmp_path / "real_000001.mp4")
+
+    # Checkpoints are also written out if writing a video fails
+    def save_video(*args, **kwargs):
+        raise OSError("disk full")
+
+    os.remove(checkpoint_path(str(tmp_path), 1))
+    experiment.save_real_video_every = 100
+    monkeypatch.setattr(experiment, "save_video", save_video)
+    with pytest.raises(OSError, match="disk full"):
+        experiment.train()
+    assert experiment.checkpoint_writer is None
+    assert saved_checkpoints(str(tmp_path)) == [1]
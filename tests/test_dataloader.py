@@ -0,0 +1,47 @@
+import pytest
+import torch
+from torch.utils.data import DataLoader, Dataset, TensorDataset
+from hgan.dataloader import BatchStream
+
+
+class FailingDataset(Dataset):
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, item):
+        raise ValueError("bad sample")
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_batch_stream_restarts(prefetch):
+    dataset = TensorDataset(torch.arange(10))
+    dataloader = DataLoader(dataset, batch_size=4)  # 3 batches per pass
+
+    stream = BatchStream(dataloader, prefetch=prefetch)
+    batches = [next(stream)[0] for _ in range(7)]
+    stream.close()
+
+    # The stream keeps going past the end of the DataLoader, starting a new pass
+    assert [len(b) for b in batches] == [4, 4, 2, 4, 4, 2, 4]
+    assert torch.equal(batches[3], batches[0])
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_batch_stream_raises(prefetch):
+    stream = BatchStream(DataLoader(FailingDataset(), batch_size=2), prefetch=prefetch)
+    with pytest.raises(ValueError, match="bad sample"):
+        next(stream)
+    stream.close()
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_batch_stream_drop_last(prefetch):
+    dataset = TensorDataset(torch.arange(10))
+    dataloader = DataLoader(dataset, batch_size=4, shuffle=True, drop_last=True)
+
+    stream = BatchStream(dataloader, prefetch=prefetch)
+    batches = [next(stream)[0] for _ in range(7)]
+    stream.close()
+
+    # Every batch is full, including those after the stream restarts a pass
+    assert [len(b) for b in batches] == [4] * 7
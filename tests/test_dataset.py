@@ -0,0 +1,88 @@
+import os
+import pickle
+import types
+import numpy as np
+import pytest
+import hgan.data
+import hgan.dataset
+from hgan.configuration import config
+from hgan.dataset import PackedVideoDataset, RealtimeDataset, ToyPhysicsDatasetNPZ
+from hgan.pack import main as pack
+
+datapath = os.path.join(os.path.dirname(hgan.data.__file__), "pendulum_colors")
+
+
+@pytest.mark.parametrize("img_size", [32, 48])
+def test_packed_dataset(tmp_path, monkeypatch, img_size):
+    monkeypatch.setattr(config.experiment, "img_size", img_size)
+    pack("--input-folder", datapath, "--output-folder", str(tmp_path))
+
+    dataset = ToyPhysicsDatasetNPZ(datapath=datapath, num_frames=10, delta=2)
+    packed = PackedVideoDataset(datapath=str(tmp_path), num_frames=10, delta=2)
+    assert PackedVideoDataset.is_packed(str(tmp_path))
+    assert len(packed) == len(dataset)
+
+    for idx in range(len(dataset)):
+        np.random.seed(idx)
+        expected, _ = dataset[idx]
+        np.random.seed(idx)
+        vid, _ = packed[idx]
+        assert vid.dtype == np.float32
+        # Same window, up to quantization to 8 bits
+        assert np.allclose(vid, expected, rtol=0, atol=0.5 / 255 + 1e-5)
+
+    # The memory map is reopened after unpickling (e.g. in DataLoader workers)
+    assert pickle.loads(pickle.dumps(packed))._videos is None
+
+
+class StubSystem:
+    """dm system that renders constant images, with a mass per trajectory"""
+
+    def __init__(self, image_resolution):
+        self.image_resolution = image_resolution
+        self.num_trajectories = []
+
+    def generate_and_render_dt(self, num_trajectories, rng_key, t0, dt, num_steps):
+        self.num_trajectories.append(num_trajectories)
+        shape = (num_trajectories, num_steps + 1, self.image_resolution)
+        return {
+            "image": np.full(shape + (self.image_resolution, 3), 0.5),
+            "other": {"m": np.arange(num_trajectories, dtype=float)},
+        }
+
+
+def test_realtime_dataset_batch(monkeypatch):
+    systems = {"STUB_A": StubSystem, "STUB_B": StubSystem}
+
+    def generate_sample(index, system, dt, num_steps, steps_per_dt):
+        data = system.generate_and_render_dt(1, None, 0.0, dt, num_steps)
+        return {
+            "image": data["image"][0],
+            "other": {k: v[0] for k, v in data["other"].items()},
+        }
+
+    stub_datasets = types.SimpleNamespace(
+        generate_sample=generate_sample,
+        **{name: (cls, lambda: {}) for name, cls in systems.items()},
+    )
+    monkeypatch.setattr(hgan.dataset, "datasets", stub_datasets)
+    monkeypatch.setattr(hgan.dataset, "all_systems", tuple(systems))
+    for name in systems:
+        monkeypatch.setitem(hgan.dataset.constant_physics, name, {})
+
+    dataset = RealtimeDataset(ndim_physics=2, num_frames=5, total_frames=8, img_size=16)
+    np.random.seed(0)
+    labels = set()
+    for _ in range(4):
+        vids, system_indices, props = dataset[[3, 1, 4, 1, 5, 9]]
+        assert vids.shape == (6, 3, 5, 16, 16)
+        assert np.allclose(vids, 127 / 255)
+        # A batch holds videos of a single system, with the props of each trajectory
+        assert len(set(system_indices.tolist())) == 1
+        labels.add(system_indices[0].item())
+        assert props.tolist() == [[j, 0] for j in range(6)]
+
+    assert labels == {0, 1}
+    # Batches are generated with a single call, of a fixed size
+    for name, system in dataset.systems.items():
+        assert set(system.num_trajectories[1:]) <= {6}
@@ -0,0 +1,46 @@
+import functools
+import jax
+import numpy as np
+import pytest
+from hgan.dm_hamiltonian_dynamics_suite.hamiltonian_systems import utils
+
+
+@pytest.mark.parametrize("resolution", [32, 64])
+def test_render_particles_trajectory(resolution):
+    rng = np.random.default_rng(0)
+    canvas_limits = utils.BoxRegion(-2.0, 2.0)
+    # Particles inside the canvas, near its edges and outside of it
+    particles = np.concatenate(
+        [
+            rng.uniform(-1.5, 1.5, size=(6, 2, 2)),
+            rng.uniform(1.8, 2.3, size=(6, 2, 2)) * rng.choice([-1, 1], size=(6, 2, 2)),
+        ],
+        axis=1,
+    )
+    radius = rng.uniform(0.2, 0.5, size=4)
+    color_indices = np.array([0, 1, 2, 1])
+
+    render = functools.partial(
+        utils.render_particles_trajectory,
+        canvas_limits=canvas_limits,
+        resolution=resolution,
+        num_colors=3,
+    )
+    expected = render(particles, radius, color_indices)
+    images = render(particles, radius, color_indices, max_radius=0.5)
+    assert images.shape == (6, resolution, resolution, 3)
+    assert np.allclose(images, expected, atol=1e-6)
+
+    # Batched with vmap and compiled, as the dm systems render trajectories
+    batch_render = jax.jit(jax.vmap(functools.partial(render, max_radius=0.5)))
+    images = batch_render(
+        np.stack([particles, particles[:, ::-1]]),
+        np.stack([radius, radius[::-1]]),
+        np.stack([color_indices, color_indices[::-1]]),
+    )
+    assert np.allclose(images[0], expected, atol=1e-6)
+    assert np.allclose(
+        images[1],
+        render(particles[:, ::-1], radius[::-1], color_indices[::-1]),
+        atol=1e-6,
+    )
@@ -0,0 +1,429 @@
+import os
+import cv2
+import jax
+import numpy as np
+import pytest
+import torch
+from scipy.integrate import solve_ivp
+from hgan.dataset import HGNRealtimeDataset
+from hgan.hgn.environments.environment_factory import (
+    EnvFactory,
+    IntegrationBudgetExceeded,
+)
+from hgan.hgn.environments.gravity import (
+    cell_gravitational_forces,
+    gravitational_forces,
+)
+from hgan.hgn.environments.jax_backend import render_balls_jax, simulate
+from hgan.hgn.environments.rendering import render_balls, render_balls_torch
+
+
+environments = (
+    ("Spring", dict(mass=0.5, elastic_cst=2.0)),
+    ("Pendulum", dict(mass=0.5, g=3.0, length=1.0)),
+    ("ChaoticPendulum", dict(mass=1.0, g=3.0, length=1.0)),
+    ("NObjectGravity", dict(mass=[1.0, 1.0], g=1.0, orbit_noise=0.1)),
+    ("NObjectGravity", dict(mass=[1.0, 1.2, 0.8], g=1.0, orbit_noise=0.1)),
+    ("NObjectGravity", dict(mass=[1.0] * 6, g=1.0, orbit_noise=0.1, softening=0.1)),
+)
+
+
+def initial_states(env, n):
+    np.random.seed(0)
+    y0 = []
+    for _ in range(n):
+        env._sample_init_conditions(env.get_default_radius_bounds())
+        y0.append(env._initial_state())
+    return np.array(y0)
+
+
+@pytest.mark.parametrize("name, kwargs", environments)
+def test_dynamics_batch(name, kwargs):
+    env = EnvFactory.get_environment(name, **kwargs)
+    y0 = initial_states(env, 4)
+    expected = np.array([env._dynamics(0, y) for y in y0])
+    assert np.allclose(env._dynamics_batch(0, y0), expected)
+
+
+@pytest.mark.parametrize("softening", [0.0, 0.1])
+def test_gravitational_forces(softening):
+    np.random.seed(0)
+    q = np.random.randn(3, 7, 2)
+    mass = np.random.uniform(0.5, 1.5, size=7)
+
+    expected = np.zeros_like(q)
+    for b in range(3):
+        for i in range(7):
+            for j in range(7):
+                if i != j:
+                    d = q[b, j] - q[b, i]
+                    r = np.sqrt(np.sum(d**2) + softening**2)
+                    expected[b, i] += 2.0 * mass[i] * mass[j] * d / r**3
+    assert np.allclose(gravitational_forces(q, mass, 2.0, softening), expected)
+
+    # The cell list approximation is exact when all cells are adjacent
+    forces = cell_gravitational_forces(q, mass, 2.0, softening, objects_per_cell=2)
+    assert np.allclose(forces, expected)
+
+
+def test_cell_gravitational_forces():
+    np.random.seed(0)
+    q = np.random.uniform(-2, 2, size=(2, 1000, 2))
+    mass = np.random.uniform(0.5, 1.5, size=1000)
+    expected = gravitational_forces(q, mass, 1.0, softening=0.05)
+    forces = cell_gravitational_forces(q, mass, 1.0, softening=0.05)
+    error = np.linalg.norm(forces - expected, axis=-1)
+    assert np.median(error / np.linalg.norm(expected, axis=-1)) < 0.02
+
+
+@pytest.mark.parametrize("name, kwargs", environments)
+@pytest.mark.parametrize("integrator", ["rk4", "leapfrog"])
+def test_evolution_batch(name, kwargs, integrator):
+    env = EnvFactory.get_environment(name, **kwargs)
+    y0 = initial_states(env, 4)
+    t_eval = np.linspace(0, 1.5, 31)[:-1]
+    expected = np.array(
+        [solve_ivp(env._dynamics, [0, 1.5], y, t_eval=t_eval, rtol=1e-10).y for y in y0]
+    )
+    rollouts = env._evolution_batch(
+        y0,
+        1.5,
+        0.05,
+        integrator=integrator,
+        steps_per_frame=4,
+        try_analytic_solution=False,
+    )
+    assert rollouts.shape == expected.shape
+    assert np.allclose(rollouts, expected, atol=1e-3)
+
+
+@pytest.mark.parametrize(
+    "name, kwargs",
+    [
+        ("Spring", dict(mass=0.5, elastic_cst=2.0)),
+        ("Pendulum", dict(mass=0.7, g=3.0, length=1.3)),
+    ],
+)
+def test_simulate_analytically(name, kwargs):
+    env = EnvFactory.get_environment(name, **kwargs)
+    np.random.seed(0)
+    # Includes pendulum rotations, and states at rest
+    y0 = np.concatenate([np.random.uniform(-4, 4, size=(20, 2)), np.zeros((1, 2))])
+    t_eval = np.linspace(0, 10, 201)[:-1]
+    expected = np.array(
+        [
+            solve_ivp(
+                env._dynamics, [0, 10], y, t_eval=t_eval, rtol=1e-11, atol=1e-11
+            ).y
+            for y in y0
+        ]
+    )
+    rollouts = env._evolution_batch(y0, 10, 0.05)
+    assert rollouts.shape == expected.shape
+    assert np.allclose(rollouts, expected, atol=1e-6)
+
+
+def test_simulate_analytically_damped():
+    env = EnvFactory.get_environment(
+        "Spring", mass=0.5, elastic_cst=2.0, damping_ratio=0.1
+    )
+    assert env._simulate_analytically(np.ones((1, 2)), np.arange(5.0)) is None
+
+
+@pytest.mark.parametrize("name, kwargs", environments)
+def test_sample_random_rollouts(name, kwargs):
+    env = EnvFactory.get_environment(name, **kwargs)
+    vids, colors = env.sample_random_rollouts(
+        number_of_frames=10,
+        delta_time=0.05,
+        number_of_rollouts=3,
+        img_size=32,
+        radius_bound="auto",
+        seed=0,
+    )
+    assert vids.shape == (3, 10, 32, 32, 3)
+    assert vids.dtype == np.float32
+    assert np.isfinite(vids).all()
+    assert colors.shape == (3, env.N_BALL_COLORS, 3)
+
+
+def test_sample_random_states_budget():
+    env = EnvFactory.get_environment("ChaoticPendulum", mass=1.0, g=3.0, length=1.0)
+    kwargs = dict(number_of_frames=10, delta_time=0.05, number_of_rollouts=2, seed=0)
+    kwargs.update(radius_bound="auto", integrator="solve_ivp")
+
+    # Integrations that exceed their budget fail, and are retried
+    with pytest.raises(IntegrationBudgetExceeded):
+        env.sample_random_states(**kwargs, max_attempts=3, max_evaluations=10)
+    assert env.sampling_stats == {"retries": 6, "rejected": 0}
+
+    rollouts = env.sample_random_states(**kwargs, max_attempts=3, timeout=60)
+    assert np.isfinite(rollouts).all()
+    assert env.sampling_stats == {"retries": 0, "rejected": 0}
+
+
+def test_gravity_near_collisions():
+    env = EnvFactory.get_environment(
+        "NObjectGravity", mass=[1.0, 1.0], g=1.0, min_separation=0.1
+    )
+    # Positions of both objects over 3 frames: passing close by (in the second frame
+    # only), starting out close and keeping apart
+    passing = [[[-1, 0], [1, 0]], [[-0.04, 0], [0.04, 0]], [[1, 0], [-1, 0]]]
+    start = [[[0, 0], [0.05, 0]], [[-1, 0], [1, 0]], [[-2, 0], [2, 0]]]
+    apart = [[[-1, 0], [1, 0]], [[0, -1], [0, 1]], [[1, 0], [-1, 0]]]
+    q = np.array([passing, start, apart], dtype=float)  # (batch, frames, objects, 2)
+    rollouts = np.concatenate(
+        [q.reshape(3, 3, 4), np.zeros((3, 3, 4))], axis=-1
+    ).transpose(0, 2, 1)
+    assert env._reject_rollouts(rollouts).tolist() == [True, True, False]
+
+    env = EnvFactory.get_environment(
+        "NObjectGravity", mass=[1.0, 1.0], g=1.0, min_separation=10.0
+    )
+    with pytest.raises(IntegrationBudgetExceeded):
+        env.sample_random_states(
+            number_of_frames=10, number_of_rollouts=2, max_attempts=5, seed=0
+        )
+    assert env.sampling_stats == {"retries": 0, "rejected": 10}
+
+
+def test_gravity_many_objects():
+    # Near collisions are only rejected on request, so many-body systems sample
+    env = EnvFactory.get_environment("NObjectGravity", mass=[1.0] * 20, g=1.0)
+    rollouts = env.sample_random_states(
+        number_of_frames=5, number_of_rollouts=2, max_attempts=1, seed=0
+    )
+    assert rollouts.shape == (2, 80, 5) and np.isfinite(rollouts).all()
+    assert env.sampling_stats == {"retries": 0, "rejected": 0}
+
+    # and with a min. separation below their initial spacing, most rollouts are kept
+    env = EnvFactory.get_environment(
+        "NObjectGravity", mass=[1.0] * 20, g=1.0, min_separation=0.05
+    )
+    rollouts = env.sample_random_states(
+        number_of_frames=5, number_of_rollouts=4, max_attempts=3, seed=0
+    )
+    assert not env._reject_rollouts(rollouts).any()
+    assert env.sampling_stats["rejected"] < 4
+
+
+@pytest.mark.parametrize("name, kwargs", environments)
+@pytest.mark.parametrize("integrator", ["rk4", "leapfrog"])
+def test_jax_backend(name, kwargs, integrator):
+    sample_kwargs = dict(
+        number_of_frames=10,
+        delta_time=0.05,
+        number_of_rollouts=3,
+        img_size=32,
+        radius_bound="auto",
+        seed=0,
+        constant_color=False,
+        integrator=integrator,
+        try_analytic_solution=False,
+    )
+    env = EnvFactory.get_environment(name, **kwargs)
+    vids, colors = env.sample_random_rollouts(**sample_kwargs)
+    env = EnvFactory.get_environment(name, backend="jax", **kwargs)
+    _vids, _colors = env.sample_random_rollouts(**sample_kwargs)
+
+    assert _vids.shape == vids.shape and _vids.dtype == vids.dtype
+    assert np.allclose(_vids, vids, atol=1e-6)
+    assert np.array_equal(_colors, colors)
+
+
+def test_jax_backend_x64():
+    x64 = jax.config.jax_enable_x64
+    env = EnvFactory.get_environment("Pendulum", backend="jax", mass=0.5, g=3.0)
+    y0 = initial_states(env, 3)
+    rollouts = simulate(env._vector_field, env._dynamics_params(), y0, 0.05, 10)
+    assert rollouts.dtype == np.float64
+
+    # 64-bit types are only enabled while integrating and rendering
+    env.sample_random_rollouts(number_of_frames=5, number_of_rollouts=2, seed=0)
+    assert jax.config.jax_enable_x64 == x64
+
+
+@pytest.mark.parametrize("color", [True, False])
+def test_render_balls(color):
+    np.random.seed(0)
+    res = 24
+    # Includes overlapping balls, balls partly out of the frame, and a hidden ball
+    centers = np.random.randint(-4, res + 4, size=(2, 5, 3, 2))
+    radii = np.array([3, 0, 5])
+    colors = np.random.random((2, 3, 3))
+    background = [0.2, 0.3, 0.4]
+
+    expected = np.zeros((2, 5, res, res, 3))
+    for b in range(2):
+        for t in range(5):
+            for n in range(3):
+                cv2.circle(
+                    expected[b, t],
+                    tuple(int(c) for c in centers[b, t, n]),
+                    int(radii[n]),
+                    tuple(colors[b, n]),
+                    -1,
+                )
+            expected[b, t] = cv2.blur(cv2.blur(expected[b, t], (2, 2)), (2, 2))
+    expected = np.minimum(expected + background, 1.0)
+    if not color:
+        expected = np.max(expected, axis=-1, keepdims=True)
+
+    vids = render_balls(centers, radii, colors, res, background, color=color)
+    assert vids.dtype == np.float32
+    assert np.allclose(vids, expected, atol=1e-6)
+
+    vids = render_balls(
+        centers, radii, colors, res, background, color=color, dtype=np.uint8
+    )
+    assert vids.dtype == np.uint8
+    assert np.abs(vids.astype(int) - np.round(expected * 255)).max() <= 1
+
+
+@pytest.mark.parametrize("color", [True, False])
+def test_render_balls_torch(color):
+    np.random.seed(0)
+    centers = np.random.randint(-4, 28, size=(2, 5, 3, 2))
+    radii = np.array([[3, 0, 5], [4, -1, 2]])
+    colors = np.random.random((2, 3, 3)).astype(np.float32)
+    background = [0.2, 0.3, 0.4]
+
+    expected = render_balls(centers, radii, colors, 24, background, color=color)
+    vids = render_balls_torch(
+        torch.from_numpy(centers),
+        torch.from_numpy(radii),
+        torch.from_numpy(colors),
+        24,
+        torch.tensor(background),
+        color=color,
+    )
+    # (batch_size, nc, n_frames, res, res) => (batch_size, n_frames, res, res, nc)
+    assert np.allclose(vids.numpy().transpose(0, 2, 3, 4, 1), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("color", [True, False])
+def test_render_balls_jax(color):
+    np.random.seed(0)
+    centers = np.random.randint(-4, 28, size=(2, 5, 3, 2))
+    radii = np.array([[3, 0, 5], [4, -1, 2]])
+    colors = np.random.random((2, 3, 3)).astype(np.float32)
+    background = np.array([0.2, 0.3, 0.4])
+
+    expected = render_balls(centers, radii, colors, 24, background, color=color)
+    vids = render_balls_jax(centers, radii, colors, 24, background, color=color)
+    assert np.allclose(np.asarray(vids), expected, atol=1e-6)
+
+
+@pytest.mark.parametrize("system_name", ["pendulum", "three_body"])
+def test_realtime_dataset_render_scenes(system_name):
+    kwargs = dict(system_name=system_name, num_frames=8, img_size=32, ndim_color=9)
+    dataset = HGNRealtimeDataset(**kwargs)
+    dataset_scenes = HGNRealtimeDataset(**kwargs, render=False)
+    dataset_scenes.system_embedding = dataset.system_embedding
+
+    np.random.seed(0)
+    vid, labels_and_props, colors = dataset[0]
+    np.random.seed(0)
+    scene, _labels_and_props, _colors = dataset_scenes[0]
+
+    scenes = {k: v.unsqueeze(0) for k, v in scene.items()}
+    assert np.allclose(dataset_scenes.render_scenes(scenes)[0].numpy(), vid, atol=1e-6)
+    assert torch.equal(labels_and_props, _labels_and_props)
+    assert torch.equal(colors, _colors)
+
+
+def test_realtime_dataset_stats():
+    dataset = HGNRealtimeDataset(system_name="three_body", num_frames=8, img_size=32)
+    for i in range(3):
+        dataset[i]
+    system_index = dataset.system_names.index("three_body")
+    stats = dataset.stats.get(system_index)
+    assert stats["rollouts"] == 3 and stats["abandoned"] == 0
+    assert stats["solve_time"] > 0
+    assert dataset.stats.summary().startswith("three_body: 3 rollouts")
+
+
+def test_realtime_dataset_integrators():
+    # Chaotic systems are integrated with an adaptive step by default
+    dataset = HGNRealtimeDataset(num_frames=8, img_size=32)
+    assert dataset.integrators == {
+        "mass_spring": "rk4",
+        "pendulum": "rk4",
+        "double_pendulum": "solve_ivp",
+        "two_body": "rk4",
+        "three_body": "solve_ivp",
+    }
+    dataset = HGNRealtimeDataset(num_frames=8, img_size=32, chaotic_integrator=None)
+    assert set(dataset.integrators.values()) == {"rk4"}
+
+
+def test_realtime_dataset_min_separation():
+    # Only the gravity systems reject near collisions
+    dataset = HGNRealtimeDataset(
+        system_name="two_body",
+        num_frames=8,
+        img_size=32,
+        min_separation=1e3,
+        max_attempts=2,
+        max_abandoned=2,
+    )
+    assert dataset.environment_kwargs["two_body"] == {"min_separation": 1e3}
+    assert dataset.environment_kwargs["pendulum"] == {}
+    system_index = dataset.system_names.index("two_body")
+    with pytest.raises(IntegrationBudgetExceeded):
+        dataset._fresh_rollouts(system_index)
+    assert dataset.stats.get(system_index)["rejected"] > 0
+
+
+def test_realtime_dataset_abandoned():
+    # Systems that always exceed their budgets raise instead of being resampled forever
+    dataset = HGNRealtimeDataset(
+        system_name="three_body",
+        num_frames=8,
+        img_size=32,
+        integrator="solve_ivp",
+        max_attempts=1,
+        max_evaluations=1,
+        max_abandoned=3,
+    )
+    with pytest.raises(IntegrationBudgetExceeded):
+        dataset[0]
+    system_index = dataset.system_names.index("three_body")
+    stats = dataset.stats.get(system_index)
+    assert stats["rollouts"] == 0 and stats["abandoned"] == 3
+
+
+def test_realtime_dataset_rollout_cache(tmp_path):
+    kwargs = dict(
+        num_frames=8,
+        total_frames=12,
+        img_size=32,
+        ndim_color=9,
+        system_physics_constant=False,
+        cache_folder=str(tmp_path),
+        cache_size=20,
+        cache_workers=2,
+    )
+    dataset = HGNRealtimeDataset(**kwargs, cache_fresh=0)
+    cache = dataset.cache
+    assert len(cache) == 20 and cache.rollouts.shape[-1] == 12
+    assert os.listdir(tmp_path) == [os.path.basename(cache.path)]
+
+    # The pool is reused, unless it is keyed differently
+    assert HGNRealtimeDataset(**kwargs).cache.path == cache.path
+    assert HGNRealtimeDataset(**kwargs, cache_seed=1).cache.path != cache.path
+
+    for seed in range(10):
+        np.random.seed(seed)
+        np.random.random()  # Whether to use a fresh rollout
+        system_index, system_args, _ = cache.sample(8)
+        np.random.seed(seed)
+        vid, labels_and_props, colors = dataset[0]
+
+        # Physical properties are those of the system the rollout was cached for
+        system_name = cache.system_names[system_index]
+        system = EnvFactory.get_environment(
+            dataset.system_name_mapping[system_name], **system_args
+        )
+        assert vid.shape == (3, 8, 32, 32)
+        assert np.allclose(labels_and_props[3:], system.physical_properties(10))
@@ -15,5 +15,11 @@ def test_experiment():
     # Configuration options can still be accessed by reaching in to the 'config' attribute first
     assert experiment.config.experiment.ndim_epsilon == 5432
 
+    # Without DataLoader workers, batches are not prefetched in a background thread,
+    # which would draw random numbers concurrently with training
+    assert experiment.dataloader.num_workers == 0
+    assert experiment.batches.prefetch == 0
+    experiment.close()
+
     if old_value is not None:
         os.environ["HGAN_EXPERIMENT_NDIM_EPSILON"] = old_value
@@ -0,0 +1,107 @@
+import os
+import numpy as np
+import pytest
+import scipy
+import torch
+from skimage.transform import resize
+from hgan.configuration import load_config
+from hgan.experiment import Experiment
+from hgan.fvd import (
+    ActivationStatistics,
+    activation_statistics,
+    compute_fvd,
+    get_detector,
+    load_statistics,
+    save_statistics,
+    trace_sqrt_product,
+    trace_sqrt_product_torch,
+)
+
+
+def test_i3d_resize():
+    videos = torch.rand(2, 3, 4, 48, 48)
+    detector = get_detector("cpu")
+    assert get_detector("cpu") is detector
+
+    # Same as resizing each frame with skimage
+    expected = np.array(
+        [
+            [resize(frame, (3, 224, 224)) for frame in video]
+            for video in videos.numpy().transpose(0, 2, 1, 3, 4)
+        ]
+    ).transpose(0, 2, 1, 3, 4)
+    assert np.allclose(detector.resize(videos).numpy(), expected, atol=1e-5)
+
+
+def test_fvd_statistics(tmp_path):
+    rng = np.random.default_rng(0)
+    real, fake = rng.normal(size=(64, 8)), rng.normal(1, 2, size=(32, 8))
+    expected = compute_fvd(real_activations=real, generated_activations=fake)
+
+    path = str(tmp_path / "stats" / "mass_spring_96px_30frames.npz")
+    save_statistics(path, *activation_statistics(real), len(real))
+    fvd = compute_fvd(generated_activations=fake, real_statistics=load_statistics(path))
+    assert np.isclose(fvd, expected)
+
+
+def test_real_fvd_statistics_path(tmp_path, monkeypatch):
+    settings = [
+        ("video", "normalize", 1),
+        ("experiment", "rt_data_generator", "dm"),
+        ("experiment", "system_physics_constant", 0),
+        ("experiment", "system_color_constant", 0),
+    ]
+    # Settings that are overridden through environment variables (e.g. by the demo)
+    for section, key, _ in settings + [("experiment", "system_name", None)]:
+        monkeypatch.delenv(f"HGAN_{section}_{key}".upper(), raising=False)
+
+    config = load_config(os.path.join(os.path.dirname(__file__), "../src/hgan"))
+    config.paths.fvd_stats = str(tmp_path)
+    config.paths.output = str(tmp_path)
+    experiment = Experiment(config)
+    path = experiment.real_fvd_statistics_path()
+    assert os.path.basename(path).startswith("mass_spring_96px_30frames_")
+
+    # Statistics are not shared between real videos generated differently
+    paths = {path}
+    for section, key, value in settings:
+        setattr(getattr(config, section), key, value)
+        paths.add(experiment.real_fvd_statistics_path())
+    assert len(paths) == 5
+
+    config.experiment.system_name = None
+    path = experiment.real_fvd_statistics_path()
+    assert os.path.basename(path).startswith("all_systems_96px_30frames_")
+
+
+def test_activation_statistics():
+    rng = np.random.default_rng(0)
+    activations = rng.normal(3, 2, size=(100, 8)).astype(np.float32)
+
+    statistics = ActivationStatistics()
+    for chunk in np.array_split(activations, [1, 17, 17, 60]):
+        statistics.update(chunk)
+
+    mean, sigma = statistics.statistics()
+    expected_mean, expected_sigma = activation_statistics(activations.astype(float))
+    assert statistics.n_samples == 100
+    assert np.allclose(mean, expected_mean)
+    assert np.allclose(sigma, expected_sigma)
+
+
+@pytest.mark.parametrize("n_samples", [16, 256])
+def test_trace_sqrt_product(n_samples):
+    rng = np.random.default_rng(0)
+    sigma, sigma_v = (
+        np.cov(rng.normal(size=(n_samples, 64)) @ rng.normal(size=(64, 64)), rowvar=0)
+        for _ in range(2)
+    )
+
+    # The trace of the root of the product, via the SVD of a symmetric product
+    u, s, vT = scipy.linalg.svd(sigma)
+    sqrt_sigma = u @ np.diag(np.sqrt(s)) @ vT
+    s = scipy.linalg.svdvals(sqrt_sigma @ sigma_v @ sqrt_sigma)
+    expected = np.where(s < 1e-10, s, np.sqrt(s)).sum()
+
+    assert np.isclose(trace_sqrt_product(sigma, sigma_v), expected)
+    assert np.isclose(trace_sqrt_product_torch(sigma, sigma_v), expected)
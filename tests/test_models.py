@@ -0,0 +1,175 @@
+import pytest
+import torch
+from torch._dynamo.exc import TorchDynamoException
+from hgan.models import AnalyticMLP, GRU, HNNPhaseSpace, MLP
+from hgan.utils import compile_forward
+
+
+class SeparableHamiltonian(torch.nn.Module):
+    """H(q, p) = T(p) + V(q), with inputs (label_and_props, q, p)"""
+
+    def __init__(self, ndim_label_and_props, ndim_q):
+        super().__init__()
+        self.ndim_label_and_props = ndim_label_and_props
+        self.ndim_q = ndim_q
+        self.T = MLP(ndim_label_and_props + ndim_q, 32, 1, nonlinearity="tanh")
+        self.V = MLP(ndim_label_and_props + ndim_q, 32, 1, nonlinearity="tanh")
+
+    def forward(self, x):
+        label_and_props, q, p = torch.split(
+            x, [self.ndim_label_and_props, self.ndim_q, self.ndim_q], dim=1
+        )
+        return self.T(torch.cat((label_and_props, p), dim=1)) + self.V(
+            torch.cat((label_and_props, q), dim=1)
+        )
+
+
+def test_fused_leapfrog():
+    torch.manual_seed(0)
+    kwargs = dict(
+        device="cpu", input_size=13, hidden_size=32, output_size=10, ndim_label=3
+    )
+    standard = HNNPhaseSpace(**kwargs)
+    standard.hnn = SeparableHamiltonian(3, 5)
+    fused = HNNPhaseSpace(**kwargs, leapfrog="fused")
+    fused.hnn = SeparableHamiltonian(3, 5)
+    fused.load_state_dict(standard.state_dict())
+
+    calls = {"standard": 0, "fused": 0}
+    for name, model in (("standard", standard), ("fused", fused)):
+        model.hnn.register_forward_hook(
+            lambda *args, name=name: calls.__setitem__(name, calls[name] + 1)
+        )
+
+    noise = torch.randn(8, 13)
+    x, dx = standard(noise, 10)
+    _x, _dx = fused(noise, 10)
+
+    # For separable Hamiltonians, the results are the same as with 3 evaluations per step
+    assert torch.allclose(x, _x, atol=1e-6)
+    assert torch.allclose(dx, _dx, atol=1e-6)
+    assert calls == {"standard": 3 * 9, "fused": 1 + 2 * 9}
+
+    # Biases of the output layer of the Hamiltonian do not affect the dynamics
+    grads = torch.autograd.grad(
+        x.sum() + dx.sum(), standard.parameters(), allow_unused=True
+    )
+    _grads = torch.autograd.grad(
+        _x.sum() + _dx.sum(), fused.parameters(), allow_unused=True
+    )
+    for g, _g in zip(grads, _grads):
+        assert (g is None and _g is None) or torch.allclose(g, _g, atol=1e-5)
+
+
+def test_fused_leapfrog_non_separable():
+    torch.manual_seed(0)
+    kwargs = dict(
+        device="cpu", input_size=13, hidden_size=32, output_size=10, ndim_label=3
+    )
+    # The default Hamiltonian is an MLP of (label_and_props, q, p), not separable
+    standard = HNNPhaseSpace(**kwargs)
+    fused = HNNPhaseSpace(**kwargs, leapfrog="fused")
+    fused.load_state_dict(standard.state_dict())
+
+    noise = torch.randn(8, 13)
+    x, _ = standard(noise, 10)
+    _x, _ = fused(noise, 10)
+
+    # The fused scheme is an approximation, that reuses kicks evaluated at other momenta
+    assert torch.equal(x[0], _x[0])
+    assert not torch.allclose(x[1:], _x[1:], atol=1e-4)
+
+
+@pytest.mark.parametrize("nonlinearity", ["relu", "tanh", "sigmoid", "softplus"])
+def test_analytic_mlp(nonlinearity):
+    torch.manual_seed(0)
+    mlp = AnalyticMLP(7, 16, 1, nonlinearity=nonlinearity)
+    x = torch.randn(5, 7, requires_grad=True)
+
+    energy, dx = mlp.energy_and_grad(x)
+    expected = mlp(x)
+    (expected_dx,) = torch.autograd.grad(expected.sum(), x)
+
+    assert torch.allclose(energy, expected)
+    assert torch.allclose(dx, expected_dx, atol=1e-6)
+
+
+def test_analytic_energy():
+    torch.manual_seed(0)
+    kwargs = dict(
+        device="cpu",
+        input_size=13,
+        hidden_size=32,
+        output_size=10,
+        ndim_label=3,
+        leapfrog="fused",
+    )
+    model = HNNPhaseSpace(**kwargs)
+    analytic = HNNPhaseSpace(**kwargs, energy="analytic")
+    analytic.load_state_dict(model.state_dict())
+
+    noise = torch.randn(8, 13)
+    x, dx = model(noise, 10)
+    _x, _dx = analytic(noise, 10)
+
+    assert torch.allclose(x, _x, atol=1e-5)
+    assert torch.allclose(dx, _dx, atol=1e-5)
+
+    grads = torch.autograd.grad(
+        x.sum() + dx.sum(), model.parameters(), allow_unused=True
+    )
+    _grads = torch.autograd.grad(
+        _x.sum() + _dx.sum(), analytic.parameters(), allow_unused=True
+    )
+    for param, g, _g in zip(model.parameters(), grads, _grads):
+        # Parameters that the dynamics do not depend on may have no gradient at all
+        g = torch.zeros_like(param) if g is None else g
+        _g = torch.zeros_like(param) if _g is None else _g
+        assert torch.allclose(g, _g, atol=1e-4)
+
+
+def test_compile_forward():
+    torch.manual_seed(0)
+    gru = GRU("cpu", input_size=6, hidden_size=8)
+    gru.initWeight()
+    eps = torch.randn(4, 6)
+
+    gru.initHidden(4)
+    expected = gru(eps, 5)
+    compile_forward(gru)
+    gru.initHidden(4)
+    assert torch.allclose(gru(eps, 5), expected, atol=1e-5)
+
+
+def test_compile_forward_fallback(monkeypatch):
+    def failing_compile(*args, **kwargs):
+        def forward(*args, **kwargs):
+            raise TorchDynamoException("unsupported")
+
+        return forward
+
+    monkeypatch.setattr(torch, "compile", failing_compile)
+    mlp = MLP(3, 4, 1)
+    x = torch.randn(2, 3)
+    expected = mlp(x)
+    compile_forward(mlp)
+    assert torch.equal(mlp(x), expected)
+
+
+def test_compile_forward_raises(monkeypatch):
+    calls = []
+
+    def failing_compile(*args, **kwargs):
+        def forward(*args, **kwargs):
+            calls.append(1)
+            raise ValueError("not a compilation error")
+
+        return forward
+
+    monkeypatch.setattr(torch, "compile", failing_compile)
+    mlp = compile_forward(MLP(3, 4, 1))
+    # Errors other than compilation errors are not hidden by falling back to eager
+    for _ in range(2):
+        with pytest.raises(ValueError, match="not a compilation error"):
+            mlp(torch.randn(2, 3))
+    assert len(calls) == 2
@@ -0,0 +1,133 @@
+import pytest
+import torch
+from hgan.updates import bp_i, bp_v, lazy_r1_gamma, r1_loss, update_Di, update_G
+from hgan.utils import MixedPrecision
+
+
+class Discriminator(torch.nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.conv = torch.nn.Conv3d(3, 4, 3)
+        self.linear = torch.nn.Linear(4, 1)
+
+    def forward(self, x, label_props_colors):
+        h = self.conv(x).mean(dim=(2, 3, 4))
+        return torch.sigmoid(self.linear(h)).squeeze(1)
+
+
+@pytest.mark.parametrize("dtype", [None, "bf16"])
+def test_bp_v_amp(dtype):
+    torch.manual_seed(0)
+    dis_v = Discriminator()
+    amp = MixedPrecision(dtype)
+
+    err, outputs = bp_v(
+        label=torch.FloatTensor(),
+        criterion=torch.nn.BCELoss(),
+        dis_v=dis_v,
+        inputs=torch.randn(2, 3, 4, 8, 8),
+        label_props_colors=None,
+        y=0.9,
+        amp=amp,
+    )
+    assert outputs.dtype == (torch.float32 if dtype is None else torch.bfloat16)
+    assert all(p.grad.dtype == torch.float32 for p in dis_v.parameters())
+
+
+def test_r1_loss_amp():
+    torch.manual_seed(0)
+    dis_v = Discriminator()
+    inputs = torch.randn(2, 3, 4, 8, 8, requires_grad=True)
+
+    penalty = r1_loss(10, dis_v(inputs, None), inputs)
+    expected_grads = [p.grad.clone() for p in dis_v.parameters()]
+    dis_v.zero_grad()
+
+    # With loss scaling, the penalty is the same, and gradients are scaled
+    amp = MixedPrecision("fp16")
+    amp.scaler = torch.amp.GradScaler("cpu", init_scale=2.0**10)
+    scaled_penalty = r1_loss(10, dis_v(inputs, None), inputs, amp=amp)
+
+    assert torch.allclose(scaled_penalty, penalty)
+    for p, expected in zip(dis_v.parameters(), expected_grads):
+        assert torch.allclose(p.grad / 2.0**10, expected, atol=1e-6)
+
+
+def test_lazy_r1():
+    assert [lazy_r1_gamma(10, 1, step) for step in range(1, 5)] == [10, 10, 10, 10]
+    lazy = [lazy_r1_gamma(10, 4, step) for step in range(1, 9)]
+    assert lazy == [0, 0, 0, 40, 0, 0, 0, 40]
+
+
+class ImageDiscriminator(Discriminator):
+    def forward(self, x, label_props_colors):
+        return super().forward(x.unsqueeze(2).expand(-1, -1, 3, -1, -1), None)
+
+
+@pytest.mark.parametrize("r1_gamma", [0, 10])
+def test_update_di_r1(r1_gamma):
+    torch.manual_seed(0)
+    dis_i = ImageDiscriminator()
+    real_data = {
+        "img": torch.randn(2, 3, 8, 8),
+        "label_and_props": torch.zeros(2, 1),
+        "colors": torch.zeros(2, 3),
+    }
+    err, _ = update_Di(
+        rnn_type="hnn_phase_space",
+        label=torch.FloatTensor(),
+        criterion=torch.nn.BCELoss(),
+        r1_gamma=r1_gamma,
+        dis_i=dis_i,
+        real_data=real_data,
+        fake_data={"img": torch.randn(2, 3, 8, 8)},
+        optim_Di=torch.optim.SGD(dis_i.parameters(), lr=0),
+    )
+
+    # Without a penalty, no gradients wrt the real images are needed
+    assert real_data["img"].requires_grad == (r1_gamma != 0)
+    assert (err["Di"] > err["Di_real"] + err["Di_fake"]) == (r1_gamma != 0)
+
+
+def test_update_g():
+    torch.manual_seed(0)
+    dis_v, dis_i = Discriminator(), ImageDiscriminator()
+    model_rnn = torch.nn.Linear(6, 6)
+    model_gi = torch.nn.Linear(6, 3 * 8 * 8)
+    z = model_rnn(torch.randn(2, 4, 6))
+    videos = model_gi(z).view(2, 4, 3, 8, 8).transpose(2, 1)
+    fake_data = {"videos": videos, "img": videos[:, :, 1], "dlatent": z}
+    kwargs = dict(label=torch.FloatTensor(), criterion=torch.nn.BCELoss(), y=0.9)
+
+    # One backward per loss, retaining the graph in between
+    bp_v(dis_v=dis_v, inputs=videos, label_props_colors=None, retain=True, **kwargs)
+    bp_i(
+        dis_i=dis_i,
+        inputs=videos[:, :, 1],
+        label_props_colors=None,
+        retain=True,
+        **kwargs
+    )
+    (torch.sum(torch.abs(z[:, :, 3:])) / 2 * 0.5).backward(retain_graph=True)
+    params = (*model_gi.parameters(), *model_rnn.parameters())
+    expected = [p.grad.clone() for p in params]
+
+    err = update_G(
+        rnn_type="hnn_phase_space",
+        label=torch.FloatTensor(),
+        criterion=torch.nn.BCELoss(),
+        q_size=3,
+        batch_size=2,
+        cyclic_coord_loss=0.5,
+        model_di=dis_i,
+        model_dv=dis_v,
+        model_gi=model_gi,
+        model_rnn=model_rnn,
+        fake_data=fake_data,
+        optim_Gi=torch.optim.SGD(model_gi.parameters(), lr=0),
+        optim_RNN=torch.optim.SGD(model_rnn.parameters(), lr=0),
+        label_props_colors=None,
+    )
+    assert set(err) == {"Gv", "Gi"}
+    for p, g in zip(params, expected):
+        assert torch.allclose(p.grad, g, atol=1e-6)
@@ -0,0 +1,17 @@
+import numpy as np
+from hgan.utils import VideoSink
+
+
+def test_video_sink():
+    written = []
+    sink = VideoSink(lambda folder, video, epoch: written.append((epoch, video)))
+
+    video = np.zeros((4, 8, 8, 3))
+    for epoch in range(3):
+        video[:] = epoch
+        sink.submit("folder", video, epoch=epoch)
+    sink.close()
+
+    # Frames are copied when submitted, and all videos are written on close
+    assert [epoch for epoch, _ in written] == [0, 1, 2]
+    assert all((v == epoch).all() for epoch, v in written)